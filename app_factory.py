@@ -2,7 +2,7 @@ import os
 from flask import Flask
 from dotenv import load_dotenv
 
-from extensions import db, login_manager, migrate, csrf, mail
+from extensions import db, login_manager, migrate, csrf, mail, buzon, stats_cache, identidades, claves, sesiones, trabajos
 
 load_dotenv()
 
@@ -47,13 +47,18 @@ def create_app():
     # =========================
     app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
     app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", 587))
-    app.config["MAIL_USE_TLS"] = True
+    # Desactivar TLS sólo para un SMTP local de pruebas (python -m aiosmtpd -n -l localhost:1025)
+    app.config["MAIL_USE_TLS"] = os.environ.get("MAIL_USE_TLS", "true").lower() not in ("0", "false", "no")
     app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME")
     app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD")
     app.config["MAIL_DEFAULT_SENDER"] = os.environ.get(
         "MAIL_DEFAULT_SENDER",
         "noreply@sitex.com"
     )
+    # Bandeja de salida: lote por conexión SMTP y reintentos con espera exponencial
+    app.config["MAIL_LOTE"] = int(os.environ.get("MAIL_LOTE", 50))
+    app.config["MAIL_MAX_INTENTOS"] = int(os.environ.get("MAIL_MAX_INTENTOS", 6))
+    app.config["MAIL_REINTENTO_BASE"] = int(os.environ.get("MAIL_REINTENTO_BASE", 30))
 
     # =========================
     # Uploads
@@ -64,6 +69,59 @@ def create_app():
         "png", "jpg", "jpeg", "gif", "pdf"
     }
 
+    # =========================
+    # Contraseñas (costo de bcrypt)
+    # =========================
+    app.config["BCRYPT_ROUNDS"] = int(os.environ.get("BCRYPT_ROUNDS", 12))
+    # Hashes simultáneos por proceso; el resto espera turno o recibe "servidor ocupado"
+    app.config["BCRYPT_MAX_CONCURRENTES"] = int(os.environ.get("BCRYPT_MAX_CONCURRENTES", os.cpu_count() or 2))
+    app.config["BCRYPT_ESPERA"] = int(os.environ.get("BCRYPT_ESPERA", 5))
+    # Intentos fallidos de login permitidos por ventana (segundos)
+    app.config["LOGIN_MAX_INTENTOS_USUARIO"] = int(os.environ.get("LOGIN_MAX_INTENTOS_USUARIO", 5))
+    app.config["LOGIN_MAX_INTENTOS_IP"] = int(os.environ.get("LOGIN_MAX_INTENTOS_IP", 50))
+    app.config["LOGIN_VENTANA"] = int(os.environ.get("LOGIN_VENTANA", 900))
+
+    # =========================
+    # Caché de estadísticas
+    # =========================
+    app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "memoria")  # memoria | archivo | redis
+    app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", 300))
+    app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("CACHE_MAX_ENTRIES", 256))
+    if os.environ.get("CACHE_DIR"):
+        app.config["CACHE_DIR"] = os.environ["CACHE_DIR"]
+    app.config["CACHE_REDIS_URL"] = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    # Identidad del usuario en sesión: TTL corto para que una baja se note en segundos
+    app.config["IDENTIDAD_TTL"] = int(os.environ.get("IDENTIDAD_TTL", 30))
+
+    # =========================
+    # Sesiones activas (latidos en memoria, volcado por lotes)
+    # =========================
+    app.config["SESIONES_INTERVALO"] = int(os.environ.get("SESIONES_INTERVALO", 60))
+    app.config["SESIONES_INACTIVIDAD_HORAS"] = int(os.environ.get("SESIONES_INACTIVIDAD_HORAS", 12))
+    app.config["SESIONES_RETENCION_DIAS"] = int(os.environ.get("SESIONES_RETENCION_DIAS", 30))
+
+    # =========================
+    # Trabajos en segundo plano y reportes
+    # =========================
+    app.config["TRABAJOS_PROCESOS"] = int(os.environ.get("TRABAJOS_PROCESOS", 2))
+    app.config["TRABAJOS_HILOS"] = int(os.environ.get("TRABAJOS_HILOS", 2))
+    app.config["TRABAJOS_CPU"] = int(os.environ.get("TRABAJOS_CPU", os.cpu_count() or 1))
+    # Segundos sin renovarse tras los que un trabajo activo se da por interrumpido
+    app.config["TRABAJOS_EXPIRACION"] = int(os.environ.get("TRABAJOS_EXPIRACION", 900))
+    app.config["REPORTES_DIR"] = os.environ.get(
+        "REPORTES_DIR",
+        os.path.join(app.instance_path, "reportes")
+    )
+    app.config["EXPORTS_DIR"] = os.environ.get(
+        "EXPORTS_DIR",
+        os.path.join(app.instance_path, "exports")
+    )
+    app.config["EXPORTS_RETENCION_HORAS"] = int(os.environ.get("EXPORTS_RETENCION_HORAS", 24))
+    app.config["CARGAS_DIR"] = os.environ.get(
+        "CARGAS_DIR",
+        os.path.join(app.instance_path, "cargas")
+    )
+
     # =========================
     # Inicializar extensiones
     # =========================
@@ -72,6 +130,12 @@ def create_app():
     migrate.init_app(app, db)
     csrf.init_app(app)
     mail.init_app(app)
+    buzon.init_app(app)
+    stats_cache.init_app(app)
+    identidades.init_app(app)
+    claves.init_app(app)
+    sesiones.init_app(app)
+    trabajos.init_app(app)
 
     # =========================
     # Login manager
@@ -81,11 +145,11 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        from models import Empleado
-        empleado = db.session.get(Empleado, int(user_id))
-        if empleado and not empleado.activo:
+        # Snapshot cacheado: sin consulta a empleado en cada petición
+        principal = identidades.obtener(int(user_id))
+        if principal and not principal.activo:
             return None
-        return empleado
+        return principal
 
     # =========================
     # Blueprints
@@ -104,6 +168,12 @@ def create_app():
     app.register_blueprint(medicion_bp)
     app.register_blueprint(admin_bp)
 
+    # =========================
+    # Comandos CLI
+    # =========================
+    from comandos import register_commands
+    register_commands(app)
+
     # =========================
     # Seguridad básica headers
     # =========================
@@ -0,0 +1,156 @@
+# autenticacion.py - Servicio de contraseñas: hash acotado y límite de intentos de login
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeout
+
+import contrasenas
+from cache import MemoriaBackend, crear_backend, _SIN_VALOR
+
+
+class ServicioOcupado(Exception):
+    """No hay cupo para otro hash dentro del tiempo de espera"""
+    pass
+
+
+class LimitadorIntentos:
+    """Intentos fallidos de login por IP y por usuario en una ventana deslizante.
+
+    Si cualquiera de los dos supera su límite, el login se rechaza antes de
+    calcular el hash, así una ráfaga de contraseñas malas no ocupa CPU. Con
+    backend "archivo" o "redis" los contadores se comparten entre workers.
+    """
+
+    def __init__(self, backend=None, max_por_usuario=5, max_por_ip=50, ventana=900):
+        self.backend = backend or MemoriaBackend(4096)
+        self.max_por_usuario = max_por_usuario
+        self.max_por_ip = max_por_ip
+        self.ventana = ventana
+
+    def _claves(self, ip, usuario):
+        claves = []
+        if ip:
+            claves.append((f"ip:{ip}", self.max_por_ip))
+        if usuario:
+            claves.append((f"usuario:{usuario.strip().lower()}", self.max_por_usuario))
+        return claves
+
+    def _recientes(self, clave, ahora):
+        try:
+            marcas = self.backend.get(clave)
+        except Exception as e:
+            print(f"Error leyendo intentos de login: {e}")
+            return []
+        if marcas is _SIN_VALOR:
+            return []
+        return [marca for marca in marcas if marca > ahora - self.ventana]
+
+    def bloqueado(self, ip, usuario):
+        """Segundos que faltan para poder intentar de nuevo (0 si no está bloqueado)"""
+        ahora = time.time()
+        espera = 0
+        for clave, limite in self._claves(ip, usuario):
+            marcas = self._recientes(clave, ahora)
+            if len(marcas) >= limite:
+                # Se libera cuando el intento más viejo que cuenta sale de la ventana
+                espera = max(espera, marcas[-limite] + self.ventana - ahora)
+        return int(espera) + 1 if espera else 0
+
+    def fallo(self, ip, usuario):
+        ahora = time.time()
+        for clave, limite in self._claves(ip, usuario):
+            marcas = self._recientes(clave, ahora)[-(limite - 1):] if limite > 1 else []
+            marcas.append(ahora)
+            try:
+                self.backend.set(clave, marcas, self.ventana)
+            except Exception as e:
+                print(f"Error guardando intentos de login: {e}")
+
+    def exito(self, usuario):
+        """Un login correcto limpia el contador del usuario (no el de la IP, que puede ser compartida)"""
+        for clave, _ in self._claves(None, usuario):
+            try:
+                self.backend.delete(clave)
+            except Exception as e:
+                print(f"Error limpiando intentos de login: {e}")
+
+
+class ServicioContrasenas:
+    """Hash y verificación de contraseñas en un pool acotado de hilos.
+
+    bcrypt libera el GIL, así que el pool limita cuántos hashes corren a la
+    vez en el proceso; las peticiones que no consiguen turno dentro de
+    ``BCRYPT_ESPERA`` segundos (o encuentran la cola llena) reciben
+    ServicioOcupado en lugar de apilarse sobre la CPU.
+    """
+
+    def __init__(self, app=None):
+        self.rondas = contrasenas.RONDAS_POR_DEFECTO
+        self.max_concurrentes = os.cpu_count() or 2
+        self.max_cola = 4 * self.max_concurrentes
+        self.espera = 5
+        self.intentos = LimitadorIntentos()
+        self._executor = None
+        self._cupos = threading.BoundedSemaphore(self.max_cola)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_ROUNDS", contrasenas.RONDAS_POR_DEFECTO)
+        app.config.setdefault("BCRYPT_MAX_CONCURRENTES", os.cpu_count() or 2)
+        app.config.setdefault("BCRYPT_MAX_COLA", 4 * app.config["BCRYPT_MAX_CONCURRENTES"])
+        app.config.setdefault("BCRYPT_ESPERA", 5)
+        app.config.setdefault("LOGIN_MAX_INTENTOS_USUARIO", 5)
+        app.config.setdefault("LOGIN_MAX_INTENTOS_IP", 50)
+        app.config.setdefault("LOGIN_VENTANA", 900)
+
+        self.rondas = app.config["BCRYPT_ROUNDS"]
+        self.max_concurrentes = app.config["BCRYPT_MAX_CONCURRENTES"]
+        self.max_cola = app.config["BCRYPT_MAX_COLA"]
+        self.espera = app.config["BCRYPT_ESPERA"]
+        self._cupos = threading.BoundedSemaphore(self.max_cola)
+        self.intentos = LimitadorIntentos(
+            crear_backend(app, "intentos", 4096),
+            max_por_usuario=app.config["LOGIN_MAX_INTENTOS_USUARIO"],
+            max_por_ip=app.config["LOGIN_MAX_INTENTOS_IP"],
+            ventana=app.config["LOGIN_VENTANA"],
+        )
+        app.extensions["contrasenas"] = self
+
+    def _pool(self):
+        # Perezoso: no crear hilos en procesos que nunca verifican contraseñas
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrentes, thread_name_prefix="bcrypt"
+                    )
+        return self._executor
+
+    def _ejecutar(self, funcion, *args):
+        if not self._cupos.acquire(blocking=False):
+            raise ServicioOcupado("Demasiadas verificaciones de contraseña en cola")
+        try:
+            futuro = self._pool().submit(funcion, *args)
+            try:
+                return futuro.result(timeout=self.espera)
+            except FuturoTimeout:
+                if futuro.cancel():
+                    raise ServicioOcupado("Tiempo de espera agotado para verificar la contraseña")
+                # Ya estaba calculando: esperar el resultado en lugar de desperdiciarlo
+                return futuro.result()
+        finally:
+            self._cupos.release()
+
+    def hashear(self, password):
+        return self._ejecutar(contrasenas.hashear, password, self.rondas)
+
+    def verificar(self, password, hash_guardado):
+        if not hash_guardado:
+            return False
+        return self._ejecutar(contrasenas.verificar, password, hash_guardado)
+
+    def necesita_rehash(self, hash_guardado):
+        """El hash se generó con un costo distinto del configurado"""
+        return contrasenas.necesita_rehash(hash_guardado, self.rondas)
@@ -0,0 +1,293 @@
+# cache.py - Caché de resultados de estadísticas con invalidación por escritura
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Grupos de datos cacheados que se invalidan cuando cambian estos modelos
+GRUPOS_POR_MODELO = {
+    'RegistroMedida': ('estadisticas', 'dashboard', 'reportes'),
+    'MedicionCargue': ('estadisticas', 'dashboard', 'reportes'),
+    'Descargue': ('estadisticas', 'dashboard', 'reportes'),
+    'Tanque': ('estadisticas', 'dashboard', 'reportes'),
+    'Venta': ('dashboard', 'reportes'),
+}
+
+_SIN_VALOR = object()
+
+
+# ============= BACKENDS =============
+
+class MemoriaBackend:
+    """Caché en el proceso con TTL y expulsión LRU"""
+
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return _SIN_VALOR
+            expira, valor = entrada
+            if expira and expira < time.time():
+                del self._datos[clave]
+                return _SIN_VALOR
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (time.time() + ttl if ttl else None, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def generacion(self, grupo):
+        with self._lock:
+            return self._generaciones.get(grupo, 0)
+
+    def incr(self, grupo):
+        with self._lock:
+            self._generaciones[grupo] = self._generaciones.get(grupo, 0) + 1
+            return self._generaciones[grupo]
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class ArchivoBackend:
+    """Caché en disco compartida entre workers (un archivo pickle por clave)"""
+
+    def __init__(self, directorio, max_entradas=256):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, hashlib.sha1(clave.encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                expira, valor = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError):
+            return _SIN_VALOR
+        if expira and expira < time.time():
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+            return _SIN_VALOR
+        os.utime(ruta)  # el mtime marca el último uso (LRU)
+        return valor
+
+    def set(self, clave, valor, ttl):
+        fd, temporal = tempfile.mkstemp(dir=self.directorio)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + ttl if ttl else None, valor), f)
+        os.replace(temporal, self._ruta(clave))
+        self._expulsar()
+
+    def delete(self, clave):
+        try:
+            os.remove(self._ruta(clave))
+        except OSError:
+            pass
+
+    def _ruta_generacion(self, grupo):
+        # Fuera del conteo LRU: perder una generación podría revivir entradas viejas
+        return os.path.join(self.directorio, f"{grupo}.gen")
+
+    def generacion(self, grupo):
+        try:
+            with open(self._ruta_generacion(grupo), 'r') as f:
+                return f.read().strip() or '0'
+        except OSError:
+            return '0'
+
+    def incr(self, grupo):
+        # Basta con un valor distinto al anterior en cualquier worker
+        valor = str(time.time_ns())
+        fd, temporal = tempfile.mkstemp(dir=self.directorio)
+        with os.fdopen(fd, 'w') as f:
+            f.write(valor)
+        os.replace(temporal, self._ruta_generacion(grupo))
+        return valor
+
+    def _expulsar(self):
+        archivos = [os.path.join(self.directorio, a) for a in os.listdir(self.directorio) if a.endswith('.cache')]
+        if len(archivos) <= self.max_entradas:
+            return
+        archivos.sort(key=lambda a: os.path.getmtime(a) if os.path.exists(a) else 0)
+        for ruta in archivos[:len(archivos) - self.max_entradas]:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+    def clear(self):
+        for archivo in os.listdir(self.directorio):
+            if archivo.endswith('.cache'):
+                try:
+                    os.remove(os.path.join(self.directorio, archivo))
+                except OSError:
+                    pass
+
+
+class RedisBackend:
+    """Caché en un servidor compatible con Redis (TTL nativo, LRU vía maxmemory-policy)"""
+
+    def __init__(self, url=None, cliente=None, prefijo='sitex:'):
+        if cliente is None:
+            import redis
+            cliente = redis.Redis.from_url(url)
+        self.cliente = cliente
+        self.prefijo = prefijo
+
+    def get(self, clave):
+        data = self.cliente.get(self.prefijo + clave)
+        if data is None:
+            return _SIN_VALOR
+        return pickle.loads(data)
+
+    def set(self, clave, valor, ttl):
+        data = pickle.dumps(valor)
+        if ttl:
+            self.cliente.setex(self.prefijo + clave, int(ttl), data)
+        else:
+            self.cliente.set(self.prefijo + clave, data)
+
+    def delete(self, clave):
+        self.cliente.delete(self.prefijo + clave)
+
+    def generacion(self, grupo):
+        return int(self.cliente.get(f"{self.prefijo}gen:{grupo}") or 0)
+
+    def incr(self, grupo):
+        return self.cliente.incr(f"{self.prefijo}gen:{grupo}")
+
+    def clear(self):
+        for clave in self.cliente.scan_iter(self.prefijo + '*'):
+            self.cliente.delete(clave)
+
+
+def crear_backend(app, nombre=None, max_entradas=None):
+    """Backend según CACHE_BACKEND; ``nombre`` separa su espacio de claves del de estadísticas"""
+    tipo = app.config.get("CACHE_BACKEND", "memoria")
+    max_entradas = max_entradas or app.config.get("CACHE_MAX_ENTRIES", 256)
+    if tipo == "archivo":
+        directorio = app.config.get("CACHE_DIR", os.path.join(app.instance_path, "cache"))
+        return ArchivoBackend(os.path.join(directorio, nombre) if nombre else directorio, max_entradas)
+    if tipo == "redis":
+        prefijo = f"sitex:{nombre}:" if nombre else "sitex:"
+        return RedisBackend(app.config.get("CACHE_REDIS_URL", "redis://localhost:6379/0"), prefijo=prefijo)
+    return MemoriaBackend(max_entradas)
+
+
+# ============= CACHÉ DE LA APLICACIÓN =============
+
+class StatsCache:
+    """Caché de estadísticas con claves versionadas por grupo.
+
+    Invalidar un grupo incrementa su generación; las entradas viejas dejan
+    de ser alcanzables y expiran por TTL/LRU. Con backend de archivo o Redis
+    la generación se comparte entre todos los workers.
+    """
+
+    def __init__(self, app=None):
+        self.backend = MemoriaBackend()
+        self.ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_BACKEND", "memoria")  # memoria | archivo | redis
+        app.config.setdefault("CACHE_TTL", 300)
+        app.config.setdefault("CACHE_MAX_ENTRIES", 256)
+        app.config.setdefault("CACHE_DIR", os.path.join(app.instance_path, "cache"))
+        app.config.setdefault("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+        # "memoria" invalida sólo en el proceso actual; los demás workers
+        # se ponen al día por TTL. "archivo" y "redis" comparten generaciones.
+        self.backend = crear_backend(app)
+        self.ttl = app.config["CACHE_TTL"]
+
+        _registrar_invalidacion(self)
+        app.extensions["stats_cache"] = self
+
+    def obtener(self, grupo, clave, calcular, ttl=None):
+        """Devolver el valor cacheado o calcularlo y guardarlo"""
+        try:
+            clave_completa = f"{grupo}:{self.backend.generacion(grupo)}:{clave}"
+            valor = self.backend.get(clave_completa)
+        except Exception as e:
+            print(f"Error leyendo caché: {e}")
+            return calcular()
+        if valor is not _SIN_VALOR:
+            return valor
+
+        valor = calcular()
+        try:
+            self.backend.set(clave_completa, valor, ttl if ttl is not None else self.ttl)
+        except Exception as e:
+            print(f"Error guardando caché: {e}")
+        return valor
+
+    def invalidar(self, *grupos):
+        for grupo in grupos:
+            try:
+                self.backend.incr(grupo)
+            except Exception as e:
+                print(f"Error invalidando caché ({grupo}): {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+
+def marcar_invalidacion(session, *modelos):
+    """Invalidar al hacer commit los grupos de ``modelos`` (nombres de clase).
+
+    Para escrituras con Core (insert/update masivos) que no pasan por el flush del ORM.
+    """
+    pendientes = session.info.setdefault("cache_invalidar", set())
+    for modelo in modelos:
+        pendientes.update(GRUPOS_POR_MODELO.get(modelo, ()))
+
+
+def _registrar_invalidacion(stats_cache):
+    """Invalidar grupos tras el commit de cambios en los modelos relevantes"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    if getattr(stats_cache, "_eventos_registrados", False):
+        return
+    stats_cache._eventos_registrados = True
+
+    @event.listens_for(Session, "after_flush")
+    def _marcar(session, flush_context):
+        pendientes = session.info.setdefault("cache_invalidar", set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            pendientes.update(GRUPOS_POR_MODELO.get(type(obj).__name__, ()))
+
+    @event.listens_for(Session, "after_commit")
+    def _invalidar(session):
+        pendientes = session.info.pop("cache_invalidar", None)
+        if pendientes:
+            stats_cache.invalidar(*pendientes)
+
+    @event.listens_for(Session, "after_rollback")
+    def _descartar(session):
+        session.info.pop("cache_invalidar", None)
@@ -0,0 +1,265 @@
+# calibracion.py - Conversión cm → galones (tablas de aforo + fórmula geométrica)
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from extensions import db
+
+# 1 galón = 3785.411784 cm³
+CM3_POR_GALON = 3785.411784
+RADIO_ESTANDAR_CM = 125.0  # 2.5m de diámetro
+
+# Tablas compiladas: {(id_tanques, version): (alturas_cm, galones)}
+_tablas_compiladas = {}
+# Versión activa por tanque: {id_tanques: (version o None, vence)}
+_versiones = {}
+_lock = threading.Lock()
+
+# Segundos que se confía en la versión activa cacheada. En este proceso una
+# tabla nueva se ve al hacer commit; en los demás workers, al vencer el TTL.
+VERSIONES_TTL = 30
+
+
+class TablaCalibracionError(ValueError):
+    """Error de formato en una tabla de aforo subida"""
+
+
+# ============= FÓRMULA GEOMÉTRICA (RESPALDO) =============
+
+def cm_a_galones_geometrico(alturas_cm, radio_cm=RADIO_ESTANDAR_CM):
+    """Cilindro vertical: V = π * r² * h, vectorizado sobre un array de alturas"""
+    radio = radio_cm or RADIO_ESTANDAR_CM
+    alturas = np.asarray(alturas_cm, dtype=float)
+    if radio <= 0:
+        return np.zeros_like(alturas)
+    return np.pi * radio ** 2 * alturas / CM3_POR_GALON
+
+
+def calcular_altura_maxima(capacidad_galones, radio_cm=RADIO_ESTANDAR_CM):
+    """Calcular altura máxima en cm basada en capacidad del tanque"""
+    volumen_cm3 = (capacidad_galones or 0) * CM3_POR_GALON
+    area_base = np.pi * (radio_cm ** 2)
+    return round(float(volumen_cm3 / area_base), 2)
+
+
+# ============= TABLAS DE AFORO =============
+
+def leer_tabla(file):
+    """Leer un CSV/Excel con columnas altura_cm y galones → arrays ordenados"""
+    nombre = (getattr(file, 'filename', '') or '').lower()
+    if nombre.endswith('.csv'):
+        df = pd.read_csv(file, sep=',', decimal='.', encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(file)
+
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    if not {'altura_cm', 'galones'} <= set(df.columns):
+        raise TablaCalibracionError("Faltan columnas: altura_cm, galones")
+
+    alturas = pd.to_numeric(df['altura_cm'].astype(str).str.replace(',', '.'), errors='coerce')
+    galones = pd.to_numeric(df['galones'].astype(str).str.replace(',', '.'), errors='coerce')
+    invalidas = alturas.isna() | galones.isna()
+    if invalidas.any():
+        filas = ", ".join(str(i + 2) for i in df.index[invalidas][:5])
+        raise TablaCalibracionError(f"Valores no numéricos en filas: {filas}")
+
+    tabla = pd.DataFrame({'altura_cm': alturas, 'galones': galones}).sort_values('altura_cm')
+    if len(tabla) < 2:
+        raise TablaCalibracionError("La tabla debe tener al menos 2 filas")
+    if tabla['altura_cm'].duplicated().any():
+        raise TablaCalibracionError("Hay alturas repetidas en la tabla")
+    if (tabla['altura_cm'] < 0).any() or (tabla['galones'] < 0).any():
+        raise TablaCalibracionError("La tabla no puede tener valores negativos")
+    if not tabla['galones'].is_monotonic_increasing:
+        raise TablaCalibracionError("Los galones deben crecer con la altura")
+
+    return tabla['altura_cm'].to_numpy(dtype=float), tabla['galones'].to_numpy(dtype=float)
+
+
+def serializar(array):
+    """Guardar un array como bytes float64 (columna LargeBinary)"""
+    return np.asarray(array, dtype='<f8').tobytes()
+
+
+def deserializar(data):
+    return np.frombuffer(data, dtype='<f8')
+
+
+def compilar(tabla):
+    """Obtener (alturas, galones) de una TablaCalibracion, usando la caché por versión"""
+    clave = (tabla.id_tanques, tabla.version)
+    with _lock:
+        compilada = _tablas_compiladas.get(clave)
+    if compilada is None:
+        compilada = (deserializar(tabla.alturas_cm), deserializar(tabla.galones))
+        with _lock:
+            _tablas_compiladas[clave] = compilada
+    return compilada
+
+
+def versiones_activas(ids_tanques):
+    """{id_tanques: version} de las tablas activas; sólo consulta los tanques sin versión vigente en caché.
+
+    También se cachea que un tanque no tiene tabla (usa la fórmula), así la
+    conversión de un tanque sin aforo tampoco va a la BD.
+    """
+    from models import TablaCalibracion
+    ids_tanques = [int(t) for t in ids_tanques]
+    if not ids_tanques:
+        return {}
+    ahora = time.monotonic()
+    with _lock:
+        vigentes = {t: _versiones[t][0] for t in ids_tanques if t in _versiones and _versiones[t][1] > ahora}
+    faltantes = [t for t in ids_tanques if t not in vigentes]
+    if faltantes:
+        filas = db.session.query(TablaCalibracion.id_tanques, TablaCalibracion.version).filter(
+            TablaCalibracion.id_tanques.in_(faltantes),
+            TablaCalibracion.activa.is_(True)
+        ).all()
+        encontradas = {id_tanques: version for id_tanques, version in filas}
+        vence = ahora + VERSIONES_TTL
+        with _lock:
+            for t in faltantes:
+                vigentes[t] = encontradas.get(t)
+                _versiones[t] = (vigentes[t], vence)
+    return {t: version for t, version in vigentes.items() if version is not None}
+
+
+def tablas_activas(ids_tanques):
+    """{id_tanques: (alturas, galones)}; sólo lee los arrays de versiones no cacheadas"""
+    from models import TablaCalibracion
+    versiones = versiones_activas(ids_tanques)
+    with _lock:
+        faltantes = [(t, v) for t, v in versiones.items() if (t, v) not in _tablas_compiladas]
+    if faltantes:
+        tablas = TablaCalibracion.query.filter(
+            TablaCalibracion.id_tanques.in_([t for t, _ in faltantes]),
+            TablaCalibracion.activa.is_(True)
+        ).all()
+        for tabla in tablas:
+            # Lo que acaba de leer la BD manda sobre una versión cacheada que ya cambió
+            versiones[tabla.id_tanques] = tabla.version
+            compilar(tabla)
+    with _lock:
+        return {t: _tablas_compiladas[(t, v)] for t, v in versiones.items() if (t, v) in _tablas_compiladas}
+
+
+def invalidar(id_tanques=None):
+    """Descartar tablas compiladas y versiones activas cacheadas (todas o las de un tanque)"""
+    with _lock:
+        if id_tanques is None:
+            _tablas_compiladas.clear()
+            _versiones.clear()
+        else:
+            _versiones.pop(id_tanques, None)
+            for clave in [c for c in _tablas_compiladas if c[0] == id_tanques]:
+                del _tablas_compiladas[clave]
+
+
+def _registrar_invalidacion():
+    """Invalidar tras el commit los tanques cuya tabla de aforo cambió"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    @event.listens_for(Session, "after_flush")
+    def _marcar(session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if type(obj).__name__ == 'TablaCalibracion' and obj.id_tanques is not None:
+                session.info.setdefault("calibracion_invalidar", set()).add(obj.id_tanques)
+
+    @event.listens_for(Session, "after_commit")
+    def _invalidar(session):
+        for id_tanques in session.info.pop("calibracion_invalidar", ()):
+            invalidar(id_tanques)
+
+    @event.listens_for(Session, "after_rollback")
+    def _descartar(session):
+        session.info.pop("calibracion_invalidar", None)
+
+
+_registrar_invalidacion()
+
+
+# ============= CONVERSIÓN =============
+
+def _interpolar(tabla, alturas):
+    """Interpolación lineal; bajo el primer punto se interpola desde (0, 0)"""
+    xs, ys = tabla
+    alturas = np.asarray(alturas, dtype=float)
+    galones = np.interp(alturas, xs, ys, right=ys[-1])
+    if xs[0] > 0:
+        bajo = alturas < xs[0]
+        galones[bajo] = ys[0] * alturas[bajo] / xs[0]
+    galones[alturas <= 0] = 0.0
+    return galones
+
+
+def convertir(tanque, alturas_cm):
+    """Convertir un array de alturas (cm) a galones para un tanque"""
+    alturas = np.asarray(alturas_cm, dtype=float)
+    tabla = tablas_activas([tanque.id_tanques]).get(tanque.id_tanques)
+    if tabla is not None:
+        return np.round(_interpolar(tabla, alturas), 2)
+    return np.round(cm_a_galones_geometrico(alturas, tanque.radio_cm), 2)
+
+
+def convertir_columna(ids_tanques, alturas_cm, tanques):
+    """Convertir columnas completas (id_tanques, altura) en una sola pasada.
+
+    ``tanques`` es un dict {id_tanques: Tanque}. Las filas de tanques
+    desconocidos quedan en NaN.
+    """
+    ids = np.asarray(ids_tanques)
+    alturas = np.asarray(alturas_cm, dtype=float)
+    resultado = np.full(alturas.shape, np.nan)
+    tablas = tablas_activas(tanques.keys())
+
+    for id_tanques in np.unique(ids):
+        tanque = tanques.get(id_tanques)
+        if tanque is None:
+            continue
+        mascara = ids == id_tanques
+        tabla = tablas.get(id_tanques)
+        if tabla is not None:
+            resultado[mascara] = _interpolar(tabla, alturas[mascara])
+        else:
+            resultado[mascara] = cm_a_galones_geometrico(alturas[mascara], tanque.radio_cm)
+    return np.round(resultado, 2)
+
+
+# ============= TABLAS PARA EL NAVEGADOR =============
+
+def etag_tabla(tanque, version):
+    """ETag de la tabla de conversión que se envía a los formularios.
+
+    Cubre todo lo que va en ``tabla_cliente``: la versión de la tabla (o el
+    radio, si se usa el cálculo geométrico) y la altura máxima del tanque.
+    """
+    altura = f"h{tanque.altura_maxima_cm}"
+    if version:
+        return f"t{tanque.id_tanques}-v{version}-{altura}"
+    return f"t{tanque.id_tanques}-r{tanque.radio_cm or RADIO_ESTANDAR_CM}-{altura}"
+
+
+def tabla_cliente(tanque):
+    """Representación compacta de la conversión de un tanque para el navegador"""
+    tabla = tablas_activas([tanque.id_tanques]).get(tanque.id_tanques)
+    datos = {
+        'tanque_id': tanque.id_tanques,
+        'altura_maxima_cm': tanque.altura_maxima_cm,
+    }
+    if tabla is not None:
+        xs, ys = tabla
+        datos.update({
+            'tipo': 'tabla',
+            'alturas': np.round(xs, 2).tolist(),
+            'galones': np.round(ys, 2).tolist(),
+        })
+    else:
+        datos.update({
+            'tipo': 'cilindro',
+            'galones_por_cm': float(cm_a_galones_geometrico(1.0, tanque.radio_cm)),
+        })
+    return datos
@@ -0,0 +1,886 @@
+# cargas.py - Carga masiva: validación vectorizada por columnas e inserción por lotes (Core)
+import csv
+import hashlib
+import os
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import and_, insert, inspect, select
+
+import calibracion
+from cache import marcar_invalidacion
+from consumo import actualizar_consumo_diario
+from calibracion import calcular_altura_maxima, RADIO_ESTANDAR_CM
+from contrasenas import hashear_lote, RONDAS_POR_DEFECTO
+from extensions import db, trabajos
+from utils import registrar_auditoria
+from models import Empleado, Tanque, RegistroMedida, MedicionCargue, Descargue, NivelTanque, PuntoControlCarga
+
+# Filas por INSERT (executemany)
+LOTE_INSERCION = 1000
+# Contraseñas por lote enviado al pool de procesos
+LOTE_HASH = 16
+# Filas por bloque en la importación por bloques (una transacción por bloque)
+TAMANO_BLOQUE = 5000
+
+REQUERIDAS = {
+    'empleados': ['nombre_empleado', 'apellido_empleado', 'numero_documento', 'email', 'usuario'],
+    'tanques': ['tipo_combustible', 'capacidad'],
+    'mediciones': ['tanque_id', 'medida_combustible', 'galones', 'tipo_medida', 'fecha_hora_registro', 'empleado_id'],
+    'descargues': ['tanque_id', 'fecha', 'medida_inicial_cm', 'descargue_cm', 'empleado_id'],
+    'cargues': ['tanque_id', 'fecha', 'medida_anterior', 'medida_posterior', 'empleado_id'],
+}
+
+# Columnas si/no del descargue (lista de chequeo y aspecto del combustible)
+_SI_NO_DESCARGUE = ['kit_derrames', 'extintores', 'conos', 'boquillas', 'botas', 'gafas', 'tapaoidos',
+                    'guantes', 'brillante', 'traslucido', 'claro', 'solidos']
+_FORMATOS_ENTREGA = {'pipa', 'camion', 'otro'}
+
+_VERDADEROS = {'true', '1', 'si', 'sí', 'yes', 'verdadero'}
+
+
+class CargaError(ValueError):
+    """Archivo que no se puede procesar (columnas faltantes, tipo desconocido)"""
+
+
+class ResultadoCarga:
+    def __init__(self):
+        self.insertados = 0
+        self.actualizados = 0
+        self.sin_cambios = 0
+        self.validos = 0
+        self.errores = []  # [(fila del archivo, mensaje)]
+
+    @property
+    def rechazados(self):
+        return len(self.errores)
+
+    def mensajes(self):
+        return [f"Fila {fila}: {mensaje}" for fila, mensaje in sorted(self.errores, key=lambda e: e[0])]
+
+
+# ============= LECTURA =============
+
+def leer_archivo(file):
+    """Leer CSV/Excel como texto (sin inferir tipos) con celdas vacías como ''"""
+    if file.filename.lower().endswith('.csv'):
+        df = pd.read_csv(file, sep=',', encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_excel(file, dtype=str).fillna('')
+    return normalizar(df)
+
+
+def normalizar(df):
+    df.columns = [str(c).strip() for c in df.columns]
+    for col in df.columns:
+        df[col] = df[col].astype(str).str.strip()
+    return df
+
+
+# ============= VALIDACIÓN POR COLUMNAS =============
+
+class Validacion:
+    """Máscara de filas válidas + errores por fila, aplicando reglas a columnas completas"""
+
+    def __init__(self, df, resultado):
+        self.df = df
+        self.resultado = resultado
+        self.valido = pd.Series(True, index=df.index)
+
+    def rechazar(self, mascara, mensaje, valores=None):
+        """Rechazar las filas aún válidas donde ``mascara`` es True.
+
+        ``mensaje`` puede usar {valor} con el valor de ``valores`` en esa fila.
+        """
+        nuevas = mascara.fillna(False).astype(bool) & self.valido
+        if not nuevas.any():
+            return
+        for idx in nuevas[nuevas].index:
+            texto = mensaje.format(valor=valores[idx]) if valores is not None else mensaje
+            self.resultado.errores.append((idx + 2, texto))
+        self.valido &= ~nuevas
+
+    def obligatorias(self, columnas):
+        for col in columnas:
+            self.rechazar(self.df[col] == '', f"Falta {col}")
+
+    def numero(self, col, mensaje):
+        """Columna numérica (acepta coma decimal); las filas no numéricas se rechazan"""
+        serie = pd.to_numeric(self.df[col].str.replace(',', '.', regex=False), errors='coerce')
+        self.rechazar(serie.isna(), mensaje, self.df[col])
+        return serie
+
+    def fecha(self, col, formatos, mensaje):
+        serie = pd.Series(pd.NaT, index=self.df.index, dtype='datetime64[ns]')
+        for formato in formatos:
+            faltantes = serie.isna()
+            serie[faltantes] = pd.to_datetime(self.df.loc[faltantes, col], format=formato, errors='coerce')
+        self.rechazar(serie.isna(), mensaje, self.df[col])
+        return serie
+
+    def existentes(self, serie, conocidos, mensaje):
+        """Rechazar valores que ya existen en la BD (``conocidos`` precargado en un set)"""
+        self.rechazar(serie.isin(conocidos), mensaje, serie)
+
+    def desconocidos(self, serie, conocidos, mensaje, valores=None):
+        """Rechazar referencias a claves que no existen en la BD"""
+        self.rechazar(~serie.isin(conocidos), mensaje, serie if valores is None else valores)
+
+    def repetidos(self, columnas, mensaje):
+        """Duplicados dentro del mismo archivo: se conserva la primera fila válida"""
+        vivas = self.df.loc[self.valido, columnas]
+        repetidas = vivas.duplicated(keep='first').reindex(self.df.index, fill_value=False)
+        self.rechazar(repetidas, mensaje)
+
+    def altura(self, serie, maximo, col):
+        """Alturas en cm entre 0 y la altura máxima de cada tanque (``maximo`` alineado por fila)"""
+        valores = self.df[col].where(self.df[col] != '', serie) if col in self.df.columns else serie
+        self.rechazar(serie < 0, f"{col} negativa → {{valor}}", valores)
+        self.rechazar(serie > maximo, f"{col} supera la altura máxima del tanque → {{valor}} cm", valores)
+
+    def longitudes(self, tabla, columnas):
+        """Respetar el largo de las columnas String del modelo"""
+        for col in columnas:
+            largo = getattr(tabla.c[col].type, 'length', None)
+            if largo and col in self.df.columns:
+                self.rechazar(self.df[col].str.len() > largo, f"{col} excede {largo} caracteres")
+
+
+def _opcional(df, col, defecto):
+    if col not in df.columns:
+        return pd.Series(defecto, index=df.index, dtype=object)
+    return df[col].where(df[col] != '', defecto)
+
+
+def _booleano(df, col, defecto):
+    if col not in df.columns:
+        return pd.Series(defecto, index=df.index, dtype=bool)
+    texto = df[col].str.lower()
+    return texto.isin(_VERDADEROS).where(texto != '', defecto).astype(bool)
+
+
+def _si_no(df, col):
+    """Columna si/no opcional; vacía o ausente queda NULL (no informado)"""
+    if col not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    texto = df[col].str.lower()
+    return texto.isin(_VERDADEROS).map({True: 'si', False: 'no'}).where(texto != '', None)
+
+
+def _numero_opcional(validacion, col, defecto):
+    """Columna numérica opcional: las celdas vacías (o la columna ausente) toman ``defecto``"""
+    if col not in validacion.df.columns:
+        return defecto
+    texto = validacion.df[col]
+    serie = pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce')
+    validacion.rechazar((texto != '') & serie.isna(), f"{col} inválido → {{valor}}", texto)
+    return serie.where(texto != '', defecto)
+
+
+def _texto_numero(valor):
+    return f"{valor:.2f}".rstrip('0').rstrip('.')
+
+
+def _valores_columna(columna):
+    """Valores existentes de una columna en una sola consulta"""
+    return set(db.session.execute(select(columna)).scalars())
+
+
+def _tanques(validacion, df):
+    """Resolver tanque_id contra todos los tanques cargados una vez en memoria.
+
+    Devuelve (ids por fila, {id_tanques: Tanque}, altura máxima por fila). Si el
+    tanque no tiene altura máxima se calcula desde su capacidad, como en el
+    formulario de descargue.
+    """
+    tanque_id = validacion.numero('tanque_id', "tanque_id inválido → {valor}")
+    tanques = {t.id_tanques: t for t in Tanque.query.all()}
+    validacion.desconocidos(tanque_id, set(tanques), "tanque_id {valor} no existe", df['tanque_id'])
+    maximos = {
+        id_tanques: t.altura_maxima_cm or calcular_altura_maxima(t.capacidad, t.radio_cm or RADIO_ESTANDAR_CM)
+        for id_tanques, t in tanques.items()
+    }
+    return tanque_id, tanques, tanque_id.map(maximos)
+
+
+def _empleado_id(validacion, df):
+    empleado_id = validacion.numero('empleado_id', "empleado_id inválido → {valor}")
+    validacion.desconocidos(empleado_id, _valores_columna(Empleado.id_empleados), "empleado_id {valor} no existe",
+                            df['empleado_id'])
+    return empleado_id
+
+
+def _a_galones(tanque_id, alturas, tanques):
+    """cm → galones de toda la columna con la tabla de aforo de cada tanque (NaN si la fila no es válida)"""
+    return pd.Series(calibracion.convertir_columna(tanque_id.to_numpy(), alturas.to_numpy(), tanques),
+                     index=alturas.index)
+
+
+# ============= PREPARACIÓN POR TIPO =============
+
+def _preparar_empleados(df, validacion):
+    tabla = Empleado.__table__
+    validacion.obligatorias(REQUERIDAS['empleados'])
+    validacion.longitudes(tabla, ['nombre_empleado', 'apellido_empleado', 'numero_documento',
+                                  'email', 'usuario', 'telefono', 'direccion'])
+    validacion.existentes(df['numero_documento'], _valores_columna(Empleado.numero_documento), "Documento duplicado")
+    validacion.existentes(df['usuario'], _valores_columna(Empleado.usuario), "Usuario duplicado")
+    validacion.existentes(df['email'], _valores_columna(Empleado.email), "Email duplicado")
+    validacion.repetidos(['numero_documento'], "Documento repetido en el archivo")
+    validacion.repetidos(['usuario'], "Usuario repetido en el archivo")
+    validacion.repetidos(['email'], "Email repetido en el archivo")
+
+    return pd.DataFrame({
+        'nombre_empleado': df['nombre_empleado'],
+        'apellido_empleado': df['apellido_empleado'],
+        'numero_documento': df['numero_documento'],
+        'tipo_documento': _opcional(df, 'tipo_documento', 'CC'),
+        'email': df['email'],
+        'telefono': _opcional(df, 'telefono', ''),
+        'direccion': _opcional(df, 'direccion', ''),
+        'cargo_establecido': _opcional(df, 'cargo_establecido', 'Islero'),
+        'usuario': df['usuario'],
+        'temporal': True,
+        'activo': _booleano(df, 'activo', True),
+        'email_confirmado': True,
+        'aceptado_terminos': _booleano(df, 'aceptado_terminos', False),
+    })[validacion.valido]
+
+
+def _insertar_empleados(conn, tabla, registros, progreso=None):
+    """Hashear las contraseñas temporales en todos los núcleos e insertar cada lote al terminar.
+
+    Contraseña temporal = últimos 4 dígitos del documento, con BCRYPT_ROUNDS rondas.
+    """
+    rondas = current_app.config.get('BCRYPT_ROUNDS', RONDAS_POR_DEFECTO)
+    lotes = [registros[i:i + LOTE_HASH] for i in range(0, len(registros), LOTE_HASH)]
+    temporales = [[registro['numero_documento'][-4:] for registro in lote] for lote in lotes]
+    if len(lotes) > 1:
+        hashes = trabajos.en_paralelo(hashear_lote, [(passwords, rondas) for passwords in temporales])
+    else:
+        # Un solo lote no compensa arrancar el pool de procesos
+        hashes = ((i, hashear_lote(passwords, rondas)) for i, passwords in enumerate(temporales))
+
+    hechos = 0
+    for indice, contrasenas in hashes:
+        lote = lotes[indice]
+        for registro, contrasena in zip(lote, contrasenas):
+            registro['contrasena'] = contrasena
+        conn.execute(insert(tabla), lote)
+        hechos += len(lote)
+        if progreso is not None:
+            progreso(hechos, len(registros))
+
+
+def _preparar_tanques(df, validacion):
+    validacion.obligatorias(REQUERIDAS['tanques'])
+    validacion.longitudes(Tanque.__table__, ['tipo_combustible'])
+    capacidad = validacion.numero('capacidad', "Capacidad inválida → {valor}")
+
+    preparado = pd.DataFrame({
+        'tipo_combustible': df['tipo_combustible'],
+        'capacidad': capacidad,
+        'activo': _booleano(df, 'activo', True),
+    })[validacion.valido]
+    preparado['capacidad'] = preparado['capacidad'].astype(int)
+    return preparado
+
+
+def _preparar_mediciones(df, validacion):
+    validacion.obligatorias(REQUERIDAS['mediciones'])
+    validacion.longitudes(RegistroMedida.__table__, ['tipo_medida', 'novedad'])
+    tanque_id = validacion.numero('tanque_id', "tanque_id inválido → {valor}")
+    validacion.desconocidos(tanque_id, _valores_columna(Tanque.id_tanques), "tanque_id {valor} no existe",
+                            df['tanque_id'])
+    empleado_id = _empleado_id(validacion, df)
+    medida = validacion.numero('medida_combustible', "medida_combustible inválida → {valor}")
+    galones = validacion.numero('galones', "galones inválidos → {valor}")
+    fecha = validacion.fecha('fecha_hora_registro', ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'],
+                             "fecha_hora_registro inválida → {valor}")
+
+    preparado = pd.DataFrame({
+        'id_tanques': tanque_id,
+        'id_empleados': empleado_id,
+        'medida_combustible': medida,
+        'galones': galones,
+        'tipo_medida': df['tipo_medida'],
+        'novedad': _opcional(df, 'novedad', ''),
+        'fecha_hora_registro': fecha,
+    })
+    validacion.df = preparado
+    validacion.repetidos(['id_tanques', 'fecha_hora_registro'], "Medición repetida en el archivo (tanque y fecha)")
+    validacion.df = df
+
+    preparado = preparado[validacion.valido].copy()
+    preparado['id_tanques'] = preparado['id_tanques'].astype(int)
+    preparado['id_empleados'] = preparado['id_empleados'].astype(int)
+    preparado['galones'] = preparado['galones'].round().astype(int)
+    preparado['medida_combustible'] = preparado['medida_combustible'].map(_texto_numero)
+    return preparado
+
+
+def _despues_mediciones(conn, preparado):
+    """Core no dispara los hooks del ORM: actualizar nivel_tanque y consumo_diario aquí"""
+    rangos = {}
+    for id_tanques, grupo in preparado.groupby('id_tanques'):
+        fechas = grupo['fecha_hora_registro']
+        rangos[int(id_tanques)] = (fechas.min().to_pydatetime(), fechas.max().to_pydatetime())
+
+        ultima = grupo.loc[fechas.idxmax()]
+        fecha = ultima['fecha_hora_registro'].to_pydatetime()
+        id_registro = conn.execute(
+            select(RegistroMedida.id_registro_medidas).where(
+                RegistroMedida.id_tanques == int(id_tanques),
+                RegistroMedida.fecha_hora_registro == fecha
+            ).order_by(RegistroMedida.id_registro_medidas.desc()).limit(1)
+        ).scalar()
+        NivelTanque.registrar(conn, int(id_tanques), float(ultima['medida_combustible']),
+                              float(ultima['galones']), fecha, 'medicion', id_registro)
+    actualizar_consumo_diario(conn, rangos)
+
+
+def _preparar_descargues(df, validacion):
+    """Descargues de los manifiestos del proveedor.
+
+    Los galones que no vengan en el archivo se calculan desde los cm como en
+    el formulario: final = inicial + descargue y diferencia = descargue.
+    """
+    validacion.obligatorias(REQUERIDAS['descargues'])
+    validacion.longitudes(Descargue.__table__, ['observaciones1', 'observaciones2', 'separacion'])
+    tanque_id, tanques, maximo = _tanques(validacion, df)
+    empleado_id = _empleado_id(validacion, df)
+    fecha = validacion.fecha('fecha', ['%Y-%m-%d', '%d/%m/%Y'], "fecha inválida → {valor}")
+
+    inicial_cm = validacion.numero('medida_inicial_cm', "medida_inicial_cm inválida → {valor}")
+    descargue_cm = validacion.numero('descargue_cm', "descargue_cm inválido → {valor}")
+    final_cm = _numero_opcional(validacion, 'medida_final_cm', inicial_cm + descargue_cm)
+    validacion.altura(inicial_cm, maximo, 'medida_inicial_cm')
+    validacion.rechazar(descargue_cm < 0, "descargue_cm negativo → {valor}", df['descargue_cm'])
+    validacion.altura(final_cm, maximo, 'medida_final_cm')
+
+    inicial_gl = _numero_opcional(validacion, 'medida_inicial_gl', _a_galones(tanque_id, inicial_cm, tanques))
+    descargue_gl = _numero_opcional(validacion, 'descargue_gl', _a_galones(tanque_id, descargue_cm, tanques))
+    final_gl = _numero_opcional(validacion, 'medida_final_gl', inicial_gl + descargue_gl)
+    diferencia = _numero_opcional(validacion, 'diferencia', descargue_gl)
+
+    preparado = pd.DataFrame({
+        'id_empleados': empleado_id,
+        'tanque': tanque_id,
+        'fecha': fecha,
+        'medida_inicial_cm': inicial_cm,
+        'medida_inicial_gl': inicial_gl,
+        'descargue_cm': descargue_cm,
+        'descargue_gl': descargue_gl,
+        'medida_final_cm': final_cm,
+        'medida_final_gl': final_gl,
+        'diferencia': diferencia,
+        'observaciones1': _opcional(df, 'observaciones1', ''),
+        'observaciones2': _opcional(df, 'observaciones2', ''),
+        'separacion': _opcional(df, 'separacion', None),
+        **{col: _si_no(df, col) for col in _SI_NO_DESCARGUE},
+    })[validacion.valido].copy()
+    preparado['id_empleados'] = preparado['id_empleados'].astype(int)
+    # Descargue.tanque es texto: se guarda el id como en el formulario
+    preparado['tanque'] = preparado['tanque'].astype(int).astype(str)
+    preparado['fecha'] = preparado['fecha'].dt.date
+    numericas = ['medida_inicial_cm', 'medida_inicial_gl', 'descargue_cm', 'descargue_gl',
+                 'medida_final_cm', 'medida_final_gl', 'diferencia']
+    preparado[numericas] = preparado[numericas].astype(float).round(2)
+    return preparado
+
+
+def _despues_descargues(conn, preparado):
+    """Nivel final del último descargue de cada tanque + consumo_diario de los días afectados"""
+    hoy = date.today()
+    rangos = {}
+    for tanque, grupo in preparado.groupby('tanque'):
+        id_tanques = int(tanque)
+        rangos[id_tanques] = (grupo['fecha'].min(), grupo['fecha'].max())
+
+        ultimo = grupo.loc[grupo['fecha'].idxmax()]
+        # Igual que el formulario: un descargue de hoy cuenta desde ahora, uno pasado desde las 00:00
+        fecha = datetime.now() if ultimo['fecha'] >= hoy else datetime.combine(ultimo['fecha'], datetime.min.time())
+        NivelTanque.registrar(conn, id_tanques, float(ultimo['medida_final_cm']),
+                              float(ultimo['medida_final_gl']), fecha, 'descargue')
+    actualizar_consumo_diario(conn, rangos)
+
+
+def _preparar_cargues(df, validacion):
+    """Cargues de emergencia: galones_totales vacío = galones(posterior) - galones(anterior)"""
+    validacion.obligatorias(REQUERIDAS['cargues'])
+    tanque_id, tanques, maximo = _tanques(validacion, df)
+    empleado_id = _empleado_id(validacion, df)
+    fecha = validacion.fecha('fecha', ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'],
+                             "fecha inválida → {valor}")
+
+    anterior = validacion.numero('medida_anterior', "medida_anterior inválida → {valor}")
+    posterior = validacion.numero('medida_posterior', "medida_posterior inválida → {valor}")
+    validacion.altura(anterior, maximo, 'medida_anterior')
+    validacion.altura(posterior, maximo, 'medida_posterior')
+    validacion.rechazar(posterior < anterior, "medida_posterior menor que medida_anterior → {valor}",
+                        df['medida_posterior'])
+
+    formato = _opcional(df, 'formato_de_entrega', 'otro').str.lower()
+    validacion.desconocidos(formato, _FORMATOS_ENTREGA, "formato_de_entrega no válido → {valor}")
+
+    calculados = _a_galones(tanque_id, posterior, tanques) - _a_galones(tanque_id, anterior, tanques)
+    galones = _numero_opcional(validacion, 'galones_totales', calculados)
+    validacion.rechazar(galones < 0, "galones_totales negativos → {valor}", galones)
+
+    preparado = pd.DataFrame({
+        'id_tanques': tanque_id,
+        'id_empleados': empleado_id,
+        'medida_anterior': anterior,
+        'medida_posterior': posterior,
+        'formato_de_entrega': formato,
+        'galones_totales': galones,
+        'fecha': fecha,
+    })[validacion.valido].copy()
+    preparado['id_tanques'] = preparado['id_tanques'].astype(int)
+    preparado['id_empleados'] = preparado['id_empleados'].astype(int)
+    for col in ('medida_anterior', 'medida_posterior', 'galones_totales'):
+        preparado[col] = preparado[col].map(_texto_numero)
+    return preparado
+
+
+def _despues_cargues(conn, preparado):
+    """Nivel posterior del último cargue de cada tanque + consumo_diario de los días afectados"""
+    rangos = {}
+    for id_tanques, grupo in preparado.groupby('id_tanques'):
+        fechas = grupo['fecha']
+        rangos[int(id_tanques)] = (fechas.min().to_pydatetime(), fechas.max().to_pydatetime())
+
+        ultimo = grupo.loc[fechas.idxmax()]
+        altura = float(ultimo['medida_posterior'])
+        tanque = db.session.get(Tanque, int(id_tanques))
+        NivelTanque.registrar(conn, int(id_tanques), altura, tanque.cm_a_galones(altura),
+                              ultimo['fecha'].to_pydatetime(), 'cargue')
+    actualizar_consumo_diario(conn, rangos)
+
+
+# tipo → (modelo, preparar, insertar, después de insertar)
+_TIPOS = {
+    'empleados': (Empleado, _preparar_empleados, _insertar_empleados, None),
+    'tanques': (Tanque, _preparar_tanques, None, None),
+    'mediciones': (RegistroMedida, _preparar_mediciones, None, _despues_mediciones),
+    'descargues': (Descargue, _preparar_descargues, None, _despues_descargues),
+    'cargues': (MedicionCargue, _preparar_cargues, None, _despues_cargues),
+}
+
+# tipo → (clave natural con índice único, columnas que el upsert actualiza)
+_CLAVES = {
+    'mediciones': (['id_tanques', 'fecha_hora_registro'],
+                   ['id_empleados', 'medida_combustible', 'galones', 'tipo_medida', 'novedad']),
+}
+
+
+# ============= INSERCIÓN =============
+
+def _registros(df):
+    """DataFrame → lista de dicts con tipos de Python (sin numpy ni NaT)"""
+    df = df.astype(object).where(df.notna(), None)
+    for col in df.columns:
+        df[col] = [v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in df[col]]
+    return df.to_dict('records')
+
+
+def insertar(conn, tabla, registros, progreso=None):
+    """INSERT ... executemany en lotes de LOTE_INSERCION"""
+    for inicio in range(0, len(registros), LOTE_INSERCION):
+        lote = registros[inicio:inicio + LOTE_INSERCION]
+        conn.execute(insert(tabla), lote)
+        if progreso is not None:
+            progreso(inicio + len(lote), len(registros))
+
+
+def _existentes(tabla, preparado, clave, columnas):
+    """Filas de la BD con la misma clave natural que ``preparado`` (DataFrame con clave + columnas)"""
+    condiciones = []
+    for col in clave:
+        serie = preparado[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            condiciones.append(tabla.c[col].between(serie.min().to_pydatetime(), serie.max().to_pydatetime()))
+        else:
+            condiciones.append(tabla.c[col].in_([int(v) for v in serie.unique()]))
+    filas = db.session.execute(
+        select(*(tabla.c[c] for c in clave + columnas)).where(and_(*condiciones))
+    ).all()
+    return pd.DataFrame(filas, columns=clave + columnas)
+
+
+def _clasificar(tabla, preparado, clave, columnas):
+    """Estado de cada fila frente a la BD: 'nuevo', 'actualizado' o 'sin_cambios'"""
+    existentes = _existentes(tabla, preparado, clave, columnas)
+    if existentes.empty:
+        return pd.Series('nuevo', index=preparado.index)
+    # Una BD sin el índice único puede tener la clave repetida: basta con una fila por clave
+    existentes = existentes.drop_duplicates(subset=clave)
+
+    cruce = preparado[clave + columnas].reset_index().merge(
+        existentes, on=clave, how='left', suffixes=('', '_bd'), indicator=True
+    ).set_index('index')
+    iguales = pd.Series(True, index=cruce.index)
+    for col in columnas:
+        # NULL y '' cuentan como el mismo valor; como objetos 4000 == 4000.0 (columna con NaN)
+        nuevo = cruce[col].astype(object).where(cruce[col].notna(), '')
+        actual = cruce[f'{col}_bd'].astype(object).where(cruce[f'{col}_bd'].notna(), '')
+        iguales &= nuevo == actual
+    estados = pd.Series('actualizado', index=cruce.index)
+    estados[iguales] = 'sin_cambios'
+    estados[cruce['_merge'] == 'left_only'] = 'nuevo'
+    return estados.reindex(preparado.index)
+
+
+_INDICES_VERIFICADOS = set()
+
+
+def _verificar_indice(conn, tabla, clave):
+    """El upsert necesita el índice único de la clave; create_all no lo agrega a una tabla existente"""
+    if tabla.name in _INDICES_VERIFICADOS:
+        return
+    existe = any(
+        indice.get('unique') and list(indice['column_names']) == clave
+        for indice in inspect(conn).get_indexes(tabla.name)
+    )
+    if not existe:
+        raise CargaError(
+            f"La tabla {tabla.name} aún no tiene el índice único de ({', '.join(clave)}): "
+            "ejecute 'flask deduplicar-mediciones' antes de actualizar registros existentes"
+        )
+    _INDICES_VERIFICADOS.add(tabla.name)
+
+
+def upsert(conn, tabla, registros, clave, columnas, progreso=None):
+    """INSERT ... ON CONFLICT (PostgreSQL/SQLite) u ON DUPLICATE KEY UPDATE (MySQL) en lotes"""
+    dialecto = conn.dialect.name
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+    elif dialecto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+    elif dialecto in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as insert_dialecto
+    else:
+        raise CargaError(f"La actualización de registros no está soportada en {dialecto}")
+
+    sentencia = insert_dialecto(tabla)
+    if dialecto in ('mysql', 'mariadb'):
+        sentencia = sentencia.on_duplicate_key_update({c: sentencia.inserted[c] for c in columnas})
+    else:
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=clave, set_={c: sentencia.excluded[c] for c in columnas}
+        )
+    for inicio in range(0, len(registros), LOTE_INSERCION):
+        lote = registros[inicio:inicio + LOTE_INSERCION]
+        conn.execute(sentencia, lote)
+        if progreso is not None:
+            progreso(inicio + len(lote), len(registros))
+
+
+def cargar(tipo, df, progreso=None, simular=False, actualizar=False):
+    """Validar e insertar un DataFrame de ``tipo`` en la transacción actual (sin commit).
+
+    ``progreso(insertados, total)`` se llama después de cada lote insertado.
+    Con ``simular`` sólo se valida: nada se escribe y ``validos`` cuenta las
+    filas que se habrían insertado.
+
+    Para los tipos con clave natural (``_CLAVES``) las filas que ya existen en
+    la BD se rechazan, o con ``actualizar`` se escriben con un upsert: sólo se
+    envían las nuevas y las que cambiaron, y se cuentan insertados,
+    actualizados y sin cambios.
+    """
+    if tipo not in _TIPOS:
+        raise CargaError("Tipo de carga no válido")
+    if actualizar and tipo not in _CLAVES:
+        raise CargaError(f"La actualización de registros existentes no está disponible para {tipo}")
+    faltantes = [c for c in REQUERIDAS[tipo] if c not in df.columns]
+    if faltantes:
+        raise CargaError(f"Faltan columnas: {', '.join(faltantes)}")
+
+    modelo, preparar, insertar_tipo, despues = _TIPOS[tipo]
+    tabla = modelo.__table__
+    resultado = ResultadoCarga()
+    validacion = Validacion(df, resultado)
+    preparado = preparar(df, validacion)
+
+    if tipo in _CLAVES and not preparado.empty:
+        clave, columnas = _CLAVES[tipo]
+        if actualizar:
+            _verificar_indice(db.session.connection(), tabla, clave)
+        estados = _clasificar(tabla, preparado, clave, columnas)
+        if actualizar:
+            resultado.sin_cambios = int((estados == 'sin_cambios').sum())
+            resultado.actualizados = int((estados == 'actualizado').sum())
+        else:
+            validacion.rechazar((estados != 'nuevo').reindex(df.index, fill_value=False),
+                                "Ya existe un registro con la misma clave ({valor})",
+                                preparado[clave].astype(str).agg(' / '.join, axis=1))
+        preparado = preparado[estados != 'sin_cambios'] if actualizar else preparado[estados == 'nuevo']
+
+    resultado.validos = len(preparado) + resultado.sin_cambios
+    if preparado.empty or simular:
+        return resultado
+
+    registros = _registros(preparado)
+    conn = db.session.connection()
+    if actualizar:
+        upsert(conn, tabla, registros, *_CLAVES[tipo], progreso=progreso)
+    else:
+        (insertar_tipo or insertar)(conn, tabla, registros, progreso)
+    if despues is not None:
+        despues(conn, preparado)
+    marcar_invalidacion(db.session, modelo.__name__)
+    resultado.insertados = len(registros) - resultado.actualizados
+    return resultado
+
+
+# ============= IMPORTACIÓN POR BLOQUES (archivos grandes, reanudable) =============
+
+def _directorio():
+    directorio = current_app.config['CARGAS_DIR']
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def guardar_subida(file, tipo):
+    """Guardar el archivo subido en CARGAS_DIR y devolver (carga_id, ruta).
+
+    El id deriva del contenido: volver a subir el mismo archivo retoma su checkpoint.
+    """
+    extension = os.path.splitext(file.filename)[1].lower()
+    temporal = os.path.join(_directorio(), f"subida-{os.getpid()}-{id(file)}{extension}")
+    sha = hashlib.sha256()
+    with open(temporal, 'wb') as destino:
+        for trozo in iter(lambda: file.stream.read(1024 * 1024), b''):
+            sha.update(trozo)
+            destino.write(trozo)
+    carga_id = f"carga-{tipo}-{sha.hexdigest()[:20]}"
+    ruta = os.path.join(_directorio(), carga_id + extension)
+    os.replace(temporal, ruta)
+    return carga_id, ruta
+
+
+def ruta_errores(carga_id):
+    return os.path.join(_directorio(), f"{carga_id}_errores.csv")
+
+
+def _celda_texto(valor):
+    """Valor de una celda de openpyxl → texto como lo leería pandas con dtype=str"""
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def leer_bloques(ruta, desde=0, tamano=TAMANO_BLOQUE):
+    """Generar DataFrames de ``tamano`` filas saltando las ``desde`` primeras filas de datos.
+
+    El índice de cada bloque es la posición de la fila en el archivo (para los
+    números de fila de los errores). CSV se lee con chunksize y XLSX con
+    openpyxl en modo read_only, así nunca está el archivo entero en memoria.
+    """
+    if ruta.lower().endswith('.csv'):
+        # Se saltan registros ya parseados, no líneas: un campo entre comillas
+        # puede tener saltos de línea (novedad, observaciones)
+        lector = pd.read_csv(ruta, sep=',', encoding='utf-8-sig', dtype=str, keep_default_na=False,
+                             chunksize=tamano)
+        inicio = 0
+        for bloque in lector:
+            fin = inicio + len(bloque)
+            if fin <= desde:
+                inicio = fin
+                continue
+            if inicio < desde:
+                bloque = bloque.iloc[desde - inicio:]
+                inicio = desde
+            bloque.index = pd.RangeIndex(inicio, inicio + len(bloque))
+            inicio += len(bloque)
+            yield normalizar(bloque)
+        return
+
+    if ruta.lower().endswith('.xls'):
+        # El formato binario antiguo no se puede leer por filas: se trocea en memoria
+        df = normalizar(pd.read_excel(ruta, dtype=str).fillna(''))
+        for inicio in range(desde, len(df), tamano):
+            yield df.iloc[inicio:inicio + tamano]
+        return
+
+    import openpyxl
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = [_celda_texto(c).strip() for c in next(filas, ())]
+        bloque = []
+        inicio = desde
+        for numero, fila in enumerate(filas):
+            if numero < desde:
+                continue
+            bloque.append([_celda_texto(v) for v in fila[:len(encabezado)]])
+            if len(bloque) == tamano:
+                yield normalizar(pd.DataFrame(bloque, columns=encabezado, index=pd.RangeIndex(inicio, inicio + tamano)))
+                inicio += tamano
+                bloque = []
+        if bloque:
+            yield normalizar(pd.DataFrame(bloque, columns=encabezado, index=pd.RangeIndex(inicio, inicio + len(bloque))))
+    finally:
+        libro.close()
+
+
+def _anotar_errores(carga_id, errores, nuevo):
+    with open(ruta_errores(carga_id), 'w' if nuevo else 'a', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        if nuevo:
+            writer.writerow(['fila', 'error'])
+        writer.writerows(sorted(errores, key=lambda e: e[0]))
+
+
+def importar_por_bloques(carga_id, ruta, tipo, progreso=None, actualizar=False):
+    """Importar un archivo guardado bloque a bloque, con commit y checkpoint por bloque.
+
+    El checkpoint (filas procesadas, totales) es una fila de cargas_checkpoint
+    que se confirma en la misma transacción que los registros del bloque; si
+    el proceso se interrumpe, la misma llamada continúa desde el último bloque
+    confirmado sin repetir ninguno. El estado del trabajo ``carga_id`` refleja
+    el progreso para la página de estado. Devuelve el estado final. Con
+    ``actualizar`` (upsert) un archivo ya importado se vuelve a aplicar desde
+    el principio: es idempotente y sólo escribe las filas que cambiaron.
+    """
+    punto = db.session.get(PuntoControlCarga, carga_id)
+    if punto is not None and punto.completado and not actualizar:
+        estado = trabajos.estado(carga_id) or {'id': carga_id, 'estado': 'completado'}
+        return dict(estado, **punto.contadores(), ya_importado=True)
+    if punto is None or punto.completado:
+        if punto is None:
+            punto = PuntoControlCarga(carga_id=carga_id, tipo=tipo)
+            db.session.add(punto)
+        for campo in PuntoControlCarga.CONTADORES:
+            setattr(punto, campo, 0)
+        punto.completado = False
+        db.session.commit()
+        _anotar_errores(carga_id, [], nuevo=True)
+
+    estado = trabajos.actualizar(carga_id, tipo='carga', carga=tipo, estado='en_proceso',
+                                 actualizar=actualizar, **punto.contadores())
+    reanudado_desde = punto.filas_procesadas
+    inicio = time.monotonic()
+
+    for bloque in leer_bloques(ruta, desde=punto.filas_procesadas):
+        try:
+            resultado = cargar(tipo, bloque, actualizar=actualizar)
+            punto.filas_procesadas += len(bloque)
+            punto.insertados += resultado.insertados
+            punto.actualizados += resultado.actualizados
+            punto.sin_cambios += resultado.sin_cambios
+            punto.rechazados += resultado.rechazados
+            punto.bloques += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            trabajos.actualizar(carga_id, estado='interrumpido')
+            raise
+        _anotar_errores(carga_id, resultado.errores, nuevo=False)
+        estado = trabajos.actualizar(
+            carga_id,
+            estado='en_proceso',
+            **punto.contadores(),
+            filas_por_segundo=_ritmo(punto.filas_procesadas - reanudado_desde, inicio),
+        )
+        if progreso is not None:
+            progreso(estado)
+
+    punto.completado = True
+    db.session.commit()
+    estado = trabajos.actualizar(carga_id, estado='completado', **punto.contadores())
+    return dict(estado, reanudado_desde=reanudado_desde)
+
+
+def _ritmo(filas, inicio):
+    return round(filas / max(time.monotonic() - inicio, 1e-6), 1)
+
+
+def id_trabajo(carga_id, simular=False, actualizar=False):
+    """Id del trabajo de un archivo guardado según el modo.
+
+    Validar (dry run) o actualizar un archivo no comparte checkpoint con su
+    importación normal.
+    """
+    prefijo = ('validacion' if simular else 'carga') + ('-upsert' if actualizar else '')
+    return f"{prefijo}-{carga_id.split('-', 1)[1]}"
+
+
+def validar_por_bloques(trabajo_id, ruta, tipo, progreso=None, actualizar=False):
+    """Ejecutar toda la validación sobre el archivo sin escribir nada (dry run).
+
+    Recorre el archivo por bloques igual que la importación, pero cada bloque
+    se valida con ``cargar(..., simular=True)`` y la transacción se descarta.
+    El reporte completo de errores queda en ``ruta_errores(trabajo_id)``.
+    """
+    estado = trabajos.actualizar(trabajo_id, tipo='validacion', carga=tipo, estado='en_proceso',
+                                 actualizar=actualizar, filas_procesadas=0, validos=0,
+                                 actualizados=0, sin_cambios=0, rechazados=0, bloques=0)
+    _anotar_errores(trabajo_id, [], nuevo=True)
+    inicio = time.monotonic()
+
+    try:
+        for bloque in leer_bloques(ruta):
+            resultado = cargar(tipo, bloque, simular=True, actualizar=actualizar)
+            _anotar_errores(trabajo_id, resultado.errores, nuevo=False)
+            estado = trabajos.actualizar(
+                trabajo_id,
+                filas_procesadas=estado['filas_procesadas'] + len(bloque),
+                validos=estado['validos'] + resultado.validos,
+                actualizados=estado['actualizados'] + resultado.actualizados,
+                sin_cambios=estado['sin_cambios'] + resultado.sin_cambios,
+                rechazados=estado['rechazados'] + resultado.rechazados,
+                bloques=estado['bloques'] + 1,
+                filas_por_segundo=_ritmo(estado['filas_procesadas'] + len(bloque), inicio),
+            )
+            if progreso is not None:
+                progreso(estado)
+    finally:
+        db.session.rollback()
+
+    return trabajos.actualizar(trabajo_id, estado='completado')
+
+
+# ============= CARGAS EN SEGUNDO PLANO =============
+
+def solicitar_carga(carga_id, ruta, tipo, simular, actualizar, id_empleados, ip_address):
+    """Encolar la importación (o su validación) de un archivo guardado y devolver el id del trabajo.
+
+    Si el mismo archivo ya se está procesando, o ya se importó sin
+    ``actualizar``, no se vuelve a encolar: se devuelve el trabajo existente.
+    """
+    trabajo_id = id_trabajo(carga_id, simular, actualizar)
+    estado = trabajos.estado(trabajo_id)
+    completado = estado and estado.get('estado') == 'completado'
+    if trabajos.activo(trabajo_id) or (completado and not simular and not actualizar):
+        return trabajo_id
+
+    trabajos.actualizar(trabajo_id, tipo='validacion' if simular else 'carga', carga=tipo,
+                        estado='pendiente', id_empleados=id_empleados)
+    trabajos.en_hilo(trabajo_id, _ejecutar_carga, ruta, tipo, simular, actualizar, id_empleados, ip_address)
+    return trabajo_id
+
+
+def _ejecutar_carga(trabajo_id, ruta, tipo, simular, actualizar, id_empleados, ip_address):
+    """Cuerpo del trabajo de carga (corre en trabajos.en_hilo)"""
+    if simular:
+        estado = validar_por_bloques(trabajo_id, ruta, tipo, actualizar=actualizar)
+        return {'validos': estado['validos'], 'rechazados': estado['rechazados']}
+
+    estado = importar_por_bloques(trabajo_id, ruta, tipo, actualizar=actualizar)
+    totales = {c: estado[c] for c in ('insertados', 'actualizados', 'sin_cambios', 'rechazados')}
+    registrar_auditoria('UPSERT_BULK' if actualizar else 'CREATE_BULK', tipo, None, None, {
+        'count': estado['insertados'],
+        **totales,
+        'carga': trabajo_id,
+    }, id_empleados=id_empleados, ip_address=ip_address)
+    return totales
@@ -0,0 +1,89 @@
+# comandos.py - Comandos de mantenimiento (flask <comando>)
+import click
+
+from extensions import db, stats_cache
+
+
+def register_commands(app):
+    """Registrar comandos CLI de mantenimiento en la aplicación"""
+
+    @app.cli.command("reconstruir-niveles")
+    def reconstruir_niveles():
+        """Recalcular nivel_tanque desde registro_medidas"""
+        from models import NivelTanque
+        db.create_all()
+        total = NivelTanque.reconstruir()
+        stats_cache.invalidar('estadisticas', 'dashboard', 'reportes')
+        click.echo(f"✅ Niveles reconstruidos para {total} tanques")
+
+    @app.cli.command("reconstruir-consumo")
+    def reconstruir_consumo():
+        """Regenerar el rollup consumo_diario desde las lecturas"""
+        from consumo import reconstruir_consumo_diario
+        db.create_all()
+        total = reconstruir_consumo_diario()
+        stats_cache.invalidar('estadisticas', 'dashboard', 'reportes')
+        click.echo(f"✅ consumo_diario regenerado: {total} filas (tanque, día)")
+
+    @app.cli.command("deduplicar-mediciones")
+    def deduplicar_mediciones():
+        """Borrar lecturas repetidas (tanque, fecha) y crear su índice único"""
+        from models import RegistroMedida, NivelTanque
+        from consumo import reconstruir_consumo_diario
+        db.create_all()
+        # Todo en una transacción: si algo falla no queda nada a medias
+        try:
+            borradas = RegistroMedida.eliminar_duplicados()
+            db.session.flush()
+            pendientes = RegistroMedida.grupos_duplicados()
+            if not pendientes:
+                if borradas:
+                    NivelTanque.reconstruir(confirmar=False)
+                    reconstruir_consumo_diario(confirmar=False)
+                # Al final: en MySQL el CREATE INDEX confirma implícitamente lo anterior
+                conn = db.session.connection()
+                for indice in RegistroMedida.__table__.indexes:
+                    if indice.unique:
+                        indice.create(conn, checkfirst=True)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            click.echo(f"❌ No se modificó nada: {e}")
+            raise SystemExit(1)
+        if pendientes:
+            db.session.rollback()
+            click.echo("❌ No se modificó nada: estas lecturas repiten tanque y fecha con valores distintos; "
+                       "corríjalas o bórrelas a mano y vuelva a ejecutar el comando:")
+            for id_tanques, fecha, cantidad in pendientes:
+                click.echo(f"   tanque {id_tanques}, {fecha}: {cantidad} lecturas")
+            raise SystemExit(1)
+        stats_cache.invalidar('estadisticas', 'dashboard', 'reportes')
+        click.echo(f"✅ {borradas} lecturas duplicadas eliminadas; índice único de (tanque, fecha) creado")
+
+    @app.cli.command("limpiar-exportaciones")
+    def limpiar_exportaciones():
+        """Borrar exportaciones en segundo plano más viejas que EXPORTS_RETENCION_HORAS"""
+        from exportaciones import limpiar_exportaciones as limpiar
+        total = limpiar()
+        click.echo(f"✅ {total} archivos de exportación eliminados")
+
+    @app.cli.command("limpiar-sesiones")
+    def limpiar_sesiones():
+        """Vencer sesiones inactivas, archivar las viejas y crear los índices de sesiones_activas"""
+        from extensions import sesiones
+        from models import SesionActiva
+        db.create_all()
+        for indice in SesionActiva.__table__.indexes:
+            indice.create(db.engine, checkfirst=True)
+        vencidas, archivadas = sesiones.limpiar()
+        click.echo(f"✅ {vencidas} sesiones vencidas; {archivadas} archivadas en sesiones_archivadas")
+
+    @app.cli.command("enviar-correos")
+    def enviar_correos():
+        """Enviar la bandeja de salida pendiente (para cron o despliegues sin hilos persistentes)"""
+        from extensions import buzon
+        db.create_all()
+        enviados, reprogramados, fallidos = buzon.enviar_pendientes()
+        purgados = buzon.purgar()
+        click.echo(f"✅ {enviados} correos enviados, {reprogramados} reprogramados, "
+                   f"{fallidos} fallidos; {purgados} enviados antiguos eliminados")
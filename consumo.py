@@ -0,0 +1,283 @@
+# consumo.py - Cálculo de consumo (ventas) a partir de diferencias entre mediciones
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, select, case, delete, insert
+from sqlalchemy.orm import Session
+
+import calibracion
+from extensions import db
+from models import Tanque, RegistroMedida, MedicionCargue, Descargue, ConsumoDiario, _a_float
+
+
+def _fecha_texto(valor):
+    """Normalizar la fecha devuelta por la BD (date o str según el motor) a 'YYYY-MM-DD'"""
+    if hasattr(valor, 'strftime'):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)[:10]
+
+
+def _a_dia(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(_fecha_texto(valor))
+
+
+def deltas_medicion(desde=None, hasta=None, solo_activos=True, id_tanques=None):
+    """Subconsulta con el consumo entre lecturas consecutivas de cada tanque.
+
+    LAG() particionado por tanque: cada lectura se compara con la anterior
+    del MISMO tanque dentro del rango. Columnas: id_tanques, tipo_combustible,
+    fecha_hora_registro, galones, consumo (sólo las bajadas de nivel).
+    """
+    anterior = func.lag(RegistroMedida.galones).over(
+        partition_by=RegistroMedida.id_tanques,
+        order_by=(RegistroMedida.fecha_hora_registro, RegistroMedida.id_registro_medidas)
+    )
+    consulta = select(
+        RegistroMedida.id_tanques,
+        Tanque.tipo_combustible,
+        RegistroMedida.fecha_hora_registro,
+        RegistroMedida.galones.label('galones'),
+        anterior.label('anterior'),
+    ).join(Tanque, Tanque.id_tanques == RegistroMedida.id_tanques).where(
+        RegistroMedida.fecha_hora_registro.is_not(None)
+    )
+    if desde is not None:
+        consulta = consulta.where(RegistroMedida.fecha_hora_registro >= desde)
+    if hasta is not None:
+        consulta = consulta.where(RegistroMedida.fecha_hora_registro < hasta)
+    if solo_activos:
+        consulta = consulta.where(Tanque.activo.is_(True))
+    if id_tanques is not None:
+        consulta = consulta.where(RegistroMedida.id_tanques == id_tanques)
+    lecturas = consulta.subquery()
+
+    diferencia = func.coalesce(lecturas.c.anterior, 0) - func.coalesce(lecturas.c.galones, 0)
+    return select(
+        lecturas.c.id_tanques,
+        lecturas.c.tipo_combustible,
+        lecturas.c.fecha_hora_registro,
+        lecturas.c.galones,
+        case((lecturas.c.anterior.is_(None), 0), (diferencia > 0, diferencia), else_=0).label('consumo'),
+    ).subquery()
+
+
+# ============= ROLLUP DIARIO (consumo_diario) =============
+
+def recalcular_consumo_diario(conn, id_tanques, dia_desde=None, dia_hasta=None):
+    """Regenerar las filas de consumo_diario de un tanque entre dos días (inclusive).
+
+    Sin límites regenera toda la historia del tanque. Usa la conexión dada
+    para correr dentro de la transacción en curso.
+    """
+    inicio = datetime.combine(dia_desde, datetime.min.time()) if dia_desde else None
+    fin = datetime.combine(dia_hasta + timedelta(days=1), datetime.min.time()) if dia_hasta else None
+
+    # Incluir la lectura previa al rango para que LAG tenga con qué comparar
+    base = inicio
+    if inicio is not None:
+        base = conn.execute(
+            select(func.max(RegistroMedida.fecha_hora_registro)).where(
+                RegistroMedida.id_tanques == id_tanques,
+                RegistroMedida.fecha_hora_registro < inicio
+            )
+        ).scalar() or inicio
+
+    deltas = deltas_medicion(base, fin, solo_activos=False, id_tanques=id_tanques)
+    dia = func.date(deltas.c.fecha_hora_registro)
+    agregado = select(
+        dia, func.sum(deltas.c.consumo), func.count(), func.min(deltas.c.galones), func.max(deltas.c.galones)
+    ).group_by(dia)
+    if inicio is not None:
+        agregado = agregado.where(deltas.c.fecha_hora_registro >= inicio)
+
+    filas = {}
+    for d, consumido, lecturas, minimo, maximo in conn.execute(agregado):
+        filas[_a_dia(d)] = {
+            'galones_consumidos': float(consumido or 0),
+            'galones_cargados': 0.0,
+            'lecturas': lecturas,
+            'nivel_min': _a_float(minimo),
+            'nivel_max': _a_float(maximo),
+        }
+
+    def _sumar_cargue(d, galones):
+        fila = filas.setdefault(_a_dia(d), {
+            'galones_consumidos': 0.0, 'galones_cargados': 0.0,
+            'lecturas': 0, 'nivel_min': None, 'nivel_max': None,
+        })
+        fila['galones_cargados'] += _a_float(galones)
+
+    # Cargues y descargues guardan galones como texto/Numeric: se suman en Python
+    cargues = select(MedicionCargue.fecha, MedicionCargue.galones_totales).where(
+        MedicionCargue.id_tanques == id_tanques, MedicionCargue.fecha.is_not(None)
+    )
+    descargues = select(
+        Descargue.fecha, func.coalesce(Descargue.descargue_gl, Descargue.diferencia), Descargue.descargue_cm
+    ).where(
+        Descargue.tanque == str(id_tanques), Descargue.fecha.is_not(None)
+    )
+    if inicio is not None:
+        cargues = cargues.where(MedicionCargue.fecha >= inicio)
+        descargues = descargues.where(Descargue.fecha >= inicio.date())
+    if fin is not None:
+        cargues = cargues.where(MedicionCargue.fecha < fin)
+        descargues = descargues.where(Descargue.fecha < fin.date())
+    for fecha, galones in conn.execute(cargues):
+        _sumar_cargue(fecha, galones)
+    # Un descargue guardado sólo en cm se convierte como en la importación (tabla de aforo o fórmula)
+    sin_galones = []
+    for fecha, galones, descargue_cm in conn.execute(descargues):
+        if galones is None and descargue_cm is not None:
+            sin_galones.append((fecha, _a_float(descargue_cm)))
+        else:
+            _sumar_cargue(fecha, galones)
+    tanque = db.session.get(Tanque, id_tanques) if sin_galones else None
+    if tanque is not None:
+        convertidos = calibracion.convertir(tanque, [cm for _, cm in sin_galones])
+        for (fecha, _), galones in zip(sin_galones, convertidos):
+            _sumar_cargue(fecha, float(galones))
+
+    tabla = ConsumoDiario.__table__
+    borrar = delete(tabla).where(tabla.c.id_tanques == id_tanques)
+    if dia_desde is not None:
+        borrar = borrar.where(tabla.c.dia >= dia_desde)
+    if dia_hasta is not None:
+        borrar = borrar.where(tabla.c.dia <= dia_hasta)
+    conn.execute(borrar)
+
+    if filas:
+        ahora = datetime.utcnow()
+        conn.execute(insert(tabla), [
+            dict(id_tanques=id_tanques, dia=d, actualizado=ahora, **valores)
+            for d, valores in filas.items()
+        ])
+    return len(filas)
+
+
+def actualizar_consumo_diario(conn, rangos):
+    """Recalcular los días afectados por lecturas nuevas.
+
+    ``rangos`` es {id_tanques: (fecha_min, fecha_max)} de lo insertado. El
+    rango se extiende hasta la siguiente lectura del tanque, cuyo consumo
+    cambia al intercalar una lectura anterior (importaciones históricas).
+    """
+    for id_tanques, (fecha_min, fecha_max) in rangos.items():
+        siguiente = None
+        if isinstance(fecha_max, datetime):
+            siguiente = conn.execute(
+                select(func.min(RegistroMedida.fecha_hora_registro)).where(
+                    RegistroMedida.id_tanques == id_tanques,
+                    RegistroMedida.fecha_hora_registro > fecha_max
+                )
+            ).scalar()
+        dia_hasta = _a_dia(siguiente) if siguiente else _a_dia(fecha_max)
+        recalcular_consumo_diario(conn, id_tanques, _a_dia(fecha_min), dia_hasta)
+
+
+def reconstruir_consumo_diario(confirmar=True):
+    """Regenerar consumo_diario completo (backfill)"""
+    conn = db.session.connection()
+    conn.execute(delete(ConsumoDiario.__table__))
+    total = 0
+    for (id_tanques,) in db.session.query(Tanque.id_tanques).all():
+        total += recalcular_consumo_diario(conn, id_tanques)
+    if confirmar:
+        db.session.commit()
+    return total
+
+
+def _ampliar(rangos, id_tanques, fecha):
+    if not id_tanques or fecha is None:
+        return
+    actual = rangos.get(id_tanques)
+    if actual is None:
+        rangos[id_tanques] = (fecha, fecha)
+    else:
+        rangos[id_tanques] = (min(actual[0], fecha, key=_orden), max(actual[1], fecha, key=_orden))
+
+
+def _orden(fecha):
+    """Permite comparar date y datetime (los descargues sólo guardan la fecha)"""
+    return fecha if isinstance(fecha, datetime) else datetime.combine(fecha, datetime.min.time())
+
+
+@event.listens_for(Session, 'after_flush')
+def _actualizar_consumo_diario(session, flush_context):
+    """Mantener consumo_diario en la misma transacción que las nuevas lecturas"""
+    rangos = {}
+    for obj in list(session.new):
+        if isinstance(obj, RegistroMedida):
+            _ampliar(rangos, obj.id_tanques, obj.fecha_hora_registro)
+        elif isinstance(obj, MedicionCargue):
+            _ampliar(rangos, obj.id_tanques, obj.fecha)
+        elif isinstance(obj, Descargue):
+            try:
+                _ampliar(rangos, int(obj.tanque), obj.fecha)
+            except (ValueError, TypeError):
+                continue
+    if rangos:
+        actualizar_consumo_diario(session.connection(), rangos)
+
+
+# ============= LECTURA PARA DASHBOARDS Y REPORTES =============
+
+def _consulta_rollup(desde, hasta=None, solo_activos=True):
+    consulta = db.session.query(
+        ConsumoDiario.dia,
+        Tanque.tipo_combustible,
+        func.sum(ConsumoDiario.galones_consumidos),
+        func.sum(ConsumoDiario.galones_cargados),
+    ).join(Tanque, Tanque.id_tanques == ConsumoDiario.id_tanques).filter(
+        ConsumoDiario.dia >= _a_dia(desde)
+    )
+    if hasta is not None:
+        consulta = consulta.filter(ConsumoDiario.dia < _a_dia(hasta))
+    if solo_activos:
+        consulta = consulta.filter(Tanque.activo.is_(True))
+    return consulta.group_by(ConsumoDiario.dia, Tanque.tipo_combustible).order_by(ConsumoDiario.dia)
+
+
+def resumen_consumo(desde, hasta=None, solo_activos=True):
+    """Consumo agregado por tipo de combustible y por día, leído de consumo_diario"""
+    ventas_por_tipo = OrderedDict()
+    ventas_por_dia = OrderedDict()
+    for dia, tipo, consumido, _ in _consulta_rollup(desde, hasta, solo_activos):
+        consumido = float(consumido or 0)
+        if consumido <= 0:
+            continue
+        ventas_por_tipo[tipo] = ventas_por_tipo.get(tipo, 0) + consumido
+        ventas_por_dia[_fecha_texto(dia)] = ventas_por_dia.get(_fecha_texto(dia), 0) + consumido
+    return ventas_por_tipo, ventas_por_dia
+
+
+def cargado_por_tipo(desde, hasta=None, solo_activos=True):
+    """Galones cargados (cargues de emergencia y descargues) por tipo de combustible"""
+    cargado = OrderedDict()
+    for _, tipo, _, cargados in _consulta_rollup(desde, hasta, solo_activos):
+        cargados = float(cargados or 0)
+        if cargados > 0:
+            cargado[tipo] = cargado.get(tipo, 0) + cargados
+    return cargado
+
+
+def niveles_diarios(desde, hasta=None, solo_activos=True):
+    """Nivel mínimo diario (galones) por tanque: {'Tanque N - tipo': [('YYYY-MM-DD', galones), ...]}"""
+    consulta = db.session.query(
+        ConsumoDiario.id_tanques, Tanque.tipo_combustible, ConsumoDiario.dia, ConsumoDiario.nivel_min
+    ).join(Tanque, Tanque.id_tanques == ConsumoDiario.id_tanques).filter(
+        ConsumoDiario.dia >= _a_dia(desde),
+        ConsumoDiario.nivel_min.is_not(None)
+    )
+    if hasta is not None:
+        consulta = consulta.filter(ConsumoDiario.dia < _a_dia(hasta))
+    if solo_activos:
+        consulta = consulta.filter(Tanque.activo.is_(True))
+
+    niveles = OrderedDict()
+    for id_tanques, tipo, dia, nivel in consulta.order_by(ConsumoDiario.id_tanques, ConsumoDiario.dia):
+        niveles.setdefault(f"Tanque {id_tanques} - {tipo}", []).append((_fecha_texto(dia), float(nivel)))
+    return niveles
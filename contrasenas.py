@@ -0,0 +1,37 @@
+# contrasenas.py - Hash de contraseñas con bcrypt
+# Sin dependencias de la app: se importa en los procesos hijos del pool de CPU (trabajos.py)
+import bcrypt
+
+RONDAS_POR_DEFECTO = 12  # igual que bcrypt.gensalt()
+
+
+def hashear(password, rondas=RONDAS_POR_DEFECTO):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rondas)).decode('utf-8')
+
+
+def hashear_lote(passwords, rondas=RONDAS_POR_DEFECTO):
+    """Hashear una lista de contraseñas (unidad de trabajo del pool de procesos)"""
+    return [hashear(password, rondas) for password in passwords]
+
+
+def verificar(password, hash_guardado):
+    """True si la contraseña corresponde al hash; un hash vacío o corrupto nunca coincide"""
+    if not hash_guardado:
+        return False
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hash_guardado.encode('utf-8'))
+    except ValueError:
+        # hash corrupto o heredado
+        return False
+
+
+def rondas_de(hash_guardado):
+    """Costo con el que se generó un hash ("$2b$12$..." -> 12), o None si no es bcrypt"""
+    partes = (hash_guardado or '').split('$')
+    if len(partes) < 4 or not partes[2].isdigit():
+        return None
+    return int(partes[2])
+
+
+def necesita_rehash(hash_guardado, rondas=RONDAS_POR_DEFECTO):
+    return rondas_de(hash_guardado) != rondas
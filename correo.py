@@ -0,0 +1,219 @@
+# correo.py - Bandeja de salida: los correos se guardan con la transacción y se envían por lotes
+import secrets
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from email.utils import formataddr
+
+from flask_mail import Message
+from sqlalchemy import and_, delete, or_, select, update
+
+
+class BuzonCorreo:
+    """Envío de correo fuera de la petición.
+
+    ``encolar`` agrega el mensaje a correos_pendientes en la misma sesión que
+    el cambio que lo origina (si la transacción falla, el correo no sale).
+    Tras el commit se despierta un hilo que toma lotes de ``MAIL_LOTE``
+    correos, los envía por una sola conexión SMTP y reprograma los fallidos
+    con espera exponencial hasta ``MAIL_MAX_INTENTOS``. Los lotes se reclaman
+    con un UPDATE, así varios workers (o ``flask enviar-correos``) no envían
+    dos veces el mismo correo.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._ultima_purga = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MAIL_ENVIO_EN_HILO", True)
+        app.config.setdefault("MAIL_LOTE", 50)
+        app.config.setdefault("MAIL_MAX_INTENTOS", 6)
+        app.config.setdefault("MAIL_REINTENTO_BASE", 30)
+        app.config.setdefault("MAIL_REINTENTO_MAX", 3600)
+        app.config.setdefault("MAIL_INTERVALO", 60)
+        app.config.setdefault("MAIL_BLOQUEO_MINUTOS", 10)
+        app.config.setdefault("MAIL_RETENCION_DIAS", 7)
+        self.app = app
+        _registrar_aviso(self)
+        app.extensions["buzon"] = self
+
+    # ============= ENCOLAR =============
+
+    def encolar(self, msg):
+        """Guardar un flask_mail.Message en la bandeja de salida (el llamador hace commit)"""
+        from extensions import db
+        from models import CorreoPendiente
+
+        remitente = msg.sender
+        if isinstance(remitente, tuple):
+            remitente = formataddr(remitente)
+        correo = CorreoPendiente(
+            destinatarios=','.join(msg.recipients),
+            remitente=remitente,
+            asunto=msg.subject,
+            cuerpo=msg.body,
+            html=msg.html,
+            estado='pendiente',
+            intentos=0,
+            proximo_intento=datetime.utcnow(),
+        )
+        db.session.add(correo)
+        db.session.info["correo_avisar"] = True
+        return correo
+
+    def avisar(self):
+        """Despertar al remitente en segundo plano (lo arranca la primera vez)"""
+        if not self.app.config["MAIL_ENVIO_EN_HILO"]:
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="correo", daemon=True)
+                self._hilo.start()
+        self._despertar.set()
+
+    def _bucle(self):
+        from extensions import db
+        while True:
+            with self.app.app_context():
+                try:
+                    self.enviar_pendientes()
+                    if self._ultima_purga is None or time.monotonic() - self._ultima_purga >= 3600:
+                        self._ultima_purga = time.monotonic()
+                        self.purgar()
+                except Exception:
+                    traceback.print_exc()
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            # Sin aviso nuevo, revisar igual cada intervalo: hay reintentos programados
+            self._despertar.wait(self.app.config["MAIL_INTERVALO"])
+            self._despertar.clear()
+
+    # ============= ENVÍO =============
+
+    def enviar_pendientes(self):
+        """Enviar lotes hasta vaciar lo que ya toca; devuelve (enviados, reprogramados, fallidos)"""
+        totales = [0, 0, 0]
+        while True:
+            correos = self._reclamar()
+            if not correos:
+                break
+            for i, cantidad in enumerate(self._enviar_lote(correos)):
+                totales[i] += cantidad
+        return tuple(totales)
+
+    def _reclamar(self):
+        from extensions import db
+        from models import CorreoPendiente as C
+
+        ahora = datetime.utcnow()
+        # Un lote que quedó "enviando" (worker caído) se puede reclamar tras MAIL_BLOQUEO_MINUTOS
+        disponible = or_(
+            and_(C.estado == 'pendiente', C.proximo_intento <= ahora),
+            and_(C.estado == 'enviando',
+                 C.proximo_intento <= ahora - timedelta(minutes=self.app.config["MAIL_BLOQUEO_MINUTOS"])),
+        )
+        ids = db.session.execute(
+            select(C.id_correo).where(disponible)
+            .order_by(C.proximo_intento)
+            .limit(self.app.config["MAIL_LOTE"])
+        ).scalars().all()
+        if not ids:
+            return []
+
+        lote = secrets.token_hex(8)
+        db.session.execute(
+            update(C).where(C.id_correo.in_(ids), disponible)
+            .values(estado='enviando', lote=lote, proximo_intento=ahora)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return C.query.filter_by(lote=lote, estado='enviando').order_by(C.id_correo).all()
+
+    def _enviar_lote(self, correos):
+        from extensions import db
+
+        mail = self.app.extensions["mail"]
+        try:
+            # Una conexión SMTP para todo el lote
+            with mail.connect() as conexion:
+                for correo in correos:
+                    try:
+                        conexion.send(self._mensaje(correo))
+                    except Exception as e:
+                        self._reprogramar(correo, e)
+                    else:
+                        correo.estado = 'enviado'
+                        correo.enviado = datetime.utcnow()
+                        correo.ultimo_error = None
+        except Exception as e:
+            # No hubo conexión (o se cayó): lo que no salió se reintenta
+            print(f"Error de conexión SMTP: {e}")
+            for correo in correos:
+                if correo.estado == 'enviando':
+                    self._reprogramar(correo, e)
+        db.session.commit()
+
+        enviados = sum(1 for c in correos if c.estado == 'enviado')
+        fallidos = sum(1 for c in correos if c.estado == 'fallido')
+        return enviados, len(correos) - enviados - fallidos, fallidos
+
+    @staticmethod
+    def _mensaje(correo):
+        return Message(
+            subject=correo.asunto,
+            recipients=correo.destinatarios.split(','),
+            body=correo.cuerpo,
+            html=correo.html,
+            sender=correo.remitente,
+        )
+
+    def _reprogramar(self, correo, error):
+        config = self.app.config
+        correo.intentos += 1
+        correo.ultimo_error = str(error)[:1000]
+        if correo.intentos >= config["MAIL_MAX_INTENTOS"]:
+            correo.estado = 'fallido'
+            return
+        espera = min(config["MAIL_REINTENTO_BASE"] * 2 ** (correo.intentos - 1), config["MAIL_REINTENTO_MAX"])
+        correo.estado = 'pendiente'
+        correo.proximo_intento = datetime.utcnow() + timedelta(seconds=espera)
+
+    def purgar(self):
+        """Borrar los correos enviados hace más de MAIL_RETENCION_DIAS"""
+        from extensions import db
+        from models import CorreoPendiente as C
+
+        limite = datetime.utcnow() - timedelta(days=self.app.config["MAIL_RETENCION_DIAS"])
+        borrados = db.session.execute(
+            delete(C).where(C.estado == 'enviado', C.enviado < limite)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return borrados
+
+
+def _registrar_aviso(buzon):
+    """Despertar al remitente sólo cuando el correo encolado quedó confirmado"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    if getattr(buzon, "_eventos_registrados", False):
+        return
+    buzon._eventos_registrados = True
+
+    @event.listens_for(Session, "after_commit")
+    def _avisar(session):
+        if session.info.pop("correo_avisar", None):
+            buzon.avisar()
+
+    @event.listens_for(Session, "after_rollback")
+    def _descartar(session):
+        session.info.pop("correo_avisar", None)
@@ -4,7 +4,7 @@
 # ADMIN_USERNAME=admin ADMIN_NUM_DOC=0000 ADMIN_EMAIL=admin@local ADMIN_PASSWORD=ChangeMe123! python create_admin.py
 
 import os
-import bcrypt
+import contrasenas
 from app_factory import create_app
 from extensions import db
 from models import Empleado
@@ -24,7 +24,7 @@ with app.app_context():
         (Empleado.numero_documento == ADMIN_NUM_DOC)
     ).first()
 
-    hashed = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = contrasenas.hashear(ADMIN_PASSWORD, app.config['BCRYPT_ROUNDS'])
 
     if admin:
         admin.usuario = ADMIN_USERNAME
@@ -0,0 +1,502 @@
+# exportaciones.py - Exportación de datos: columnas, consultas por lotes y escritores en streaming
+import csv
+import gzip
+import io
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from extensions import db, trabajos
+from models import Empleado, Tanque, RegistroMedida, Descargue
+from utils import registrar_auditoria
+
+TIPOS = ('empleados', 'tanques', 'mediciones', 'descargues')
+
+# Filas por lote al leer de la BD (cursor del lado del servidor) y al escribir
+LOTE = 1000
+# Filas por record batch / row group en Parquet y Arrow
+LOTE_COLUMNAR = 65536
+
+COLUMNARES = ('parquet', 'arrow')
+
+# ``lotes`` es None si el tipo no tiene versión columnar
+Exportacion = namedtuple('Exportacion', ['tipo', 'headers', 'filas', 'nombre', 'lotes'])
+
+
+# ============= DEFINICIÓN DE CADA EXPORTACIÓN =============
+
+def _filas_empleados(filtros):
+    for emp in Empleado.query.order_by(Empleado.id_empleados).yield_per(LOTE):
+        yield [
+            emp.id_empleados,
+            emp.usuario,
+            emp.nombre_empleado,
+            emp.apellido_empleado,
+            emp.numero_documento,
+            emp.email,
+            emp.telefono or '',
+            emp.direccion or '',
+            emp.cargo_establecido,
+            'Sí' if emp.activo else 'No',
+            'Sí' if emp.email_confirmado else 'No',
+            emp.fecha_creacion.strftime('%Y-%m-%d %H:%M') if emp.fecha_creacion else ''
+        ]
+
+
+def _filas_tanques(filtros):
+    # Pocas filas: se cargan juntas para precargar niveles en una consulta
+    for tanque in Tanque.precargar_niveles(Tanque.query.order_by(Tanque.id_tanques).all()):
+        yield [
+            tanque.id_tanques,
+            tanque.tipo_combustible,
+            tanque.capacidad,
+            tanque.contenido or 0,
+            tanque.volumen_m3,
+            'Sí' if tanque.activo else 'No',
+            tanque.fecha_creacion.strftime('%Y-%m-%d') if tanque.fecha_creacion else ''
+        ]
+
+
+def _filtros_mediciones(filtros):
+    return dict(
+        fecha_desde=filtros.get('fecha_desde'),
+        fecha_hasta=filtros.get('fecha_hasta'),
+        id_tanques=int(filtros['tanque_id']) if filtros.get('tanque_id') else None
+    )
+
+
+def _filtros_descargues(filtros):
+    return dict(fecha_desde=filtros.get('fecha_desde'), fecha_hasta=filtros.get('fecha_hasta'))
+
+
+def _filas_mediciones(filtros):
+    # Tanque y empleado vienen en el mismo SELECT: una consulta para toda la exportación
+    query = RegistroMedida.consulta(**_filtros_mediciones(filtros))
+
+    for med in query.order_by(RegistroMedida.fecha_hora_registro.desc()).yield_per(LOTE):
+        yield [
+            med.id_registro_medidas,
+            med.fecha_hora_registro.strftime('%Y-%m-%d %H:%M:%S') if med.fecha_hora_registro else '',
+            f"Tanque {med.tanque.id_tanques}" if med.tanque else 'N/A',
+            med.tanque.tipo_combustible if med.tanque else 'N/A',
+            med.medida_combustible or '',
+            med.galones or 0,
+            med.tipo_medida or 'rutinario',
+            med.empleado.nombre_empleado if med.empleado else 'N/A',
+            med.novedad or ''
+        ]
+
+
+def _filas_descargues(filtros):
+    query = Descargue.consulta(**_filtros_descargues(filtros))
+
+    for desc in query.order_by(Descargue.fecha.desc()).yield_per(LOTE):
+        yield [
+            desc.idDescargue,
+            desc.fecha.strftime('%Y-%m-%d') if desc.fecha else '',
+            desc.tanque or '',
+            float(desc.medida_inicial_gl) if desc.medida_inicial_gl else 0,
+            float(desc.descargue_gl) if desc.descargue_gl else 0,
+            float(desc.medida_final_gl) if desc.medida_final_gl else 0,
+            float(desc.diferencia) if desc.diferencia else 0,
+            desc.empleado.nombre_empleado if desc.empleado else 'N/A',
+            desc.kit_derrames or 'no',
+            desc.extintores or 'no',
+            desc.observaciones1 or ''
+        ]
+
+
+# ============= VERSIÓN COLUMNAR (Parquet / Arrow) =============
+
+def _numero(valor):
+    """Texto o Decimal → float (None si no es numérico)"""
+    if valor is None:
+        return None
+    try:
+        return float(str(valor).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _columnas_mediciones(pa):
+    # (nombre, tipo arrow, conversión) en el orden del SELECT
+    return [
+        ('id_registro_medidas', pa.int64(), None),
+        ('fecha_hora_registro', pa.timestamp('us'), None),
+        ('id_tanques', pa.int32(), None),
+        ('tipo_combustible', pa.dictionary(pa.int32(), pa.string()), None),
+        ('medida_cm', pa.float64(), _numero),
+        ('galones', pa.float64(), _numero),
+        ('tipo_medida', pa.dictionary(pa.int32(), pa.string()), lambda v: v or 'rutinario'),
+        ('empleado', pa.string(), None),
+        ('novedad', pa.string(), None),
+    ]
+
+
+def _consulta_columnar_mediciones(filtros):
+    return select(
+        RegistroMedida.id_registro_medidas,
+        RegistroMedida.fecha_hora_registro,
+        RegistroMedida.id_tanques,
+        Tanque.tipo_combustible,
+        RegistroMedida.medida_combustible,
+        RegistroMedida.galones,
+        RegistroMedida.tipo_medida,
+        Empleado.nombre_empleado,
+        RegistroMedida.novedad,
+    ).outerjoin(Tanque, Tanque.id_tanques == RegistroMedida.id_tanques).outerjoin(
+        Empleado, Empleado.id_empleados == RegistroMedida.id_empleados
+    ).where(*RegistroMedida.criterios(**_filtros_mediciones(filtros))).order_by(
+        RegistroMedida.fecha_hora_registro.desc()
+    )
+
+
+def _columnas_descargues(pa):
+    return [
+        ('id_descargue', pa.int64(), None),
+        ('fecha', pa.date32(), None),
+        ('tanque', pa.string(), None),
+        ('medida_inicial_gl', pa.float64(), _numero),
+        ('descargue_gl', pa.float64(), _numero),
+        ('medida_final_gl', pa.float64(), _numero),
+        ('diferencia', pa.float64(), _numero),
+        ('empleado', pa.string(), None),
+        ('kit_derrames', pa.dictionary(pa.int32(), pa.string()), None),
+        ('extintores', pa.dictionary(pa.int32(), pa.string()), None),
+        ('observaciones', pa.string(), None),
+    ]
+
+
+def _consulta_columnar_descargues(filtros):
+    return select(
+        Descargue.idDescargue,
+        Descargue.fecha,
+        Descargue.tanque,
+        Descargue.medida_inicial_gl,
+        Descargue.descargue_gl,
+        Descargue.medida_final_gl,
+        Descargue.diferencia,
+        Empleado.nombre_empleado,
+        Descargue.kit_derrames,
+        Descargue.extintores,
+        Descargue.observaciones1,
+    ).outerjoin(Empleado, Empleado.id_empleados == Descargue.id_empleados).where(
+        *Descargue.criterios(**_filtros_descargues(filtros))
+    ).order_by(Descargue.fecha.desc())
+
+
+def _lotes_arrow(columnas, consulta):
+    """Generador de (schema, record batches) leyendo sólo las columnas necesarias"""
+    import pyarrow as pa
+
+    columnas = columnas(pa)
+    esquema = pa.schema([pa.field(nombre, tipo) for nombre, tipo, _ in columnas])
+    yield esquema
+
+    resultado = db.session.execute(consulta.execution_options(yield_per=LOTE_COLUMNAR))
+    for filas in resultado.partitions():
+        arrays = []
+        for (nombre, tipo, convertir), valores in zip(columnas, zip(*filas)):
+            if convertir is not None:
+                valores = [convertir(v) for v in valores]
+            if pa.types.is_dictionary(tipo):
+                arrays.append(pa.array(valores, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(valores, type=tipo))
+        yield pa.RecordBatch.from_arrays(arrays, schema=esquema)
+
+
+_COLUMNARES = {
+    'mediciones': (_columnas_mediciones, _consulta_columnar_mediciones),
+    'descargues': (_columnas_descargues, _consulta_columnar_descargues),
+}
+
+
+_DEFINICIONES = {
+    'empleados': (
+        ['ID', 'Usuario', 'Nombre', 'Apellido', 'Documento', 'Email', 'Teléfono',
+         'Dirección', 'Cargo', 'Activo', 'Email Confirmado', 'Fecha Creación'],
+        _filas_empleados,
+    ),
+    'tanques': (
+        ['ID', 'Tipo Combustible', 'Capacidad (gal)', 'Contenido (gal)',
+         'Volumen (m³)', 'Activo', 'Fecha Creación'],
+        _filas_tanques,
+    ),
+    'mediciones': (
+        ['ID', 'Fecha/Hora', 'Tanque', 'Tipo Combustible', 'Medida (cm)',
+         'Galones', 'Tipo Medición', 'Empleado', 'Novedad'],
+        _filas_mediciones,
+    ),
+    'descargues': (
+        ['ID', 'Fecha', 'Tanque', 'Medida Inicial (gl)', 'Descargue (gl)',
+         'Medida Final (gl)', 'Diferencia', 'Empleado', 'Kit Derrames',
+         'Extintores', 'Observaciones'],
+        _filas_descargues,
+    ),
+}
+
+
+def preparar_exportacion(tipo, filtros=None):
+    """Devolver la Exportacion de ``tipo`` o None si el tipo no existe.
+
+    ``filas`` es un generador perezoso: la consulta corre al iterarlo.
+    """
+    if tipo not in _DEFINICIONES:
+        return None
+    headers, generador = _DEFINICIONES[tipo]
+    filtros = dict(filtros or {})
+    nombre = f"{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    lotes = None
+    if tipo in _COLUMNARES:
+        columnas, consulta = _COLUMNARES[tipo]
+        lotes = lambda: _lotes_arrow(columnas, consulta(filtros))
+    return Exportacion(tipo, headers, lambda: generador(filtros), nombre, lotes)
+
+
+# ============= ESCRITORES =============
+
+def escribir_csv(headers, filas, estado=None):
+    """Generador de trozos CSV (con BOM UTF-8) para una respuesta en streaming.
+
+    Si se pasa ``estado`` (dict), deja en estado['registros'] el total escrito.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    # El encabezado sale de inmediato: el primer byte no espera a la consulta
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    registros = 0
+    for fila in filas:
+        writer.writerow(fila)
+        registros += 1
+        if registros % LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+    if estado is not None:
+        estado['registros'] = registros
+
+
+def columnar_disponible():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _Salida:
+    """Destino de escritura para pyarrow que acumula bytes hasta que se vacían"""
+
+    def __init__(self):
+        self.trozos = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.trozos.append(data)
+        self.posicion += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        data = b''.join(self.trozos)
+        self.trozos = []
+        return data
+
+
+def escribir_columnar(lotes, formato, estado=None):
+    """Generador de bytes Parquet (zstd) o Arrow IPC stream (zstd), un lote a la vez"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    lotes = iter(lotes)
+    esquema = next(lotes)
+    salida = _Salida()
+    archivo = pa.PythonFile(salida, mode='w')
+    if formato == 'parquet':
+        writer = pq.ParquetWriter(archivo, esquema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(archivo, esquema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    registros = 0
+    try:
+        for lote in lotes:
+            writer.write_batch(lote)
+            registros += lote.num_rows
+            datos = salida.vaciar()
+            if datos:
+                yield datos
+    finally:
+        writer.close()
+    yield salida.vaciar()
+    if estado is not None:
+        estado['registros'] = registros
+
+
+def escribir_xlsx(headers, filas, destino, titulo, estado=None):
+    """Escribir un XLSX fila por fila con xlsxwriter en modo constant_memory.
+
+    Cada fila se vuelca a disco al pasar a la siguiente, así la memoria no
+    crece con el número de registros. Los anchos de columna se calculan
+    mientras se escribe y los formatos se comparten entre todas las celdas.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    try:
+        ws = workbook.add_worksheet(titulo[:31])
+        formato_encabezado = workbook.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'font_size': 12,
+            'bg_color': '#E10000', 'align': 'center', 'valign': 'vcenter',
+        })
+        formato_celda = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
+
+        anchos = [len(str(h)) for h in headers]
+        ws.write_row(0, 0, headers, formato_encabezado)
+
+        registros = 0
+        for registros, fila in enumerate(filas, 1):
+            ws.write_row(registros, 0, fila, formato_celda)
+            for col, valor in enumerate(fila):
+                largo = len(str(valor))
+                if largo > anchos[col]:
+                    anchos[col] = largo
+
+        for col, ancho in enumerate(anchos):
+            ws.set_column(col, col, min(ancho + 2, 50))
+        ws.freeze_panes(1, 0)
+    finally:
+        workbook.close()
+
+    if estado is not None:
+        estado['registros'] = registros
+    return destino
+
+
+# ============= EXPORTACIONES EN SEGUNDO PLANO =============
+
+# formato → (extensión, mimetype, acción de auditoría)
+FORMATOS = {
+    'csv': ('csv', 'text/csv', 'EXPORT_CSV'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'EXPORT_EXCEL'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet', 'EXPORT_PARQUET'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream', 'EXPORT_ARROW'),
+}
+
+
+def _directorio():
+    directorio = current_app.config['EXPORTS_DIR']
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def solicitar_exportacion(exportacion, filtros, formato, comprimir, id_empleados, ip_address):
+    """Encolar una exportación y devolver el id del trabajo"""
+    limpiar_exportaciones()
+    extension = FORMATOS[formato][0]
+    nombre = f"{exportacion.nombre}.{extension}" + ('.gz' if comprimir else '')
+    trabajo_id = trabajos.crear(
+        'exportacion', nombre=nombre, exportacion=exportacion.tipo, formato=formato,
+        comprimido=comprimir, id_empleados=id_empleados
+    )
+    trabajos.en_hilo(trabajo_id, _ejecutar_exportacion, exportacion.tipo, dict(filtros),
+                     formato, comprimir, id_empleados, ip_address)
+    return trabajo_id
+
+
+def _ejecutar_exportacion(trabajo_id, tipo, filtros, formato, comprimir, id_empleados, ip_address):
+    """Escribir el archivo de la exportación en EXPORTS_DIR (corre en trabajos.en_hilo)"""
+    exportacion = preparar_exportacion(tipo, filtros)
+    extension, _, accion = FORMATOS[formato]
+    destino = os.path.join(_directorio(), f"{trabajo_id}.{extension}" + ('.gz' if comprimir else ''))
+    temporal = destino + '.parcial'
+    estado = {}
+
+    try:
+        if formato == 'csv':
+            abrir = gzip.open if comprimir else open
+            with abrir(temporal, 'wt', encoding='utf-8', newline='') as f:
+                for trozo in escribir_csv(exportacion.headers, exportacion.filas(), estado):
+                    f.write(trozo)
+        elif formato in COLUMNARES:
+            abrir = gzip.open if comprimir else open
+            with abrir(temporal, 'wb') as f:
+                for trozo in escribir_columnar(exportacion.lotes(), formato, estado):
+                    f.write(trozo)
+        else:
+            xlsx = temporal + '.xlsx' if comprimir else temporal
+            escribir_xlsx(exportacion.headers, exportacion.filas(), xlsx, tipo.capitalize(), estado)
+            if comprimir:
+                with open(xlsx, 'rb') as origen, gzip.open(temporal, 'wb') as f:
+                    shutil.copyfileobj(origen, f)
+                os.remove(xlsx)
+        os.replace(temporal, destino)
+    except Exception:
+        for ruta in (temporal, temporal + '.xlsx'):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        raise
+
+    registros = estado.get('registros', 0)
+    registrar_auditoria(accion, tipo, None, None, {
+        'formato': formato,
+        'registros': registros,
+        'comprimido': comprimir,
+        'trabajo': trabajo_id,
+    }, id_empleados=id_empleados, ip_address=ip_address)
+    return {'ruta': destino, 'registros': registros, 'bytes': os.path.getsize(destino)}
+
+
+def ruta_exportacion(trabajo_id, id_empleados):
+    """(ruta, estado) del archivo de una exportación completada del empleado; ruta None si no está"""
+    estado = trabajos.estado(trabajo_id)
+    if not estado or estado.get('tipo') != 'exportacion' or estado.get('id_empleados') != id_empleados:
+        return None, None
+    if estado.get('estado') != 'completado':
+        return None, estado
+    ruta = os.path.realpath((estado.get('resultado') or {}).get('ruta') or '')
+    if not ruta.startswith(os.path.realpath(_directorio()) + os.sep) or not os.path.exists(ruta):
+        return None, estado
+    return ruta, estado
+
+
+def limpiar_exportaciones():
+    """Borrar archivos con más de EXPORTS_RETENCION_HORAS y marcar sus trabajos como expirados"""
+    limite = time.time() - current_app.config['EXPORTS_RETENCION_HORAS'] * 3600
+    directorio = _directorio()
+    borrados = 0
+    for archivo in os.listdir(directorio):
+        ruta = os.path.join(directorio, archivo)
+        try:
+            if os.path.getmtime(ruta) >= limite:
+                continue
+            os.remove(ruta)
+        except OSError:
+            continue
+        borrados += 1
+        if not archivo.endswith('.parcial'):
+            trabajos.actualizar(archivo.split('.', 1)[0], estado='expirado')
+    return borrados
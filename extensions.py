@@ -5,6 +5,12 @@ from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
 from sqlalchemy.orm import DeclarativeBase
+from autenticacion import ServicioContrasenas
+from cache import StatsCache
+from correo import BuzonCorreo
+from identidad import CacheIdentidad
+from sesiones import RegistroSesiones
+from trabajos import GestorTrabajos
 
 class Base(DeclarativeBase):
     pass
@@ -15,3 +21,9 @@ login_manager = LoginManager()
 migrate = Migrate()
 csrf = CSRFProtect()
 mail = Mail()
+buzon = BuzonCorreo()
+stats_cache = StatsCache()
+identidades = CacheIdentidad()
+claves = ServicioContrasenas()
+sesiones = RegistroSesiones()
+trabajos = GestorTrabajos()
@@ -4,19 +4,7 @@
 from app_factory import create_app
 from extensions import db
 from models import Tanque
-
-def calcular_altura_maxima(capacidad_galones):
-    """Calcular altura máxima en cm basada en capacidad del tanque"""
-    radio_cm = 125  # 2.5m de diámetro
-    
-    # Volumen en cm³ = capacidad en galones * 3785.411784
-    volumen_cm3 = capacidad_galones * 3785.411784
-    
-    # Altura = Volumen / (π * r²)
-    area_base = 3.14159 * (radio_cm ** 2)
-    altura_cm = volumen_cm3 / area_base
-    
-    return round(altura_cm, 2)
+from calibracion import calcular_altura_maxima
 
 app = create_app()
 
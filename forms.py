@@ -253,10 +253,23 @@ class CargaMasivaForm(FlaskForm):
     tipo_carga = SelectField('Tipo de Carga *', choices=[
         ('empleados', 'Empleados'),
         ('tanques', 'Tanques'),
-        ('mediciones', 'Mediciones')
+        ('mediciones', 'Mediciones'),
+        ('descargues', 'Descargues'),
+        ('cargues', 'Cargues de emergencia')
     ], validators=[DataRequired(message="Campo obligatorio")])
+    por_bloques = BooleanField('Importar por bloques (archivos grandes, reanudable)')
+    segundo_plano = BooleanField('Procesar en segundo plano')
+    simular = BooleanField('Solo validar (no guarda nada)')
+    actualizar = BooleanField('Actualizar mediciones existentes (mismo tanque y fecha)')
     submit = SubmitField('Cargar Datos')
 
+class CalibracionForm(FlaskForm):
+    archivo = FileField('Tabla de Aforo CSV/Excel *', validators=[
+        DataRequired(message="Debe seleccionar un archivo"),
+        FileAllowed(['csv', 'xlsx', 'xls'], 'Solo archivos CSV o Excel')
+    ])
+    submit = SubmitField('Cargar Tabla')
+
 class FiltroMedicionesForm(FlaskForm):
     fecha_desde = DateField('Desde', validators=[Optional()])
     fecha_hasta = DateField('Hasta', validators=[Optional()])
@@ -34,4 +34,24 @@ cols_mediciones = ["tanque_id","medida_combustible","galones","tipo_medida","nov
 pd.DataFrame(mediciones, columns=cols_mediciones).to_csv("mediciones_carga_masiva.csv", index=False)
 pd.DataFrame(mediciones, columns=cols_mediciones).to_excel("mediciones_carga_masiva.xlsx", index=False)
 
-print("Archivos generados: empleados, tanques, mediciones (.csv y .xlsx)")
\ No newline at end of file
+# --- DESCARGUES ---
+# Los galones vacíos se calculan desde los cm con la tabla de aforo del tanque
+descargues = [
+    [1, "2025-10-28", 45.5, 30.0, 2, "", "si", "si", "Remito 1045"],
+    [2, "2025-10-28", 60.0, 25.5, 3, 3100.0, "si", "no", "Remito 1046"],
+    [1, "2025-10-30", 40.2, 35.0, 2, "", "si", "si", ""],
+]
+cols_descargues = ["tanque_id","fecha","medida_inicial_cm","descargue_cm","empleado_id","medida_final_gl","kit_derrames","brillante","observaciones1"]
+pd.DataFrame(descargues, columns=cols_descargues).to_csv("descargues_carga_masiva.csv", index=False)
+pd.DataFrame(descargues, columns=cols_descargues).to_excel("descargues_carga_masiva.xlsx", index=False)
+
+# --- CARGUES DE EMERGENCIA ---
+cargues = [
+    [3, "2025-10-28 15:00:00", 30.2, 55.0, 4, "pipa", ""],
+    [1, "2025-10-29 09:30:00", 44.8, 70.1, 2, "camion", 1500.0],
+]
+cols_cargues = ["tanque_id","fecha","medida_anterior","medida_posterior","empleado_id","formato_de_entrega","galones_totales"]
+pd.DataFrame(cargues, columns=cols_cargues).to_csv("cargues_carga_masiva.csv", index=False)
+pd.DataFrame(cargues, columns=cols_cargues).to_excel("cargues_carga_masiva.xlsx", index=False)
+
+print("Archivos generados: empleados, tanques, mediciones, descargues, cargues (.csv y .xlsx)")
\ No newline at end of file
@@ -0,0 +1,116 @@
+# graficos_pdf.py - Gráficos vectoriales para los PDF con reportlab.graphics (sin matplotlib)
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.charts.piecharts import Pie
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.graphics.widgets.markers import makeMarker
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+
+COLORES = ['#E10000', '#00E1E1', '#00E100', '#FFA500', '#8A2BE2']
+
+
+def _titulo(drawing, texto, ancho, alto):
+    drawing.add(String(ancho / 2, alto - 16, texto, fontName='Helvetica-Bold',
+                       fontSize=14, textAnchor='middle'))
+
+
+def _etiqueta_vertical(texto, x, y):
+    """Texto girado 90° (etiqueta del eje Y)"""
+    return Group(String(0, 0, texto, fontSize=10, textAnchor='middle'), transform=(0, 1, -1, 0, x, y))
+
+
+def grafico_torta(datos, titulo, ancho=5 * inch, alto=3.5 * inch, colores=COLORES):
+    """Torta con etiquetas 'tipo (xx.x%)' — datos = {etiqueta: valor}"""
+    drawing = Drawing(ancho, alto)
+    _titulo(drawing, titulo, ancho, alto)
+
+    etiquetas = list(datos.keys())
+    valores = [float(v) for v in datos.values()]
+    total = sum(valores) or 1
+
+    pie = Pie()
+    diametro = min(ancho, alto - 60)
+    pie.width = pie.height = diametro
+    pie.x = (ancho - diametro) / 2
+    pie.y = (alto - 30 - diametro) / 2
+    pie.data = valores
+    pie.labels = [f"{e} ({v / total * 100:.1f}%)" for e, v in zip(etiquetas, valores)]
+    pie.startAngle = 90
+    pie.direction = 'anticlockwise'
+    pie.simpleLabels = 0
+    pie.slices.strokeColor = colors.white
+    pie.slices.strokeWidth = 1
+    pie.slices.fontSize = 9
+    for i in range(len(valores)):
+        pie.slices[i].fillColor = colors.HexColor(colores[i % len(colores)])
+    drawing.add(pie)
+    return drawing
+
+
+def grafico_barras(etiquetas, valores, titulo, eje_x='', eje_y='',
+                   ancho=6 * inch, alto=3 * inch, color='#E10000', borde='#C20000'):
+    """Barras verticales con el valor encima de cada barra"""
+    drawing = Drawing(ancho, alto)
+    _titulo(drawing, titulo, ancho, alto)
+
+    chart = VerticalBarChart()
+    chart.x = 50
+    chart.y = 50
+    chart.width = ancho - 70
+    chart.height = alto - 90
+    chart.data = [[float(v) for v in valores]]
+    chart.categoryAxis.categoryNames = list(etiquetas)
+    chart.categoryAxis.labels.angle = 45
+    chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.categoryAxis.labels.fontSize = 8
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 8
+    chart.bars[0].fillColor = colors.HexColor(color)
+    chart.bars[0].strokeColor = colors.HexColor(borde)
+    chart.barLabelFormat = '%d'
+    chart.barLabels.nudge = 6
+    chart.barLabels.fontSize = 7
+    drawing.add(chart)
+
+    if eje_x:
+        drawing.add(String(chart.x + chart.width / 2, 4, eje_x, fontSize=10, textAnchor='middle'))
+    if eje_y:
+        drawing.add(_etiqueta_vertical(eje_y, 12, chart.y + chart.height / 2))
+    return drawing
+
+
+def grafico_lineas(series, titulo, eje_y='', ancho=6 * inch, alto=3 * inch, colores=COLORES):
+    """Líneas (p. ej. nivel de tanques) — series = {nombre: [(x, y), ...]} con x numérico"""
+    drawing = Drawing(ancho, alto)
+    _titulo(drawing, titulo, ancho, alto)
+
+    nombres = [n for n, puntos in series.items() if puntos]
+    plot = LinePlot()
+    plot.x = 50
+    plot.y = 40
+    plot.width = ancho - 170
+    plot.height = alto - 80
+    plot.data = [[(float(x), float(y)) for x, y in series[n]] for n in nombres]
+    plot.xValueAxis.labels.fontSize = 8
+    plot.yValueAxis.labels.fontSize = 8
+    plot.yValueAxis.valueMin = 0
+    for i, _ in enumerate(nombres):
+        color = colors.HexColor(colores[i % len(colores)])
+        plot.lines[i].strokeColor = color
+        plot.lines[i].strokeWidth = 1.5
+        plot.lines[i].symbol = makeMarker('Circle', size=3, fillColor=color, strokeColor=color)
+    drawing.add(plot)
+
+    leyenda = Legend()
+    leyenda.x = plot.x + plot.width + 15
+    leyenda.y = plot.y + plot.height
+    leyenda.fontSize = 8
+    leyenda.alignment = 'right'
+    leyenda.colorNamePairs = [(colors.HexColor(colores[i % len(colores)]), n) for i, n in enumerate(nombres)]
+    drawing.add(leyenda)
+
+    if eje_y:
+        drawing.add(_etiqueta_vertical(eje_y, 12, plot.y + plot.height / 2))
+    return drawing
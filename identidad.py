@@ -0,0 +1,144 @@
+# identidad.py - Identidad cacheada para Flask-Login (sin consultar empleado en cada petición)
+from flask_login import UserMixin
+
+from cache import MemoriaBackend, crear_backend, _SIN_VALOR
+
+
+class Principal(UserMixin):
+    """Snapshot inmutable del empleado autenticado.
+
+    Guarda sólo lo que usan los decoradores de rol y la barra de navegación.
+    Cualquier otro atributo (relaciones, ``check_password``...) se delega en
+    la fila completa de Empleado, que se consulta sólo si se pide.
+    """
+
+    CAMPOS = ('id_empleados', 'cargo_establecido', 'activo', 'email_confirmado',
+              'nombre_empleado', 'apellido_empleado', 'email')
+
+    def __init__(self, *valores):
+        self.__dict__.update(zip(self.CAMPOS, valores))
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError(f"Principal es inmutable: modifique current_user.empleado.{nombre}")
+
+    def __getattr__(self, nombre):
+        # Sólo se llama para atributos que no están en el snapshot
+        if nombre.startswith('__') or nombre in self.CAMPOS:
+            raise AttributeError(nombre)
+        return getattr(self.empleado, nombre)
+
+    def __repr__(self):
+        return f'<Principal {self.id_empleados} {self.cargo_establecido}>'
+
+    @property
+    def empleado(self):
+        """Fila completa del empleado (el identity map la reutiliza durante la petición)"""
+        from extensions import db
+        from models import Empleado
+        return db.session.get(Empleado, self.id_empleados)
+
+    def get_id(self):
+        return str(self.id_empleados)
+
+    @property
+    def idEmpleados(self):
+        return self.id_empleados
+
+    @property
+    def rol(self):
+        return self.cargo_establecido
+
+    @property
+    def confirmado(self):
+        return self.email_confirmado
+
+    @property
+    def is_active(self):
+        return self.activo and self.email_confirmado
+
+
+class CacheIdentidad:
+    """Principales por id de empleado con TTL corto y expulsión LRU.
+
+    Se invalidan al hacer commit de cualquier cambio en Empleado; con el
+    backend "memoria" los demás workers se enteran al vencer el TTL.
+    """
+
+    def __init__(self, app=None):
+        self.backend = MemoriaBackend()
+        self.ttl = 30
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("IDENTIDAD_TTL", 30)
+        app.config.setdefault("IDENTIDAD_MAX_ENTRIES", 1024)
+        self.backend = crear_backend(app, "identidad", app.config["IDENTIDAD_MAX_ENTRIES"])
+        self.ttl = app.config["IDENTIDAD_TTL"]
+        _registrar_invalidacion(self)
+        app.extensions["identidad"] = self
+
+    @staticmethod
+    def _clave(id_empleados):
+        return f"empleado:{id_empleados}"
+
+    def _consultar(self, id_empleados):
+        from extensions import db
+        from models import Empleado
+        fila = db.session.execute(
+            db.select(*(getattr(Empleado, campo) for campo in Principal.CAMPOS))
+            .where(Empleado.id_empleados == id_empleados)
+        ).first()
+        return Principal(*fila) if fila else None
+
+    def obtener(self, id_empleados):
+        """Principal del empleado, o None si no existe"""
+        clave = self._clave(id_empleados)
+        try:
+            principal = self.backend.get(clave)
+        except Exception as e:
+            print(f"Error leyendo caché de identidad: {e}")
+            return self._consultar(id_empleados)
+        if principal is not _SIN_VALOR:
+            return principal
+
+        principal = self._consultar(id_empleados)
+        if principal is not None:
+            try:
+                self.backend.set(clave, principal, self.ttl)
+            except Exception as e:
+                print(f"Error guardando caché de identidad: {e}")
+        return principal
+
+    def invalidar(self, *ids_empleados):
+        for id_empleados in ids_empleados:
+            try:
+                self.backend.delete(self._clave(id_empleados))
+            except Exception as e:
+                print(f"Error invalidando identidad ({id_empleados}): {e}")
+
+
+def _registrar_invalidacion(identidades):
+    """Invalidar tras el commit los principales de los empleados modificados o borrados"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    if getattr(identidades, "_eventos_registrados", False):
+        return
+    identidades._eventos_registrados = True
+
+    @event.listens_for(Session, "after_flush")
+    def _marcar(session, flush_context):
+        for obj in list(session.dirty) + list(session.deleted):
+            if type(obj).__name__ == 'Empleado' and obj.id_empleados is not None:
+                session.info.setdefault("identidad_invalidar", set()).add(obj.id_empleados)
+
+    @event.listens_for(Session, "after_commit")
+    def _invalidar(session):
+        pendientes = session.info.pop("identidad_invalidar", None)
+        if pendientes:
+            identidades.invalidar(*pendientes)
+
+    @event.listens_for(Session, "after_rollback")
+    def _descartar(session):
+        session.info.pop("identidad_invalidar", None)
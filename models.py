@@ -1,11 +1,23 @@
 # models.py - ACTUALIZADO CON CONFIRMACIÓN DE EMAIL
 from flask_login import UserMixin
-from datetime import datetime, timedelta
-import secrets
-from extensions import db
-from itsdangerous import URLSafeTimedSerializer
+from datetime import datetime
+from collections import namedtuple
+import hashlib
+from extensions import db, claves
+from sqlalchemy import event, select, update, insert, func, or_
+from sqlalchemy.orm import Session, joinedload
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from flask import current_app
-import bcrypt
+import calibracion
+
+# Tokens firmados de email: propósito (salt) y vigencia en horas
+TOKEN_CONFIRMACION = 'confirmar-email'
+TOKEN_RESET = 'reset-password'
+CONFIRMACION_HORAS = 24
+RESET_HORAS = 1
+
+# Lectura de nivel precargada en bloque (misma forma que NivelTanque)
+LecturaNivel = namedtuple('LecturaNivel', ['altura_cm', 'galones', 'fecha', 'id_registro_medidas'])
 
 class Empleado(db.Model, UserMixin):
     __tablename__ = 'empleado'
@@ -25,10 +37,11 @@ class Empleado(db.Model, UserMixin):
     
     # NUEVOS CAMPOS PARA CONFIRMACIÓN DE EMAIL
     email_confirmado = db.Column(db.Boolean, default=False)
+    # Sin uso desde los tokens firmados; se conservan para no alterar la tabla
     token_confirmacion = db.Column(db.String(100))
     token_confirmacion_expiry = db.Column(db.DateTime)
     
-    # Recuperación de contraseña
+    # Recuperación de contraseña (columnas sin uso, ver arriba)
     reset_token = db.Column(db.String(100))
     reset_token_expiry = db.Column(db.DateTime)
     
@@ -66,67 +79,67 @@ class Empleado(db.Model, UserMixin):
     def __repr__(self):
         return f'<Empleado {self.nombre_empleado} {self.apellido_empleado}>'
 
-    def check_password(self, raw_password):
-        import bcrypt
-        if not getattr(self, 'contrasena', None):
-            return False
-        return bcrypt.checkpw(raw_password.encode('utf-8'), self.contrasena.encode('utf-8'))
-
     @property
     def is_locked(self):
         return not self.activo
 
-    # NUEVO: Generar token de confirmación de email
-    def generate_confirmation_token(self, hours_valid=24):
-        token = secrets.token_urlsafe(48)
-        self.token_confirmacion = token
-        self.token_confirmacion_expiry = datetime.utcnow() + timedelta(hours=hours_valid)
-        return token
+    # ============= TOKENS FIRMADOS =============
+    # El token lleva el id y una huella del hash de la contraseña: verificar es
+    # una búsqueda por clave primaria y emitirlo no escribe en la BD.
 
-    # NUEVO: Verificar token de confirmación
-    def verify_confirmation_token(self, token):
-        if not self.token_confirmacion or self.token_confirmacion != token:
-            return False
-        if not getattr(self, 'token_confirmacion_expiry', None):
-            return False
-        return datetime.utcnow() < self.token_confirmacion_expiry
+    def _huella(self):
+        """Cambia con la contraseña: un token de recuperación ya usado deja de valer"""
+        return hashlib.sha256((self.contrasena or '').encode('utf-8')).hexdigest()[:16]
+
+    def _generar_token(self, proposito):
+        serializador = URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=proposito)
+        return serializador.dumps({'id': self.id_empleados, 'h': self._huella()})
 
+    @classmethod
+    def _desde_token(cls, token, proposito, horas):
+        """Devuelve (empleado, None) o (None, 'invalido' | 'expirado')"""
+        serializador = URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=proposito)
+        try:
+            datos = serializador.loads(token, max_age=horas * 3600)
+        except SignatureExpired:
+            return None, 'expirado'
+        except BadSignature:
+            return None, 'invalido'
+        empleado = db.session.get(cls, datos.get('id')) if isinstance(datos, dict) else None
+        if empleado is None or empleado._huella() != datos.get('h'):
+            return None, 'invalido'
+        return empleado, None
+
+    def generate_confirmation_token(self):
+        return self._generar_token(TOKEN_CONFIRMACION)
+
+    @classmethod
+    def verify_confirmation_token(cls, token):
+        return cls._desde_token(token, TOKEN_CONFIRMACION, CONFIRMACION_HORAS)
 
     # NUEVO: Confirmar email
     def confirmar_email(self):
         self.email_confirmado = True
-        self.token_confirmacion = None
-        self.token_confirmacion_expiry = None
 
     def generate_reset_token(self):
         """Generar token de recuperación de contraseña"""
-        self.reset_token = secrets.token_urlsafe(32)
-        self.reset_token_expiry = datetime.utcnow() + timedelta(hours=1)
-        return self.reset_token
+        return self._generar_token(TOKEN_RESET)
 
-    def verify_reset_token(self, token):
+    @classmethod
+    def verify_reset_token(cls, token):
         """Verificar token de recuperación"""
-        if self.reset_token == token and self.reset_token_expiry > datetime.utcnow():
-            return True
-        return False
+        return cls._desde_token(token, TOKEN_RESET, RESET_HORAS)
     
     def set_password(self, raw_password: str):
-        self.contrasena = bcrypt.hashpw(
-            raw_password.encode("utf-8"),
-            bcrypt.gensalt()
-        ).decode("utf-8")
+        self.contrasena = claves.hashear(raw_password)
 
     def check_password(self, raw_password: str) -> bool:
-        if not self.contrasena:
-            return False
-        try:
-            return bcrypt.checkpw(
-                raw_password.encode("utf-8"),
-                self.contrasena.encode("utf-8")
-            )
-        except ValueError:
-            # hash corrupto o heredado
+        """Verificar la contraseña; si el hash usa otro costo se regenera (el llamador hace commit)"""
+        if not claves.verificar(raw_password, self.contrasena):
             return False
+        if claves.necesita_rehash(self.contrasena):
+            self.contrasena = claves.hashear(raw_password)
+        return True
 
 class SesionActiva(db.Model):
     """Tabla para rastrear sesiones activas"""
@@ -142,6 +155,67 @@ class SesionActiva(db.Model):
     
     empleado = db.relationship("Empleado", back_populates="sesiones_activas")
 
+    __table_args__ = (
+        # Cerrar sesiones de un empleado y listar las activas sin recorrer el histórico
+        db.Index('ix_sesiones_activas_empleado_activa', 'id_empleados', 'activa'),
+        db.Index('ix_sesiones_activas_activa_actividad', 'activa', 'fecha_actividad'),
+    )
+
+
+class SesionArchivada(db.Model):
+    """Sesiones cerradas o vencidas que ya salieron de sesiones_activas"""
+    __tablename__ = 'sesiones_archivadas'
+    id_sesion = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id_empleados = db.Column(db.Integer, db.ForeignKey('empleado.id_empleados'), nullable=False, index=True)
+    session_id = db.Column(db.String(100), nullable=False)
+    fecha_inicio = db.Column(db.DateTime)
+    fecha_actividad = db.Column(db.DateTime)
+    ip_address = db.Column(db.String(45))
+    user_agent = db.Column(db.String(255))
+    activa = db.Column(db.Boolean, default=False)
+
+
+class CorreoPendiente(db.Model):
+    """Bandeja de salida: correos que el remitente en segundo plano envía por lotes"""
+    __tablename__ = 'correos_pendientes'
+    id_correo = db.Column(db.Integer, primary_key=True)
+    destinatarios = db.Column(db.Text, nullable=False)  # separados por coma
+    remitente = db.Column(db.String(120))
+    asunto = db.Column(db.String(255), nullable=False)
+    cuerpo = db.Column(db.Text)
+    html = db.Column(db.Text)
+    estado = db.Column(db.String(15), nullable=False, default='pendiente')  # pendiente | enviando | enviado | fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lote = db.Column(db.String(32))
+    ultimo_error = db.Column(db.Text)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+    enviado = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_correos_pendientes_estado_proximo', 'estado', 'proximo_intento'),
+    )
+
+
+class PuntoControlCarga(db.Model):
+    """Checkpoint de una importación por bloques; se confirma en la misma transacción que cada bloque"""
+    __tablename__ = 'cargas_checkpoint'
+    carga_id = db.Column(db.String(80), primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)
+    filas_procesadas = db.Column(db.Integer, nullable=False, default=0)
+    insertados = db.Column(db.Integer, nullable=False, default=0)
+    actualizados = db.Column(db.Integer, nullable=False, default=0)
+    sin_cambios = db.Column(db.Integer, nullable=False, default=0)
+    rechazados = db.Column(db.Integer, nullable=False, default=0)
+    bloques = db.Column(db.Integer, nullable=False, default=0)
+    completado = db.Column(db.Boolean, nullable=False, default=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    CONTADORES = ('filas_procesadas', 'insertados', 'actualizados', 'sin_cambios', 'rechazados', 'bloques')
+
+    def contadores(self):
+        return {campo: getattr(self, campo) for campo in self.CONTADORES}
+
 
 class Auditoria(db.Model):
     """Tabla de auditoría para rastrear cambios"""
@@ -178,6 +252,9 @@ class Tanque(db.Model):
     mediciones_cargue = db.relationship("MedicionCargue", back_populates="tanque", lazy=True)
     registro_medidas = db.relationship("RegistroMedida", back_populates="tanque", lazy=True)
     ventas = db.relationship("Venta", back_populates="tanque", lazy=True)
+    # Snapshot del nivel actual: se carga con JOIN junto al tanque
+    nivel = db.relationship("NivelTanque", back_populates="tanque", uselist=False, lazy="joined")
+    tablas_calibracion = db.relationship("TablaCalibracion", back_populates="tanque", lazy=True)
 
     @property
     def idTanques(self):
@@ -187,31 +264,92 @@ class Tanque(db.Model):
     def capacidad_gal(self):
         return self.capacidad or 0
 
+    @classmethod
+    def ultimas_mediciones(cls, ids_tanques):
+        """Última RegistroMedida de cada tanque en UNA consulta.
+
+        Usa DISTINCT ON en PostgreSQL y ROW_NUMBER() OVER (PARTITION BY ...)
+        en el resto de motores. Devuelve {id_tanques: LecturaNivel}.
+        """
+        ids_tanques = list(ids_tanques)
+        if not ids_tanques:
+            return {}
+
+        columnas = [
+            RegistroMedida.id_tanques,
+            RegistroMedida.medida_combustible,
+            RegistroMedida.galones,
+            RegistroMedida.fecha_hora_registro,
+            RegistroMedida.id_registro_medidas,
+        ]
+        orden = (RegistroMedida.fecha_hora_registro.desc(), RegistroMedida.id_registro_medidas.desc())
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            consulta = (
+                select(*columnas)
+                .where(RegistroMedida.id_tanques.in_(ids_tanques))
+                .distinct(RegistroMedida.id_tanques)
+                .order_by(RegistroMedida.id_tanques, *orden)
+            )
+        else:
+            numerada = (
+                select(
+                    *columnas,
+                    func.row_number().over(
+                        partition_by=RegistroMedida.id_tanques,
+                        order_by=orden
+                    ).label('rn')
+                )
+                .where(RegistroMedida.id_tanques.in_(ids_tanques))
+                .subquery()
+            )
+            consulta = select(
+                numerada.c.id_tanques,
+                numerada.c.medida_combustible,
+                numerada.c.galones,
+                numerada.c.fecha_hora_registro,
+                numerada.c.id_registro_medidas,
+            ).where(numerada.c.rn == 1)
+
+        return {
+            fila[0]: LecturaNivel(_a_float(fila[1]), _a_float(fila[2]), fila[3], fila[4])
+            for fila in db.session.execute(consulta)
+        }
+
+    @classmethod
+    def precargar_niveles(cls, tanques):
+        """Precargar el nivel de los tanques que aún no tienen snapshot en nivel_tanque"""
+        pendientes = [t for t in tanques if t.nivel is None and '_nivel_precargado' not in t.__dict__]
+        if not pendientes:
+            return tanques
+        lecturas = cls.ultimas_mediciones(t.id_tanques for t in pendientes)
+        for tanque in pendientes:
+            tanque._nivel_precargado = lecturas.get(tanque.id_tanques)
+        return tanques
+
+    def _lectura_actual(self):
+        """Snapshot si existe; si no, lectura precargada o consulta puntual"""
+        if self.nivel is not None:
+            return self.nivel
+        if '_nivel_precargado' not in self.__dict__:
+            Tanque.precargar_niveles([self])
+        return self._nivel_precargado
+
     @property
     def contenido(self):
         """Obtener contenido actual del tanque en galones"""
-        ultima_medicion = RegistroMedida.query.filter_by(
-            id_tanques=self.id_tanques
-        ).order_by(RegistroMedida.fecha_hora_registro.desc()).first()
-        
-        if ultima_medicion and ultima_medicion.galones:
-            return float(ultima_medicion.galones)
+        lectura = self._lectura_actual()
+        if lectura and lectura.galones:
+            return float(lectura.galones)
         return 0.0
 
     @property
     def altura_actual_cm(self):
         """Obtener altura actual en cm basada en última medición"""
-        ultima_medicion = RegistroMedida.query.filter_by(
-            id_tanques=self.id_tanques
-        ).order_by(RegistroMedida.fecha_hora_registro.desc()).first()
-        
-        if not ultima_medicion or not ultima_medicion.medida_combustible:
-            return 0.0
-        
-        try:
-            return float(ultima_medicion.medida_combustible)
-        except (ValueError, TypeError):
-            return 0.0
+        lectura = self._lectura_actual()
+        if lectura and lectura.altura_cm:
+            return float(lectura.altura_cm)
+        return 0.0
 
     @property
     def porcentaje_llenado(self):
@@ -249,24 +387,150 @@ class Tanque(db.Model):
         return True, "OK"
 
     def cm_a_galones(self, altura_cm):
-        """Convertir altura en cm a galones para este tanque específico"""
-        radio = self.radio_cm or 125.0
-        if radio <= 0:
-            return 0
-        
-        # Volumen = π * r² * h
-        area_base = 3.14159 * (radio ** 2)
-        volumen_cm3 = area_base * altura_cm
-        
-        # 1 galón = 3785.411784 cm³
-        galones = volumen_cm3 / 3785.411784
-        
-        return round(galones, 2)
+        """Convertir altura en cm a galones (tabla de aforo o fórmula geométrica)"""
+        return float(calibracion.convertir(self, [altura_cm])[0])
 
     def __repr__(self):
         return f'<Tanque {self.tipo_combustible} - {self.capacidad} gal>'
 
 
+class NivelTanque(db.Model):
+    """Snapshot del nivel actual de cada tanque (última lectura registrada).
+
+    Se actualiza en la misma transacción que cada RegistroMedida,
+    MedicionCargue o Descargue (ver ``_actualizar_niveles``).
+    """
+    __tablename__ = 'nivel_tanque'
+    id_tanques = db.Column(db.Integer, db.ForeignKey('tanques.id_tanques'), primary_key=True)
+    altura_cm = db.Column(db.Float, default=0.0)
+    galones = db.Column(db.Float, default=0.0)
+    fecha = db.Column(db.DateTime)
+    id_registro_medidas = db.Column(db.Integer, db.ForeignKey('registro_medidas.id_registro_medidas'))
+    origen = db.Column(db.String(20))  # 'medicion', 'cargue' o 'descargue'
+
+    tanque = db.relationship("Tanque", back_populates="nivel")
+
+    @classmethod
+    def registrar(cls, conn, id_tanques, altura_cm, galones, fecha, origen, id_registro_medidas=None):
+        """Actualizar el snapshot si la lectura es igual o más reciente que la guardada"""
+        tabla = cls.__table__
+        valores = {
+            'altura_cm': altura_cm,
+            'galones': galones,
+            'fecha': fecha,
+            'origen': origen,
+            'id_registro_medidas': id_registro_medidas,
+        }
+        resultado = conn.execute(
+            update(tabla)
+            .where(tabla.c.id_tanques == id_tanques)
+            .where(or_(tabla.c.fecha.is_(None), tabla.c.fecha <= fecha))
+            .values(**valores)
+        )
+        if resultado.rowcount:
+            return
+        existe = conn.execute(
+            select(tabla.c.id_tanques).where(tabla.c.id_tanques == id_tanques)
+        ).first()
+        if not existe:
+            conn.execute(insert(tabla).values(id_tanques=id_tanques, **valores))
+
+    @classmethod
+    def reconstruir(cls, confirmar=True):
+        """Recalcular todos los snapshots desde registro_medidas (backfill)"""
+        ids = [fila[0] for fila in db.session.query(Tanque.id_tanques)]
+        lecturas = Tanque.ultimas_mediciones(ids)
+
+        db.session.query(cls).delete()
+        db.session.add_all([
+            cls(
+                id_tanques=id_tanques,
+                altura_cm=lectura.altura_cm,
+                galones=lectura.galones,
+                fecha=lectura.fecha,
+                id_registro_medidas=lectura.id_registro_medidas,
+                origen='medicion'
+            )
+            for id_tanques, lectura in lecturas.items()
+        ])
+        if confirmar:
+            db.session.commit()
+        else:
+            db.session.flush()
+        return len(lecturas)
+
+    def __repr__(self):
+        return f'<NivelTanque {self.id_tanques} - {self.galones} gal>'
+
+
+class TablaCalibracion(db.Model):
+    """Tabla de aforo (strapping chart) de un tanque, guardada como arrays ordenados"""
+    __tablename__ = 'tabla_calibracion'
+    id_tabla = db.Column(db.Integer, primary_key=True)
+    id_tanques = db.Column(db.Integer, db.ForeignKey('tanques.id_tanques'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    alturas_cm = db.Column(db.LargeBinary, nullable=False)  # float64, orden ascendente
+    galones = db.Column(db.LargeBinary, nullable=False)     # float64, alineado con alturas_cm
+    puntos = db.Column(db.Integer)
+    activa = db.Column(db.Boolean, default=True)
+    nombre_archivo = db.Column(db.String(255))
+    id_empleados = db.Column(db.Integer, db.ForeignKey('empleado.id_empleados'))
+    fecha_carga = db.Column(db.DateTime, default=datetime.utcnow)
+
+    tanque = db.relationship("Tanque", back_populates="tablas_calibracion")
+
+    __table_args__ = (
+        db.UniqueConstraint('id_tanques', 'version', name='uq_tabla_calibracion_version'),
+    )
+
+    @classmethod
+    def publicar(cls, tanque, alturas, galones, nombre_archivo=None, id_empleados=None):
+        """Crear una nueva versión activa y desactivar las anteriores"""
+        version_actual = db.session.query(func.max(cls.version)).filter_by(
+            id_tanques=tanque.id_tanques
+        ).scalar() or 0
+        cls.query.filter_by(id_tanques=tanque.id_tanques, activa=True).update({'activa': False})
+        tabla = cls(
+            id_tanques=tanque.id_tanques,
+            version=version_actual + 1,
+            alturas_cm=calibracion.serializar(alturas),
+            galones=calibracion.serializar(galones),
+            puntos=len(alturas),
+            activa=True,
+            nombre_archivo=nombre_archivo,
+            id_empleados=id_empleados
+        )
+        db.session.add(tabla)
+        return tabla
+
+    def __repr__(self):
+        return f'<TablaCalibracion tanque={self.id_tanques} v{self.version}>'
+
+
+class ConsumoDiario(db.Model):
+    """Rollup diario por tanque: consumo, cargues y rango de nivel.
+
+    Se mantiene desde ``consumo.actualizar_consumo_diario`` en la misma
+    transacción que las lecturas; ``flask reconstruir-consumo`` lo regenera.
+    """
+    __tablename__ = 'consumo_diario'
+    id_tanques = db.Column(db.Integer, db.ForeignKey('tanques.id_tanques'), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    galones_consumidos = db.Column(db.Float, default=0.0)
+    galones_cargados = db.Column(db.Float, default=0.0)
+    lecturas = db.Column(db.Integer, default=0)
+    nivel_min = db.Column(db.Float)
+    nivel_max = db.Column(db.Float)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_consumo_diario_dia', 'dia'),
+    )
+
+    def __repr__(self):
+        return f'<ConsumoDiario {self.id_tanques} {self.dia} - {self.galones_consumidos} gal>'
+
+
 class Descargue(db.Model):
     __tablename__ = 'descargues'
     idDescargue = db.Column(db.Integer, primary_key=True)
@@ -299,6 +563,26 @@ class Descargue(db.Model):
     fecha = db.Column(db.Date)
     imagen_path = db.Column(db.String(255))
 
+    @classmethod
+    def criterios(cls, fecha_desde=None, fecha_hasta=None, id_tanques=None):
+        """Condiciones WHERE de los filtros comunes (historial, exportaciones)"""
+        condiciones = []
+        if fecha_desde:
+            condiciones.append(cls.fecha >= fecha_desde)
+        if fecha_hasta:
+            condiciones.append(cls.fecha <= fecha_hasta)
+        if id_tanques:
+            condiciones.append(cls.tanque == str(id_tanques))
+        return condiciones
+
+    @classmethod
+    def consulta(cls, **filtros):
+        """Query base con el empleado cargado en el mismo SELECT.
+
+        ``tanque`` es texto (no hay relación que precargar).
+        """
+        return cls.query.options(joinedload(cls.empleado)).filter(*cls.criterios(**filtros))
+
     def __repr__(self):
         return f'<Descargue {self.tanque} - {self.fecha}>'
 
@@ -317,6 +601,23 @@ class MedicionCargue(db.Model):
     empleado = db.relationship("Empleado", back_populates="mediciones_cargue")
     tanque = db.relationship("Tanque", back_populates="mediciones_cargue")
 
+    @classmethod
+    def criterios(cls, fecha_desde=None, fecha_hasta=None, id_tanques=None):
+        """Condiciones WHERE de los filtros comunes (historial, exportaciones)"""
+        condiciones = []
+        if fecha_desde:
+            condiciones.append(cls.fecha >= fecha_desde)
+        if fecha_hasta:
+            condiciones.append(cls.fecha <= fecha_hasta)
+        if id_tanques:
+            condiciones.append(cls.id_tanques == id_tanques)
+        return condiciones
+
+    @classmethod
+    def consulta(cls, **filtros):
+        """Query base con tanque y empleado cargados en el mismo SELECT"""
+        return cls.query.options(joinedload(cls.tanque), joinedload(cls.empleado)).filter(*cls.criterios(**filtros))
+
     @property
     def idMedicion_cargue(self):
         return self.id_medicion_cargue
@@ -348,6 +649,92 @@ class RegistroMedida(db.Model):
     empleado = db.relationship("Empleado", back_populates="registro_medidas")
     tanque = db.relationship("Tanque", back_populates="registro_medidas")
 
+    __table_args__ = (
+        # Clave natural de una lectura: evita duplicados al recargar archivos (upsert)
+        db.Index('uq_registro_medidas_tanque_fecha', 'id_tanques', 'fecha_hora_registro', unique=True),
+    )
+
+    @classmethod
+    def criterios(cls, fecha_desde=None, fecha_hasta=None, id_tanques=None, tipo_medida=None):
+        """Condiciones WHERE de los filtros comunes (historial, exportaciones)"""
+        condiciones = []
+        if fecha_desde:
+            condiciones.append(cls.fecha_hora_registro >= fecha_desde)
+        if fecha_hasta:
+            condiciones.append(cls.fecha_hora_registro <= fecha_hasta)
+        if id_tanques:
+            condiciones.append(cls.id_tanques == id_tanques)
+        if tipo_medida:
+            condiciones.append(cls.tipo_medida == tipo_medida)
+        return condiciones
+
+    @classmethod
+    def consulta(cls, **filtros):
+        """Query base con tanque y empleado cargados en el mismo SELECT"""
+        return cls.query.options(joinedload(cls.tanque), joinedload(cls.empleado)).filter(*cls.criterios(**filtros))
+
+    @classmethod
+    def eliminar_duplicados(cls):
+        """Borrar lecturas repetidas (mismo tanque y fecha) dejando una por grupo.
+
+        Necesario antes de crear ``uq_registro_medidas_tanque_fecha`` en una BD
+        existente. Sólo se tocan los grupos cuyas lecturas miden lo mismo
+        (``medida_combustible`` y ``galones``); los que difieren quedan para
+        revisión y siguen apareciendo en ``grupos_duplicados``. Se conserva la
+        primera lectura enlazada a un cargue (o la primera del grupo); los
+        enlaces a cargues, documentos y el snapshot de nivel de las copias
+        pasan a la conservada. No hace commit.
+        """
+        enlace = RegistroMedidaMedicionCargue
+        repetidas = db.session.query(cls.id_tanques, cls.fecha_hora_registro).filter(
+            cls.fecha_hora_registro.isnot(None)
+        ).group_by(cls.id_tanques, cls.fecha_hora_registro).having(func.count() > 1).all()
+
+        borrar = []
+        for id_tanques, fecha in repetidas:
+            lecturas = db.session.query(cls.id_registro_medidas, cls.medida_combustible, cls.galones).filter(
+                cls.id_tanques == id_tanques, cls.fecha_hora_registro == fecha
+            ).all()
+            if len({((medida or '').strip(), galones) for _, medida, galones in lecturas}) > 1:
+                # Valores distintos: no hay una copia que se pueda descartar sin perder datos
+                continue
+            ids = sorted(id_registro for id_registro, _, _ in lecturas)
+            enlaces = db.session.query(enlace.id_registro_medidas, enlace.id_medicion_cargue).filter(
+                enlace.id_registro_medidas.in_(ids)
+            ).all()
+            enlazadas = sorted({id_registro for id_registro, _ in enlaces})
+            conservar = enlazadas[0] if enlazadas else ids[0]
+            copias = [id_registro for id_registro in ids if id_registro != conservar]
+
+            # Cada cargue enlazado a una copia queda enlazado (una sola vez) a la conservada
+            ya_enlazados = {cargue for id_registro, cargue in enlaces if id_registro == conservar}
+            nuevos = {cargue for id_registro, cargue in enlaces if id_registro != conservar} - ya_enlazados
+            db.session.query(enlace).filter(enlace.id_registro_medidas.in_(copias)).delete(
+                synchronize_session=False
+            )
+            if nuevos:
+                db.session.execute(insert(enlace), [
+                    {'id_registro_medidas': conservar, 'id_medicion_cargue': cargue} for cargue in sorted(nuevos)
+                ])
+            for modelo in (NivelTanque, Documento):
+                db.session.query(modelo).filter(modelo.id_registro_medidas.in_(copias)).update(
+                    {modelo.id_registro_medidas: conservar}, synchronize_session=False
+                )
+            borrar.extend(copias)
+
+        for inicio in range(0, len(borrar), 1000):
+            db.session.query(cls).filter(
+                cls.id_registro_medidas.in_(borrar[inicio:inicio + 1000])
+            ).delete(synchronize_session=False)
+        return len(borrar)
+
+    @classmethod
+    def grupos_duplicados(cls, limite=20):
+        """(id_tanques, fecha, cantidad) de las lecturas que aún repiten tanque y fecha"""
+        return db.session.query(cls.id_tanques, cls.fecha_hora_registro, func.count()).filter(
+            cls.fecha_hora_registro.isnot(None)
+        ).group_by(cls.id_tanques, cls.fecha_hora_registro).having(func.count() > 1).limit(limite).all()
+
     @property
     def idRegistro_medidas(self):
         return self.id_registro_medidas
@@ -459,3 +846,84 @@ class RegistroMedidaMedicionCargue(db.Model):
     __tablename__ = 'registro_medidas_has_medicion_cargue'
     id_registro_medidas = db.Column(db.Integer, db.ForeignKey('registro_medidas.id_registro_medidas'), primary_key=True)
     id_medicion_cargue = db.Column(db.Integer, db.ForeignKey('medicion_cargue.id_medicion_cargue'), primary_key=True)
+
+
+# ============= MANTENIMIENTO DEL NIVEL ACTUAL =============
+
+def _a_float(valor):
+    """Convertir valores de medida (str/Decimal/int) a float, 0.0 si no es válido"""
+    if valor is None or valor == '':
+        return 0.0
+    try:
+        return float(str(valor).replace(',', '.'))
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _lectura_nivel(session, obj):
+    """Extraer la lectura de nivel que aporta un objeto recién insertado"""
+    if isinstance(obj, RegistroMedida):
+        if not obj.id_tanques:
+            return None
+        return {
+            'id_tanques': obj.id_tanques,
+            'altura_cm': _a_float(obj.medida_combustible),
+            'galones': _a_float(obj.galones),
+            'fecha': obj.fecha_hora_registro or datetime.now(),
+            'origen': 'medicion',
+            'id_registro_medidas': obj.id_registro_medidas,
+        }
+
+    if isinstance(obj, MedicionCargue):
+        tanque = session.get(Tanque, obj.id_tanques) if obj.id_tanques else None
+        if not tanque:
+            return None
+        altura = _a_float(obj.medida_posterior)
+        return {
+            'id_tanques': tanque.id_tanques,
+            'altura_cm': altura,
+            'galones': tanque.cm_a_galones(altura),
+            'fecha': obj.fecha or datetime.now(),
+            'origen': 'cargue',
+        }
+
+    if isinstance(obj, Descargue):
+        try:
+            tanque = session.get(Tanque, int(obj.tanque))
+        except (ValueError, TypeError):
+            tanque = None
+        if not tanque:
+            return None
+        if obj.medida_final_cm is not None:
+            altura = _a_float(obj.medida_final_cm)
+        else:
+            altura = _a_float(obj.medida_inicial_cm) + _a_float(obj.descargue_cm)
+        galones = _a_float(obj.medida_final_gl) or tanque.cm_a_galones(altura)
+        fecha = datetime.now()
+        if obj.fecha and obj.fecha < fecha.date():
+            fecha = datetime.combine(obj.fecha, datetime.min.time())
+        return {
+            'id_tanques': tanque.id_tanques,
+            'altura_cm': altura,
+            'galones': galones,
+            'fecha': fecha,
+            'origen': 'descargue',
+        }
+
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _actualizar_niveles(session, flush_context):
+    """Mantener nivel_tanque en la misma transacción que las nuevas lecturas"""
+    lecturas = []
+    for obj in list(session.new):
+        lectura = _lectura_nivel(session, obj)
+        if lectura:
+            lecturas.append(lectura)
+    if not lecturas:
+        return
+
+    conn = session.connection()
+    for lectura in sorted(lecturas, key=lambda l: l['fecha']):
+        NivelTanque.registrar(conn, **lectura)
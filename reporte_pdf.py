@@ -0,0 +1,93 @@
+# reporte_pdf.py - Construcción del PDF del reporte mensual
+# Módulo sin dependencias de la app: se ejecuta en el pool de procesos (trabajos.py)
+import os
+import tempfile
+from io import BytesIO
+
+
+def generar_pdf(datos, destino):
+    """Construir el PDF del reporte y guardarlo en ``destino`` (escritura atómica).
+
+    ``datos`` = {'periodo', 'generado', 'ventas_por_tipo', 'ventas_por_dia',
+    'niveles_por_tanque'}. Los gráficos se dibujan como vectores (graficos_pdf).
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.units import inch
+    from graficos_pdf import grafico_torta, grafico_barras, grafico_lineas
+
+    ventas_por_tipo = datos['ventas_por_tipo']
+    ventas_por_dia = datos['ventas_por_dia']
+    niveles_por_tanque = datos.get('niveles_por_tanque') or {}
+    
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=24, textColor=colors.HexColor('#E10000'), alignment=1)
+    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Normal'], fontSize=12, textColor=colors.grey, alignment=1)
+    
+    elements.append(Paragraph("REPORTE MENSUAL DE COMBUSTIBLE", title_style))
+    elements.append(Paragraph(f"Estación Hayuelos - {datos['periodo']}", subtitle_style))
+    elements.append(Spacer(1, 0.3*inch))
+    
+    if ventas_por_tipo:
+        elements.append(grafico_torta(ventas_por_tipo, 'Combustible Más Vendido por Tipo'))
+        elements.append(Spacer(1, 0.3*inch))
+    
+    if ventas_por_dia:
+        fechas = list(ventas_por_dia.keys())[-14:]
+        valores_dias = [ventas_por_dia[f] for f in fechas]
+        fechas_cortas = [f[-5:] for f in fechas]
+        elements.append(grafico_barras(fechas_cortas, valores_dias, 'Días con Más Ventas (Últimas 2 Semanas)',
+                                       eje_x='Fecha', eje_y='Galones Vendidos'))
+        elements.append(Spacer(1, 0.3*inch))
+    
+    if niveles_por_tanque:
+        # Eje X = día del mes
+        series = {nombre: [(int(dia[-2:]), galones) for dia, galones in puntos]
+                  for nombre, puntos in niveles_por_tanque.items()}
+        elements.append(grafico_lineas(series, 'Nivel Mínimo Diario por Tanque', eje_y='Galones'))
+        elements.append(Spacer(1, 0.3*inch))
+    
+    elements.append(Paragraph("RESUMEN DE CONSUMO POR TIPO", styles['Heading2']))
+    nota_style = ParagraphStyle('Nota', parent=styles['Normal'], fontSize=9, textColor=colors.grey, alignment=0)
+    elements.append(Paragraph("* Los datos de consumo se calculan a partir de las diferencias en las mediciones de inventario.", nota_style))
+    elements.append(Spacer(1, 0.1*inch))
+    if ventas_por_tipo:
+        data = [['Tipo de Combustible', 'Galones Vendidos', 'Porcentaje']]
+        total = sum(ventas_por_tipo.values())
+        for tipo, galones in ventas_por_tipo.items():
+            porcentaje = (galones / total * 100) if total > 0 else 0
+            data.append([tipo, f"{galones:,.0f}", f"{porcentaje:.1f}%"])
+        data.append(['TOTAL', f"{total:,.0f}", '100%'])
+        
+        table = Table(data, colWidths=[2.5*inch, 2*inch, 1.5*inch])
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#E10000')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#FFE0E0')),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ]))
+        elements.append(table)
+    
+    elements.append(Spacer(1, 0.3*inch))
+    elements.append(Paragraph(f"Generado el {datos['generado']}", subtitle_style))
+    
+    doc.build(elements)
+
+    directorio = os.path.dirname(destino)
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.pdf')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(temporal, destino)
+    return destino
@@ -0,0 +1,128 @@
+# reportes.py - Reporte mensual: datos, PDFs cacheados en disco y generación en segundo plano
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, datetime
+
+from flask import current_app
+
+from extensions import stats_cache, trabajos
+from consumo import resumen_consumo, niveles_diarios
+from reporte_pdf import generar_pdf
+
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+         'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+
+def periodo_mes(mes=None):
+    """'YYYY-MM' (o None = mes actual) → (primer día, primer día del mes siguiente)"""
+    if mes:
+        inicio = datetime.strptime(mes, '%Y-%m').date()
+    else:
+        inicio = date.today().replace(day=1)
+    if inicio > date.today():
+        raise ValueError("El mes no puede ser futuro")
+    if inicio.month == 12:
+        fin = date(inicio.year + 1, 1, 1)
+    else:
+        fin = date(inicio.year, inicio.month + 1, 1)
+    return inicio, fin
+
+
+def datos_reporte(inicio, fin):
+    """Datos del reporte leídos del rollup diario (cacheados en el grupo 'reportes')"""
+    ventas_por_tipo, ventas_por_dia = stats_cache.obtener(
+        'reportes', f"consumo:{inicio:%Y-%m}",
+        lambda: resumen_consumo(inicio, fin)
+    )
+    niveles = stats_cache.obtener(
+        'reportes', f"niveles:{inicio:%Y-%m}",
+        lambda: niveles_diarios(inicio, fin)
+    )
+    return {
+        'ventas_por_tipo': dict(ventas_por_tipo),
+        'ventas_por_dia': dict(ventas_por_dia),
+        'niveles_por_tanque': {nombre: [list(p) for p in puntos] for nombre, puntos in niveles.items()},
+    }
+
+
+def version_datos(datos):
+    """Huella de los datos: si no cambian, el PDF ya generado sigue siendo válido"""
+    return hashlib.sha1(json.dumps(datos, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def _directorio():
+    return current_app.config['REPORTES_DIR']
+
+
+def ruta_archivada(inicio):
+    return os.path.join(_directorio(), 'archivo', f"reporte_mensual_{inicio:%Y_%m}.pdf")
+
+
+def ruta_cache(inicio, version):
+    return os.path.join(_directorio(), f"reporte_mensual_{inicio:%Y_%m}_{version}.pdf")
+
+
+def archivar(ruta, inicio):
+    """Guardar el PDF de un mes cerrado como archivo inmutable (nunca se sobrescribe)"""
+    destino = ruta_archivada(inicio)
+    if os.path.exists(destino):
+        return destino
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.pdf')
+    os.close(fd)
+    shutil.copyfile(ruta, temporal)
+    os.chmod(temporal, 0o444)
+    os.replace(temporal, destino)
+    return destino
+
+
+def solicitar_reporte(mes=None):
+    """Devolver el PDF del mes si ya existe; si no, encolar su generación.
+
+    Resultado: {'estado': 'completado', 'ruta', 'nombre'} o
+    {'estado': 'pendiente'|'en_proceso', 'trabajo_id', 'nombre'}.
+    """
+    inicio, fin = periodo_mes(mes)
+    nombre = f"reporte_mensual_{inicio:%Y_%m}.pdf"
+    cerrado = fin <= date.today()
+
+    if cerrado and os.path.exists(ruta_archivada(inicio)):
+        return {'estado': 'completado', 'ruta': ruta_archivada(inicio), 'nombre': nombre}
+
+    datos = datos_reporte(inicio, fin)
+    version = version_datos(datos)
+    ruta = ruta_cache(inicio, version)
+    if os.path.exists(ruta):
+        if cerrado:
+            ruta = archivar(ruta, inicio)
+        return {'estado': 'completado', 'ruta': ruta, 'nombre': nombre}
+
+    trabajo_id = f"reporte-{inicio:%Y-%m}-{version}"
+    if trabajos.activo(trabajo_id):
+        return {'estado': 'en_proceso', 'trabajo_id': trabajo_id, 'nombre': nombre}
+
+    trabajos.crear('reporte', trabajo_id=trabajo_id, nombre=nombre, mes=f"{inicio:%Y-%m}")
+    datos_pdf = dict(
+        datos,
+        periodo=f"{MESES[inicio.month - 1]} {inicio.year}",
+        generado=datetime.now().strftime('%d/%m/%Y a las %H:%M'),
+    )
+    trabajos.en_proceso(
+        trabajo_id, generar_pdf, datos_pdf, ruta,
+        al_terminar=(lambda resultado: archivar(resultado, inicio)) if cerrado else None
+    )
+    return {'estado': 'pendiente', 'trabajo_id': trabajo_id, 'nombre': nombre}
+
+
+def ruta_resultado(trabajo_id):
+    """Ruta del PDF de un trabajo completado (sólo dentro de REPORTES_DIR)"""
+    estado = trabajos.estado(trabajo_id)
+    if not estado or estado.get('tipo') != 'reporte' or estado.get('estado') != 'completado':
+        return None, estado
+    ruta = os.path.realpath(estado.get('resultado') or '')
+    if not ruta.startswith(os.path.realpath(_directorio()) + os.sep) or not os.path.exists(ruta):
+        return None, estado
+    return ruta, estado
@@ -1,19 +1,31 @@
 # routes.py - COMPLETO CON CONFIRMACIÓN DE EMAIL
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app,
+                   Response, stream_with_context, session)
 from flask_login import current_user, login_user, logout_user, login_required
 from flask_mail import Message
 from werkzeug.utils import secure_filename
 from datetime import date, datetime, timedelta
 from sqlalchemy import func, extract
+from sqlalchemy.exc import IntegrityError
 import os
-import secrets
 import pandas as pd
 
-from extensions import db, mail
-from models import Empleado, Tanque, Descargue, RegistroMedida, MedicionCargue, SesionActiva, Auditoria, Venta
+from extensions import db, buzon, stats_cache, identidades, claves, sesiones, trabajos
+from models import (Empleado, Tanque, Descargue, RegistroMedida, MedicionCargue, Auditoria, Venta,
+                    TablaCalibracion)
 from forms import (LoginForm, RegisterForm, MedicionForm, DescargueForm, ChangePasswordForm, 
                   ResetPasswordForm, RequestPasswordResetForm, PasswordResetForm, TanqueForm,
-                  CargaMasivaForm, FiltroMedicionesForm)
+                  CargaMasivaForm, FiltroMedicionesForm, CalibracionForm)
+from autenticacion import ServicioOcupado
+from calibracion import calcular_altura_maxima, leer_tabla, TablaCalibracionError
+import calibracion
+from consumo import resumen_consumo, cargado_por_tipo as cargado_por_tipo_combustible
+from reportes import solicitar_reporte, ruta_resultado
+from cargas import (leer_archivo, cargar, CargaError, guardar_subida, importar_por_bloques, ruta_errores,
+                    validar_por_bloques, id_trabajo, solicitar_carga)
+from exportaciones import (preparar_exportacion, escribir_csv, escribir_xlsx, escribir_columnar,
+                           columnar_disponible, solicitar_exportacion, ruta_exportacion,
+                           FORMATOS as FORMATOS_EXPORTACION, COLUMNARES as FORMATOS_COLUMNARES)
 from utils import (islero_or_encargado_required, admin_or_encargado_required, admin_required,
                   registrar_auditoria, allowed_file)
 
@@ -25,8 +37,13 @@ medicion_bp = Blueprint("medicion", __name__, url_prefix="/medicion")
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 # ============= FUNCIONES AUXILIARES =============
+def avisar_servidor_ocupado():
+    """Descartar cambios y avisar cuando no hubo cupo para calcular un hash (la ruta responde 503)"""
+    db.session.rollback()
+    flash("El servidor está ocupado. Intente de nuevo en unos segundos.", "warning")
+
 def enviar_email_confirmacion(empleado, token):
-    """Enviar email de confirmación al registrarse"""
+    """Encolar el email de confirmación (sale al hacer commit, en segundo plano)"""
     confirm_url = url_for('auth.confirm_email', token=token, _external=True)
     contrasena_temp = empleado.numero_documento[-4:] if len(empleado.numero_documento) >= 4 else empleado.numero_documento
     
@@ -84,21 +101,7 @@ Sistema Hayuelos - "Y También vendemos combustible"
     </body>
     </html>
     """
-    mail.send(msg)
-
-def calcular_altura_maxima(capacidad_galones):
-    """Calcular altura máxima en cm basada en capacidad del tanque"""
-    # Radio estándar en cm (ajustar según tanques reales)
-    radio_cm = 125  # 2.5m de diámetro
-    
-    # Volumen en cm³ = capacidad en galones * 3785.411784
-    volumen_cm3 = capacidad_galones * 3785.411784
-    
-    # Altura = Volumen / (π * r²)
-    area_base = 3.14159 * (radio_cm ** 2)
-    altura_cm = volumen_cm3 / area_base
-    
-    return round(altura_cm, 2)
+    buzon.encolar(msg)
 
 # ============= AUTH ROUTES =============
 @auth_bp.route("/login", methods=["GET", "POST"])
@@ -110,12 +113,26 @@ def login():
     if form.validate_on_submit():
         usuario = form.username.data.strip()
         contrasena = form.password.data
+        ip = request.remote_addr
+
+        # Antes de calcular ningún hash: una ráfaga de intentos no ocupa CPU
+        espera = claves.intentos.bloqueado(ip, usuario)
+        if espera:
+            flash(f"Demasiados intentos fallidos. Intente de nuevo en {(espera + 59) // 60} minuto(s).", "danger")
+            return render_template("auth/login.html", form=form), 429
 
         empleado = Empleado.query.filter(
             (Empleado.usuario == usuario) | (Empleado.numero_documento == usuario)
         ).first()
 
-        if empleado and empleado.check_password(contrasena):
+        try:
+            valida = empleado is not None and empleado.check_password(contrasena)
+        except ServicioOcupado:
+            avisar_servidor_ocupado()
+            return render_template("auth/login.html", form=form), 503
+
+        if valida:
+            claves.intentos.exito(usuario)
             if not empleado.activo:
                 flash("Su cuenta ha sido deshabilitada. Contacte al administrador.", "danger")
                 return redirect(url_for("auth.login"))
@@ -127,20 +144,17 @@ def login():
 
             login_user(empleado, remember=form.remember_me.data)
             
-            # Crear sesión activa
-            session_id = secrets.token_urlsafe(32)
-            sesion = SesionActiva(
-                id_empleados=empleado.id_empleados,
-                session_id=session_id,
-                ip_address=request.remote_addr,
-                user_agent=request.headers.get('User-Agent', '')[:255]
+            # Sesión activa (la actividad posterior se registra por lotes)
+            session['sesion_id'] = sesiones.iniciar(
+                empleado.id_empleados, request.remote_addr, request.headers.get('User-Agent', '')
             )
-            db.session.add(sesion)
+            # También guarda el hash regenerado por check_password si el costo cambió
             db.session.commit()
 
             flash(f"Bienvenido {empleado.nombre_empleado}!", "success")
             return redirect(url_for("dashboard.index"))
         else:
+            claves.intentos.fallo(ip, usuario)
             flash("Usuario o contraseña incorrectos", "danger")
 
     return render_template("auth/login.html", form=form)
@@ -182,26 +196,23 @@ def register():
             aceptado_terminos=form.aceptar_terminos.data
         )
 
-        nuevo_empleado.set_password(contrasena_temporal)
+        try:
+            nuevo_empleado.set_password(contrasena_temporal)
+        except ServicioOcupado:
+            avisar_servidor_ocupado()
+            return render_template("auth/register.html", form=form), 503
 
         
         # 1) Guardar usuario primero para que exista en la BD
         db.session.add(nuevo_empleado)
-        db.session.commit()  # ahora tiene id y podemos generar/almacenar el token
+        db.session.commit()  # ahora tiene id, que va dentro del token
 
-        # 2) Generar token y persistirlo (generate_confirmation_token escribe token en el objeto)
+        # 2) Generar token y encolar el email en la misma transacción: si falla el SMTP
+        #    el registro no se cae, el remitente en segundo plano reintenta
         token = nuevo_empleado.generate_confirmation_token()
-        db.session.commit()  # persiste token_confirmacion y token_confirmacion_expiry
-
-        # 3) Intentar enviar email; loggear cualquier excepción para ver el error en Vercel
-        import traceback
-        try:
-            enviar_email_confirmacion(nuevo_empleado, token)
-            flash(f"¡Registro exitoso! Se ha enviado un email de confirmación a {nuevo_empleado.email}.", "success")
-        except Exception as e:
-            print("Error enviando email:", e)
-            traceback.print_exc()
-            flash("Usuario creado, pero hubo un error al enviar el email. Contacte al administrador.", "warning")
+        enviar_email_confirmacion(nuevo_empleado, token)
+        db.session.commit()
+        flash(f"¡Registro exitoso! Se ha enviado un email de confirmación a {nuevo_empleado.email}.", "success")
         
         # Auditoría
         registrar_auditoria('CREATE', 'empleado', nuevo_empleado.id_empleados, None, {
@@ -216,15 +227,19 @@ def register():
 # NUEVO: Ruta para confirmar email
 @auth_bp.route("/confirm/<token>")
 def confirm_email(token):
-    empleado = Empleado.query.filter_by(token_confirmacion=token).first()
+    empleado, error = Empleado.verify_confirmation_token(token)
+    
+    if error == 'expirado':
+        flash("El token de confirmación ha expirado. Solicita un nuevo email de confirmación.", "danger")
+        return redirect(url_for("auth.resend_confirmation"))
     
     if not empleado:
         flash("Token de confirmación inválido", "danger")
         return redirect(url_for("auth.login"))
     
-    if not empleado.verify_confirmation_token(token):
-        flash("El token de confirmación ha expirado. Solicita un nuevo email de confirmación.", "danger")
-        return redirect(url_for("auth.resend_confirmation"))
+    if empleado.email_confirmado:
+        flash("Este email ya ha sido confirmado", "info")
+        return redirect(url_for("auth.login"))
     
     empleado.confirmar_email()
     db.session.commit()
@@ -250,14 +265,9 @@ def resend_confirmation():
             
             # Generar nuevo token
             token = empleado.generate_confirmation_token()
+            enviar_email_confirmacion(empleado, token)
             db.session.commit()
-            
-            try:
-                enviar_email_confirmacion(empleado, token)
-                flash("Se ha enviado un nuevo email de confirmación", "success")
-            except Exception as e:
-                flash(f"Error al enviar el email. Contacte al administrador.", "danger")
-                print(f"Error: {e}")
+            flash("Se ha enviado un nuevo email de confirmación", "success")
         else:
             flash("Si el email existe en nuestro sistema, recibirás un enlace de confirmación", "info")
     
@@ -266,11 +276,10 @@ def resend_confirmation():
 @auth_bp.route("/logout")
 @login_required
 def logout():
-    SesionActiva.query.filter_by(
-        id_empleados=current_user.id_empleados,
-        activa=True
-    ).update({'activa': False})
-    db.session.commit()
+    session_id = session.pop('sesion_id', None)
+    if session_id:
+        sesiones.cerrar(session_id)
+        db.session.commit()
     
     logout_user()
     flash("Sesión cerrada correctamente", "info")
@@ -279,8 +288,10 @@ def logout():
 @auth_bp.route("/logout_all", methods=["POST"])
 @login_required
 def logout_all():
-    SesionActiva.query.filter_by(id_empleados=current_user.id_empleados).update({'activa': False})
+    sesiones.cerrar_todas(current_user.id_empleados)
     db.session.commit()
+    session.pop('sesion_id', None)
+    identidades.invalidar(current_user.id_empleados)
     logout_user()
     flash("Se han cerrado todas las sesiones activas", "success")
     return redirect(url_for("auth.login"))
@@ -290,9 +301,16 @@ def logout_all():
 def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if current_user.check_password(form.current_password.data):
-            current_user.set_password(form.new_password.data)
-            current_user.temporal = False
+        empleado = current_user.empleado
+        try:
+            actual_valida = empleado.check_password(form.current_password.data)
+            if actual_valida:
+                empleado.set_password(form.new_password.data)
+        except ServicioOcupado:
+            avisar_servidor_ocupado()
+            return render_template("auth/change_password.html", form=form), 503
+        if actual_valida:
+            empleado.temporal = False
             db.session.commit()
             
             registrar_auditoria('UPDATE', 'empleado', current_user.id_empleados, 
@@ -316,7 +334,6 @@ def request_password_reset():
                 return redirect(url_for("auth.resend_confirmation"))
             
             token = empleado.generate_reset_token()
-            db.session.commit()
             
             reset_url = url_for('auth.reset_password', token=token, _external=True)
             msg = Message("Recuperación de Contraseña - Hayuelos",
@@ -360,12 +377,9 @@ Sistema Hayuelos
             </body>
             </html>
             """
-            try:
-                mail.send(msg)
-                flash("Se ha enviado un enlace de recuperación a tu email", "success")
-            except Exception as e:
-                flash(f"Error al enviar el email. Contacte al administrador.", "danger")
-                print(f"Error: {e}")
+            buzon.encolar(msg)
+            db.session.commit()
+            flash("Se ha enviado un enlace de recuperación a tu email", "success")
         else:
             flash("Si el email existe en nuestro sistema, recibirás un enlace de recuperación", "info")
     
@@ -373,17 +387,20 @@ Sistema Hayuelos
 
 @auth_bp.route("/reset/<token>", methods=["GET", "POST"])
 def reset_password(token):
-    empleado = Empleado.query.filter_by(reset_token=token).first()
-    if not empleado or not empleado.verify_reset_token(token):
+    # El token deja de valer en cuanto cambia la contraseña (lleva una huella del hash)
+    empleado, _ = Empleado.verify_reset_token(token)
+    if not empleado:
         flash("Token inválido o expirado", "danger")
         return redirect(url_for("auth.request_password_reset"))
     
     form = PasswordResetForm()  # 👈 El formulario debe estar aquí
     
     if form.validate_on_submit():
-        empleado.set_password(form.password.data)
-        empleado.reset_token = None
-        empleado.reset_token_expiry = None
+        try:
+            empleado.set_password(form.password.data)
+        except ServicioOcupado:
+            avisar_servidor_ocupado()
+            return render_template("auth/reset_password.html", form=form), 503
         empleado.temporal = False
         db.session.commit()
         
@@ -403,7 +420,11 @@ def reset_password_admin(empleado_id):
     empleado = Empleado.query.get_or_404(empleado_id)
     
     contrasena_temporal = empleado.numero_documento[-4:] if len(empleado.numero_documento) >= 4 else empleado.numero_documento
-    empleado.set_password(contrasena_temporal)
+    try:
+        empleado.set_password(contrasena_temporal)
+    except ServicioOcupado:
+        avisar_servidor_ocupado()
+        return empleados(), 503
     empleado.temporal = True
     db.session.commit()
 
@@ -422,7 +443,11 @@ def resetear_clave_empleado(empleado_id):
     empleado = Empleado.query.get_or_404(empleado_id)
     
     temp_password = empleado.numero_documento[-4:] if len(empleado.numero_documento) >= 4 else empleado.numero_documento
-    empleado.set_password(temp_password)
+    try:
+        empleado.set_password(temp_password)
+    except ServicioOcupado:
+        avisar_servidor_ocupado()
+        return empleados(), 503
     empleado.temporal = True
     db.session.commit()
     
@@ -450,41 +475,50 @@ def privacidad():
 @dashboard_bp.route("/")
 @login_required
 def index():
-    tanques = Tanque.query.filter_by(activo=True).all()
+    tanques = Tanque.precargar_niveles(Tanque.query.filter_by(activo=True).all())
     total_capacity = sum(float(t.capacidad) for t in tanques) if tanques else 0
-    mediciones_recientes = RegistroMedida.query.order_by(
+    mediciones_recientes = RegistroMedida.consulta().order_by(
         RegistroMedida.fecha_hora_registro.desc()
     ).limit(5).all()
     descargues_hoy = Descargue.query.filter_by(fecha=date.today()).all()
 
-    tanques_por_tipo = {}
-    for tanque in tanques:
-        tipo = tanque.tipo_combustible
-        if tipo not in tanques_por_tipo:
-            tanques_por_tipo[tipo] = {"count": 0, "capacity": 0, "current": 0}
-        tanques_por_tipo[tipo]["count"] += 1
-        tanques_por_tipo[tipo]["capacity"] += float(tanque.capacidad)
-        tanques_por_tipo[tipo]["current"] += tanque.contenido or 0
-
-    combustible_mas_vendido = db.session.query(
-        Tanque.tipo_combustible,
-        func.sum(Venta.cantidad_galones).label('total')
-    ).join(Venta).group_by(Tanque.tipo_combustible).order_by(func.sum(Venta.cantidad_galones).desc()).first()
-
-    ventas_por_mes = db.session.query(
-        extract('month', Venta.fecha).label('mes'),
-        func.sum(Venta.cantidad_galones).label('total')
-    ).group_by('mes').order_by(func.sum(Venta.cantidad_galones).desc()).all()
+    def calcular_agregados():
+        tanques_por_tipo = {}
+        for tanque in tanques:
+            tipo = tanque.tipo_combustible
+            if tipo not in tanques_por_tipo:
+                tanques_por_tipo[tipo] = {"count": 0, "capacity": 0, "current": 0}
+            tanques_por_tipo[tipo]["count"] += 1
+            tanques_por_tipo[tipo]["capacity"] += float(tanque.capacidad)
+            tanques_por_tipo[tipo]["current"] += tanque.contenido or 0
+
+        combustible_mas_vendido = db.session.query(
+            Tanque.tipo_combustible,
+            func.sum(Venta.cantidad_galones).label('total')
+        ).join(Venta).group_by(Tanque.tipo_combustible).order_by(func.sum(Venta.cantidad_galones).desc()).first()
+
+        ventas_por_mes = db.session.query(
+            extract('month', Venta.fecha).label('mes'),
+            func.sum(Venta.cantidad_galones).label('total')
+        ).group_by('mes').order_by(func.sum(Venta.cantidad_galones).desc()).all()
+
+        return {
+            "tanques_por_tipo": tanques_por_tipo,
+            "combustible_mas_vendido": tuple(combustible_mas_vendido) if combustible_mas_vendido else None,
+            "ventas_por_mes": [tuple(fila) for fila in ventas_por_mes],
+        }
+
+    agregados = stats_cache.obtener('dashboard', 'index', calcular_agregados)
 
     context = {
         "tanques": tanques,
         "total_capacity": total_capacity,
         "mediciones_recientes": mediciones_recientes,
         "descargues_hoy": descargues_hoy,
-        "tanques_por_tipo": tanques_por_tipo,
+        "tanques_por_tipo": agregados["tanques_por_tipo"],
         "total_tanques": len(tanques),
-        "combustible_mas_vendido": combustible_mas_vendido,
-        "ventas_por_mes": ventas_por_mes
+        "combustible_mas_vendido": agregados["combustible_mas_vendido"],
+        "ventas_por_mes": agregados["ventas_por_mes"]
     }
     return render_template("dashboard/index.html", **context)
 
@@ -499,6 +533,7 @@ def tanques():
         Tanque.activo.desc(),  # Activos primero
         Tanque.id_tanques.asc()  # Luego por ID
     ).all()
+    Tanque.precargar_niveles(tanques)
     
     return render_template("dashboard/tanques.html", tanques=tanques)
 
@@ -560,110 +595,68 @@ def cambiar_rol_empleado(empleado_id):
 @admin_or_encargado_required
 def estadisticas():
     """Dashboard de estadísticas para toma de decisiones - 2 estadísticas clave"""
-    from collections import OrderedDict
-    
     hoy = datetime.now()
     hace_30_dias = hoy - timedelta(days=30)
     
-    # ===== ESTADÍSTICA 1: ALERTA DE TANQUES CON STOCK BAJO =====
-    tanques = Tanque.query.filter_by(activo=True).all()
-    tanques_alerta = []
-    
-    for tanque in tanques:
-        porcentaje = tanque.porcentaje_llenado
-        contenido = tanque.contenido
-        capacidad = tanque.capacidad or 0
-        
-        if porcentaje < 30:
-            nivel = 'critico' if porcentaje < 15 else 'bajo'
-            tanques_alerta.append({
-                'id': tanque.id_tanques,
-                'tipo': tanque.tipo_combustible,
-                'contenido': round(contenido, 2),
-                'capacidad': capacidad,
-                'porcentaje': round(porcentaje, 1),
-                'nivel': nivel,
-                'galones_faltantes': round(capacidad - contenido, 2)
-            })
-    
-    tanques_alerta.sort(key=lambda x: x['porcentaje'])
-    
-    # ===== ESTADÍSTICA 2: RENDIMIENTO Y PÉRDIDAS DEL MES =====
-    ventas_por_tipo = OrderedDict()
-    cargado_por_tipo = OrderedDict()
-    
-    for tanque in tanques:
-        tipo = tanque.tipo_combustible
-        
-        mediciones = RegistroMedida.query.filter(
-            RegistroMedida.id_tanques == tanque.id_tanques,
-            RegistroMedida.fecha_hora_registro >= hace_30_dias
-        ).order_by(RegistroMedida.fecha_hora_registro.asc()).all()
-        
-        total_vendido = 0
-        for i in range(1, len(mediciones)):
-            try:
-                galones_anterior = float(mediciones[i-1].galones or 0)
-                galones_actual = float(mediciones[i].galones or 0)
-                diferencia = galones_anterior - galones_actual
-                if diferencia > 0:
-                    total_vendido += diferencia
-            except (ValueError, TypeError):
-                continue
-        
-        if total_vendido > 0:
-            ventas_por_tipo[tipo] = ventas_por_tipo.get(tipo, 0) + total_vendido
-        
-        cargues = MedicionCargue.query.filter(
-            MedicionCargue.id_tanques == tanque.id_tanques,
-            MedicionCargue.fecha >= hace_30_dias
-        ).all()
-        
-        for cargue in cargues:
-            try:
-                galones = float(cargue.galones_totales or 0)
-                cargado_por_tipo[tipo] = cargado_por_tipo.get(tipo, 0) + galones
-            except (ValueError, TypeError):
-                continue
-    
-    total_cargado = sum(cargado_por_tipo.values())
-    total_vendido = sum(ventas_por_tipo.values())
-    diferencia = total_cargado - total_vendido
-    porcentaje_eficiencia = (total_vendido / total_cargado * 100) if total_cargado > 0 else 0
-    
-    rendimiento = {
-        'total_cargado': round(total_cargado, 2),
-        'total_vendido': round(total_vendido, 2),
-        'diferencia': round(diferencia, 2),
-        'porcentaje_eficiencia': round(porcentaje_eficiencia, 1),
-        'estado': 'normal' if diferencia >= 0 else 'alerta',
-        'ventas_por_tipo': dict(ventas_por_tipo),
-        'cargado_por_tipo': dict(cargado_por_tipo)
-    }
-    
-    # ===== DATOS PARA REPORTE MENSUAL =====
-    ventas_por_dia = OrderedDict()
-    mediciones_mes = RegistroMedida.query.filter(
-        RegistroMedida.fecha_hora_registro >= hace_30_dias
-    ).order_by(RegistroMedida.fecha_hora_registro.asc()).all()
-    
-    for i in range(1, len(mediciones_mes)):
-        try:
-            fecha = mediciones_mes[i].fecha_hora_registro.strftime('%Y-%m-%d')
-            galones_anterior = float(mediciones_mes[i-1].galones or 0)
-            galones_actual = float(mediciones_mes[i].galones or 0)
-            diferencia = galones_anterior - galones_actual
-            if diferencia > 0:
-                ventas_por_dia[fecha] = ventas_por_dia.get(fecha, 0) + diferencia
-        except (ValueError, TypeError):
-            continue
+    def calcular():
+        # ===== ESTADÍSTICA 1: ALERTA DE TANQUES CON STOCK BAJO =====
+        tanques = Tanque.precargar_niveles(Tanque.query.filter_by(activo=True).all())
+        tanques_alerta = []
+
+        for tanque in tanques:
+            porcentaje = tanque.porcentaje_llenado
+            contenido = tanque.contenido
+            capacidad = tanque.capacidad or 0
+
+            if porcentaje < 30:
+                nivel = 'critico' if porcentaje < 15 else 'bajo'
+                tanques_alerta.append({
+                    'id': tanque.id_tanques,
+                    'tipo': tanque.tipo_combustible,
+                    'contenido': round(contenido, 2),
+                    'capacidad': capacidad,
+                    'porcentaje': round(porcentaje, 1),
+                    'nivel': nivel,
+                    'galones_faltantes': round(capacidad - contenido, 2)
+                })
+
+        tanques_alerta.sort(key=lambda x: x['porcentaje'])
+
+        # ===== ESTADÍSTICA 2: RENDIMIENTO Y PÉRDIDAS DEL MES =====
+        # Consumo calculado en la BD (LAG por tanque) y agregado por día y tipo
+        ventas_por_tipo, ventas_por_dia = resumen_consumo(hace_30_dias)
+        cargado_por_tipo = cargado_por_tipo_combustible(hace_30_dias)
+
+        total_cargado = sum(cargado_por_tipo.values())
+        total_vendido = sum(ventas_por_tipo.values())
+        diferencia = total_cargado - total_vendido
+        porcentaje_eficiencia = (total_vendido / total_cargado * 100) if total_cargado > 0 else 0
+
+        rendimiento = {
+            'total_cargado': round(total_cargado, 2),
+            'total_vendido': round(total_vendido, 2),
+            'diferencia': round(diferencia, 2),
+            'porcentaje_eficiencia': round(porcentaje_eficiencia, 1),
+            'estado': 'normal' if diferencia >= 0 else 'alerta',
+            'ventas_por_tipo': dict(ventas_por_tipo),
+            'cargado_por_tipo': dict(cargado_por_tipo)
+        }
+
+        return {
+            'tanques_alerta': tanques_alerta,
+            'rendimiento': rendimiento,
+            'ventas_por_tipo': dict(ventas_por_tipo),
+            'ventas_por_dia': dict(ventas_por_dia),
+        }
+
+    datos = stats_cache.obtener('estadisticas', hoy.strftime('%Y-%m-%d'), calcular)
     
     return render_template(
         'dashboard/estadisticas.html',
-        tanques_alerta=tanques_alerta,
-        rendimiento=rendimiento,
-        ventas_por_tipo=dict(ventas_por_tipo),
-        ventas_por_dia=dict(ventas_por_dia),
+        tanques_alerta=datos['tanques_alerta'],
+        rendimiento=datos['rendimiento'],
+        ventas_por_tipo=datos['ventas_por_tipo'],
+        ventas_por_dia=datos['ventas_por_dia'],
         fecha_reporte=hoy.strftime('%B %Y')
     )
 
@@ -672,138 +665,56 @@ def estadisticas():
 @login_required
 @admin_or_encargado_required
 def reporte_mensual():
-    """Generar reporte mensual en PDF"""
-    from io import BytesIO
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-    from reportlab.lib.units import inch
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from collections import OrderedDict
-    import base64
-    
-    hoy = datetime.now()
-    hace_30_dias = hoy - timedelta(days=30)
-    
-    tanques = Tanque.query.filter_by(activo=True).all()
-    ventas_por_tipo = OrderedDict()
-    ventas_por_dia = OrderedDict()
-    
-    for tanque in tanques:
-        tipo = tanque.tipo_combustible
-        mediciones = RegistroMedida.query.filter(
-            RegistroMedida.id_tanques == tanque.id_tanques,
-            RegistroMedida.fecha_hora_registro >= hace_30_dias
-        ).order_by(RegistroMedida.fecha_hora_registro.asc()).all()
-        
-        for i in range(1, len(mediciones)):
-            try:
-                fecha = mediciones[i].fecha_hora_registro.strftime('%Y-%m-%d')
-                dia_semana = mediciones[i].fecha_hora_registro.strftime('%A')
-                galones_anterior = float(mediciones[i-1].galones or 0)
-                galones_actual = float(mediciones[i].galones or 0)
-                diferencia = galones_anterior - galones_actual
-                if diferencia > 0:
-                    ventas_por_tipo[tipo] = ventas_por_tipo.get(tipo, 0) + diferencia
-                    ventas_por_dia[fecha] = ventas_por_dia.get(fecha, 0) + diferencia
-            except (ValueError, TypeError):
-                continue
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=24, textColor=colors.HexColor('#E10000'), alignment=1)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Normal'], fontSize=12, textColor=colors.grey, alignment=1)
-    
-    elements.append(Paragraph("REPORTE MENSUAL DE COMBUSTIBLE", title_style))
-    elements.append(Paragraph(f"Estación Hayuelos - {hoy.strftime('%B %Y')}", subtitle_style))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    if ventas_por_tipo:
-        fig1, ax1 = plt.subplots(figsize=(6, 4))
-        colores = ['#E10000', '#00E1E1', '#00E100', '#FFA500', '#8A2BE2']
-        tipos = list(ventas_por_tipo.keys())
-        valores = list(ventas_por_tipo.values())
-        ax1.pie(valores, labels=tipos, autopct='%1.1f%%', colors=colores[:len(tipos)], startangle=90)
-        ax1.set_title('Combustible Más Vendido por Tipo', fontsize=14, fontweight='bold')
-        
-        img_buffer1 = BytesIO()
-        plt.savefig(img_buffer1, format='png', dpi=150, bbox_inches='tight')
-        plt.close(fig1)
-        img_buffer1.seek(0)
-        
-        elements.append(Image(img_buffer1, width=5*inch, height=3.5*inch))
-        elements.append(Spacer(1, 0.3*inch))
-    
-    if ventas_por_dia:
-        fig2, ax2 = plt.subplots(figsize=(8, 4))
-        fechas = list(ventas_por_dia.keys())[-14:]
-        valores_dias = [ventas_por_dia[f] for f in fechas]
-        fechas_cortas = [f[-5:] for f in fechas]
-        
-        barras = ax2.bar(fechas_cortas, valores_dias, color='#E10000', edgecolor='#C20000')
-        ax2.set_xlabel('Fecha', fontsize=10)
-        ax2.set_ylabel('Galones Vendidos', fontsize=10)
-        ax2.set_title('Días con Más Ventas (Últimas 2 Semanas)', fontsize=14, fontweight='bold')
-        plt.xticks(rotation=45, ha='right')
-        
-        for bar, val in zip(barras, valores_dias):
-            ax2.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 5, f'{int(val)}', ha='center', va='bottom', fontsize=8)
-        
-        plt.tight_layout()
-        img_buffer2 = BytesIO()
-        plt.savefig(img_buffer2, format='png', dpi=150, bbox_inches='tight')
-        plt.close(fig2)
-        img_buffer2.seek(0)
-        
-        elements.append(Image(img_buffer2, width=6*inch, height=3*inch))
-        elements.append(Spacer(1, 0.3*inch))
-    
-    elements.append(Paragraph("RESUMEN DE CONSUMO POR TIPO", styles['Heading2']))
-    nota_style = ParagraphStyle('Nota', parent=styles['Normal'], fontSize=9, textColor=colors.grey, alignment=0)
-    elements.append(Paragraph("* Los datos de consumo se calculan a partir de las diferencias en las mediciones de inventario.", nota_style))
-    elements.append(Spacer(1, 0.1*inch))
-    if ventas_por_tipo:
-        data = [['Tipo de Combustible', 'Galones Vendidos', 'Porcentaje']]
-        total = sum(ventas_por_tipo.values())
-        for tipo, galones in ventas_por_tipo.items():
-            porcentaje = (galones / total * 100) if total > 0 else 0
-            data.append([tipo, f"{galones:,.0f}", f"{porcentaje:.1f}%"])
-        data.append(['TOTAL', f"{total:,.0f}", '100%'])
-        
-        table = Table(data, colWidths=[2.5*inch, 2*inch, 1.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#E10000')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#FFE0E0')),
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        elements.append(table)
-    
-    elements.append(Spacer(1, 0.3*inch))
-    elements.append(Paragraph(f"Generado el {hoy.strftime('%d/%m/%Y a las %H:%M')}", subtitle_style))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f'reporte_mensual_{hoy.strftime("%Y_%m")}.pdf',
-        mimetype='application/pdf'
+    """Descargar el reporte mensual en PDF (se genera en segundo plano si no existe)"""
+    mes = request.args.get('mes')
+    try:
+        solicitud = solicitar_reporte(mes)
+    except ValueError:
+        flash("Mes inválido. Use el formato AAAA-MM.", "danger")
+        return redirect(url_for('dashboard.estadisticas'))
+
+    if solicitud['estado'] == 'completado':
+        return send_file(
+            solicitud['ruta'],
+            as_attachment=True,
+            download_name=solicitud['nombre'],
+            mimetype='application/pdf'
+        )
+
+    return render_template(
+        'dashboard/reporte_estado.html',
+        trabajo_id=solicitud['trabajo_id'],
+        nombre=solicitud['nombre']
     )
 
 
+@dashboard_bp.route("/reporte-mensual/estado/<trabajo_id>")
+@login_required
+@admin_or_encargado_required
+def reporte_mensual_estado(trabajo_id):
+    """Estado del trabajo de generación del reporte (JSON)"""
+    estado = trabajos.estado(trabajo_id)
+    if not estado or estado.get('tipo') != 'reporte':
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    respuesta = {'id': trabajo_id, 'estado': estado['estado'], 'error': estado.get('error')}
+    if estado['estado'] == 'completado':
+        respuesta['descarga'] = url_for('dashboard.reporte_mensual_descargar', trabajo_id=trabajo_id)
+    return jsonify(respuesta)
+
+
+@dashboard_bp.route("/reporte-mensual/descargar/<trabajo_id>")
+@login_required
+@admin_or_encargado_required
+def reporte_mensual_descargar(trabajo_id):
+    """Descargar el PDF generado por un trabajo"""
+    ruta, estado = ruta_resultado(trabajo_id)
+    if not ruta:
+        flash("El reporte no está disponible", "warning")
+        return redirect(url_for('dashboard.estadisticas'))
+    return send_file(ruta, as_attachment=True, download_name=estado.get('nombre'), mimetype='application/pdf')
+
+
 # ===== RUTAS PARA MANUALES Y POLÍTICAS =====
 
 @main_bp.route("/manual-usuario")
@@ -877,7 +788,16 @@ def registro():
             imagen_path=imagen_path
         )
         db.session.add(medicion)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # uq_registro_medidas_tanque_fecha: otra lectura del mismo tanque en el mismo segundo
+            db.session.rollback()
+            if imagen_path:
+                os.remove(os.path.join('static/uploads', imagen_path))
+            flash("❌ Ya se registró una medición para este tanque en este mismo momento. "
+                  "Revise el historial o intente de nuevo.", "danger")
+            return render_template("medicion/registro.html", form=form)
         
         registrar_auditoria('CREATE', 'registro_medidas', medicion.id_registro_medidas, None, {
             'tanque': form.tanque.data,
@@ -894,21 +814,12 @@ def registro():
 def historial():
     page = request.args.get("page", 1, type=int)
     
-    query = RegistroMedida.query
-    
-    fecha_desde = request.args.get('fecha_desde')
-    fecha_hasta = request.args.get('fecha_hasta')
-    tanque_id = request.args.get('tanque', type=int)
-    tipo = request.args.get('tipo')
-    
-    if fecha_desde:
-        query = query.filter(RegistroMedida.fecha_hora_registro >= fecha_desde)
-    if fecha_hasta:
-        query = query.filter(RegistroMedida.fecha_hora_registro <= fecha_hasta)
-    if tanque_id:
-        query = query.filter_by(id_tanques=tanque_id)
-    if tipo:
-        query = query.filter_by(tipo_medida=tipo)
+    query = RegistroMedida.consulta(
+        fecha_desde=request.args.get('fecha_desde'),
+        fecha_hasta=request.args.get('fecha_hasta'),
+        id_tanques=request.args.get('tanque', type=int),
+        tipo_medida=request.args.get('tipo')
+    )
     
     mediciones = query.order_by(
         RegistroMedida.fecha_hora_registro.desc()
@@ -1012,28 +923,73 @@ def convert_cm_to_gallons(tanque_id):
     cm = request.args.get('cm', type=float, default=0)
     
     tanque = Tanque.query.get_or_404(tanque_id)
-    
-    # Fix: Use tanque.radio_cm (from DB) instead of non-existent diametro_m
     radio_cm = tanque.radio_cm if tanque.radio_cm else 125  # Fallback to default if None
     
-    # Fórmula correcta: V = π * r² * h
-    # 1 galón = 3785.411784 cm³
-    area_base = 3.14159 * (radio_cm ** 2)  # cm²
-    volumen_cm3 = area_base * cm  # cm³
-    galones = volumen_cm3 / 3785.411784
-    
     return jsonify({
         'cm': cm,
-        'gallons': round(galones, 2),
+        'gallons': tanque.cm_a_galones(cm),
         'tanque_id': tanque_id,
         'radio_cm': radio_cm
     })
 
+@medicion_bp.route("/api/convert_cm_to_gallons", methods=["POST"])
+@login_required
+def convert_cm_to_gallons_batch():
+    """API para convertir muchos pares (tanque, cm) en una sola petición.
+
+    Cuerpo JSON: {"items": [{"tanque_id": 1, "cm": 120.5}, ...]}, con el
+    token CSRF en la cabecera X-CSRFToken.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'El cuerpo debe ser un objeto JSON'}), 400
+    items = payload.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Se requiere una lista "items"'}), 400
+    if len(items) > 5000:
+        return jsonify({'error': 'Máximo 5000 conversiones por petición'}), 400
+
+    try:
+        ids = [int(item['tanque_id']) for item in items]
+        alturas = [float(str(item.get('cm', 0)).replace(',', '.')) for item in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Cada item requiere tanque_id y cm numéricos'}), 400
+
+    tanques = {t.id_tanques: t for t in Tanque.query.filter(Tanque.id_tanques.in_(set(ids))).all()}
+    galones = calibracion.convertir_columna(ids, alturas, tanques)
+
+    return jsonify({
+        'items': [
+            {
+                'tanque_id': id_tanques,
+                'cm': cm,
+                'gallons': None if id_tanques not in tanques else float(gl)
+            }
+            for id_tanques, cm, gl in zip(ids, alturas, galones)
+        ]
+    })
+
+@medicion_bp.route("/api/tabla_conversion/<int:tanque_id>", methods=["GET"])
+@login_required
+def tabla_conversion(tanque_id):
+    """Tabla de conversión compacta del tanque para convertir en el navegador (con ETag)"""
+    tanque = Tanque.query.get_or_404(tanque_id)
+    version = calibracion.versiones_activas([tanque_id]).get(tanque_id)
+    etag = calibracion.etag_tabla(tanque, version)
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(calibracion.tabla_cliente(tanque))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @medicion_bp.route("/historial_descargues")
 @login_required
 def historial_descargues():
     page = request.args.get("page", 1, type=int)
-    descargues = Descargue.query.order_by(Descargue.fecha.desc()).paginate(
+    descargues = Descargue.consulta().order_by(Descargue.fecha.desc()).paginate(
         page=page, per_page=20, error_out=False
     )
     return render_template("medicion/historial_descargues.html", descargues=descargues)
@@ -1067,127 +1023,34 @@ def carga_masiva():
             flash("Archivo inválido", "danger")
             return redirect(request.url)
 
-        try:
-            if file.filename.lower().endswith('.csv'):
-                df = pd.read_csv(file, sep=',', decimal='.', encoding='utf-8-sig')
-            else:
-                df = pd.read_excel(file)
-            
-            df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            df.replace({"True": True, "False": False}, inplace=True, regex=True)
-
-            count = 0
-            errors = []
-
-            if tipo_carga == 'empleados':
-                required = ['nombre_empleado', 'apellido_empleado', 'numero_documento', 'email', 'usuario']
-                if not all(col in df.columns for col in required):
-                    flash(f"Faltan columnas: {', '.join(required)}", "danger")
-                    return redirect(request.url)
-                
-                for idx, row in df.iterrows():
-                    if Empleado.query.filter_by(numero_documento=row['numero_documento']).first():
-                        errors.append(f"Fila {idx+2}: Documento duplicado")
-                        continue
-                    if Empleado.query.filter_by(usuario=row['usuario']).first():
-                        errors.append(f"Fila {idx+2}: Usuario duplicado")
-                        continue
-                    
-                    temp_pass = str(row['numero_documento'])[-4:]
-                    empleado = Empleado(
-                        nombre_empleado=row['nombre_empleado'],
-                        apellido_empleado=row['apellido_empleado'],
-                        numero_documento=row['numero_documento'],
-                        tipo_documento=row.get('tipo_documento', 'CC'),
-                        email=row['email'],
-                        telefono=row.get('telefono', ''),
-                        direccion=row.get('direccion', ''),
-                        cargo_establecido=row.get('cargo_establecido', 'Islero'),
-                        usuario=row['usuario'],
-                        temporal=True,
-                        activo=row.get('activo', True),
-                        email_confirmado=True,
-                        aceptado_terminos=row.get('aceptado_terminos', False)
-                    )
-                    empleado.set_password(temp_pass)
-
-                    db.session.add(empleado)
-                    count += 1
-
-            elif tipo_carga == 'tanques':
-                required = ['tipo_combustible', 'capacidad']
-                if not all(col in df.columns for col in required):
-                    flash("Faltan columnas: tipo_combustible, capacidad", "danger")
-                    return redirect(request.url)
-                
-                for idx, row in df.iterrows():
-                    try:
-                        capacidad = int(float(str(row['capacidad']).replace(',', '.')))
-                        tanque = Tanque(
-                            tipo_combustible=row['tipo_combustible'],
-                            capacidad=capacidad,
-                            activo=row.get('activo', True)
-                        )
-                        db.session.add(tanque)
-                        count += 1
-                    except Exception as e:
-                        errors.append(f"Fila {idx+2}: Capacidad inválida → {str(e)}")
-
-            elif tipo_carga == 'mediciones':
-                required = ['tanque_id', 'medida_combustible', 'galones', 'tipo_medida', 'fecha_hora_registro', 'empleado_id']
-                if not all(col in df.columns for col in required):
-                    flash("Faltan columnas en mediciones", "danger")
-                    return redirect(request.url)
-                
-                for idx, row in df.iterrows():
-                    try:
-                        tanque_id = int(row['tanque_id'])
-                        empleado_id = int(row['empleado_id'])
-                        tanque = Tanque.query.get(tanque_id)
-                        empleado = Empleado.query.get(empleado_id)
-                        
-                        if not tanque:
-                            errors.append(f"Fila {idx+2}: tanque_id {tanque_id} no existe")
-                            continue
-                        if not empleado:
-                            errors.append(f"Fila {idx+2}: empleado_id {empleado_id} no existe")
-                            continue
-                        
-                        medida_str = str(row['medida_combustible']).replace(',', '.')
-                        galones_str = str(row['galones']).replace(',', '.')
-                        medida = float(medida_str)
-                        galones = float(galones_str)
-                        
-                        fecha_str = str(row['fecha_hora_registro']).strip()
-                        try:
-                            fecha = datetime.strptime(fecha_str, '%Y-%m-%d %H:%M:%S')
-                        except:
-                            fecha = datetime.strptime(fecha_str, '%Y-%m-%d %H:%M')
-                        
-                        medicion = RegistroMedida(
-                            id_tanques=tanque.id_tanques,
-                            id_empleados=empleado.id_empleados,
-                            medida_combustible=medida,
-                            galones=galones,
-                            tipo_medida=row['tipo_medida'],
-                            novedad=row.get('novedad', ''),
-                            fecha_hora_registro=fecha
-                        )
-                        db.session.add(medicion)
-                        count += 1
-                    except Exception as e:
-                        errors.append(f"Fila {idx+2}: Error → {str(e)}")
+        if form.por_bloques.data or form.segundo_plano.data or form.simular.data:
+            return _carga_por_bloques(form, file, tipo_carga)
 
+        actualizar = form.actualizar.data
+        try:
+            df = leer_archivo(file)
+            resultado = cargar(tipo_carga, df, actualizar=actualizar)
             db.session.commit()
-            registrar_auditoria('CREATE_BULK', tipo_carga, None, None, {'count': count})
+            count = resultado.insertados
+            errors = resultado.mensajes()
+            datos = {'count': count}
+            if actualizar:
+                datos.update(actualizados=resultado.actualizados, sin_cambios=resultado.sin_cambios)
+            registrar_auditoria('UPSERT_BULK' if actualizar else 'CREATE_BULK', tipo_carga, None, None, datos)
 
             msg = f"Se cargaron {count} registros exitosamente"
+            if actualizar:
+                msg += f" ({resultado.actualizados} actualizados, {resultado.sin_cambios} sin cambios)"
             if errors:
                 error_sample = "; ".join(errors[:3])
                 flash(f"{msg}. Errores: {len(errors)} → {error_sample}", "warning")
             else:
                 flash(msg, "success")
 
+        except CargaError as e:
+            db.session.rollback()
+            flash(str(e), "danger")
+            return redirect(request.url)
         except Exception as e:
             db.session.rollback()
             flash(f"Error crítico: {str(e)}", "danger")
@@ -1196,8 +1059,126 @@ def carga_masiva():
     return render_template("admin/carga_masiva.html", form=form)
 
 
+def _carga_por_bloques(form, file, tipo_carga):
+    """Importación por bloques: commit por bloque, checkpoint y reporte de errores descargable.
+
+    Con ``segundo_plano`` se encola como trabajo y se consulta su progreso;
+    con ``simular`` sólo se valida el archivo completo (dry run).
+    """
+    carga_id, ruta = guardar_subida(file, tipo_carga)
+    actualizar = form.actualizar.data
+
+    if form.segundo_plano.data:
+        trabajo_id = solicitar_carga(carga_id, ruta, tipo_carga, form.simular.data, actualizar,
+                                     current_user.id_empleados, request.remote_addr)
+        estado_url = url_for('admin.carga_masiva_estado', trabajo_id=trabajo_id)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'trabajo_id': trabajo_id, 'estado_url': estado_url}), 202
+        return render_template('admin/carga_estado.html', trabajo_id=trabajo_id,
+                               tipo=tipo_carga, simular=form.simular.data, actualizar=actualizar)
+
+    # Mismo archivo ya en curso (en segundo plano o en otra petición): no procesarlo dos veces
+    trabajo_id = id_trabajo(carga_id, form.simular.data, actualizar)
+    if trabajos.activo(trabajo_id):
+        flash("Este archivo ya se está procesando. Puede seguir su progreso aquí.", "info")
+        return render_template('admin/carga_estado.html', trabajo_id=trabajo_id,
+                               tipo=tipo_carga, simular=form.simular.data, actualizar=actualizar)
+
+    if form.simular.data:
+        try:
+            resumen = validar_por_bloques(trabajo_id, ruta, tipo_carga, actualizar=actualizar)
+        except CargaError as e:
+            flash(str(e), "danger")
+            return redirect(request.url)
+        detalle = (f" ({resumen['actualizados']} se actualizarían, {resumen['sin_cambios']} sin cambios)"
+                   if actualizar else "")
+        flash(f"Validación completa: {resumen['validos']} filas válidas{detalle}, {resumen['rechazados']} rechazadas. "
+              "No se guardó ningún registro.", "warning" if resumen['rechazados'] else "success")
+        return render_template("admin/carga_masiva.html", form=form, resumen=resumen)
+
+    try:
+        resumen = importar_por_bloques(trabajo_id, ruta, tipo_carga, actualizar=actualizar)
+    except CargaError as e:
+        flash(str(e), "danger")
+        return redirect(request.url)
+    except Exception as e:
+        flash(f"Error en la importación: {str(e)}. Suba el mismo archivo para reanudar desde el último bloque.", "danger")
+        print(f"[ERROR] {e}")
+        return redirect(request.url)
+
+    if resumen.get('ya_importado'):
+        flash("Este archivo ya fue importado completamente", "info")
+    else:
+        registrar_auditoria('UPSERT_BULK' if actualizar else 'CREATE_BULK', tipo_carga, None, None, {
+            'count': resumen['insertados'],
+            'actualizados': resumen['actualizados'],
+            'sin_cambios': resumen['sin_cambios'],
+            'rechazados': resumen['rechazados'],
+            'carga': trabajo_id
+        })
+        if resumen.get('reanudado_desde'):
+            flash(f"Importación reanudada desde la fila {resumen['reanudado_desde'] + 2}", "info")
+        detalle = (f", {resumen['actualizados']} actualizados, {resumen['sin_cambios']} sin cambios"
+                   if actualizar else "")
+        flash(f"Se cargaron {resumen['insertados']} registros en {resumen['bloques']} bloques{detalle}. "
+              f"Rechazados: {resumen['rechazados']}", "warning" if resumen['rechazados'] else "success")
+    return render_template("admin/carga_masiva.html", form=form, resumen=resumen)
+
+
+@admin_bp.route("/carga_masiva/errores/<carga_id>")
+@login_required
+@admin_required
+def carga_masiva_errores(carga_id):
+    """Descargar el reporte de filas rechazadas de una importación o validación"""
+    estado = trabajos.estado(carga_id)
+    if not estado or estado.get('tipo') not in ('carga', 'validacion') or not os.path.exists(ruta_errores(carga_id)):
+        flash("Reporte de errores no disponible", "warning")
+        return redirect(url_for('admin.carga_masiva'))
+    return send_file(ruta_errores(carga_id), mimetype='text/csv', as_attachment=True,
+                     download_name=f"errores_{carga_id}.csv")
+
+
+@admin_bp.route("/carga_masiva/estado/<trabajo_id>")
+@login_required
+@admin_required
+def carga_masiva_estado(trabajo_id):
+    """Progreso de una carga en segundo plano (JSON): filas procesadas, rechazadas y ritmo"""
+    estado = trabajos.estado(trabajo_id)
+    if not estado or estado.get('tipo') not in ('carga', 'validacion'):
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    respuesta = {
+        'id': trabajo_id,
+        'estado': estado['estado'],
+        'error': estado.get('error'),
+        'simulacion': estado['tipo'] == 'validacion',
+        'filas_procesadas': estado.get('filas_procesadas', 0),
+        'insertados': estado.get('insertados'),
+        'validos': estado.get('validos'),
+        'actualizados': estado.get('actualizados'),
+        'sin_cambios': estado.get('sin_cambios'),
+        'rechazados': estado.get('rechazados', 0),
+        'bloques': estado.get('bloques', 0),
+        'filas_por_segundo': estado.get('filas_por_segundo'),
+    }
+    if respuesta['rechazados'] and os.path.exists(ruta_errores(trabajo_id)):
+        respuesta['errores_url'] = url_for('admin.carga_masiva_errores', carga_id=trabajo_id)
+    return jsonify(respuesta)
+
+
 # ============= EXPORT ROUTES (AGREGAR AL FINAL DE routes.py) =============
 
+@admin_bp.route("/sesiones")
+@login_required
+@admin_required
+def sesiones_activas():
+    """Sesiones abiertas ahora (no recorre el histórico: índice por activa y actividad)"""
+    return render_template(
+        "admin/sesiones.html",
+        sesiones=sesiones.activas(),
+        inactividad_horas=current_app.config["SESIONES_INACTIVIDAD_HORAS"],
+    )
+
 @admin_bp.route("/export_menu", methods=["GET"])
 @login_required
 @admin_or_encargado_required
@@ -1212,208 +1193,136 @@ def export_menu():
 @admin_or_encargado_required
 def export_data(tipo):
     """Exportar datos en formato Excel o CSV"""
-    from io import BytesIO
-    try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill, Alignment
-    except ImportError:
-        flash("Error: Instale openpyxl con 'pip install openpyxl'", "danger")
-        return redirect(url_for('dashboard.index'))
-    
     formato = request.args.get('formato', 'excel')  # 'excel' o 'csv'
     
     # Determinar qué datos exportar
-    if tipo == 'empleados':
-        empleados = Empleado.query.all()
-        data = []
-        headers = ['ID', 'Usuario', 'Nombre', 'Apellido', 'Documento', 'Email', 'Teléfono', 
-                   'Dirección', 'Cargo', 'Activo', 'Email Confirmado', 'Fecha Creación']
-        
-        for emp in empleados:
-            data.append([
-                emp.id_empleados,
-                emp.usuario,
-                emp.nombre_empleado,
-                emp.apellido_empleado,
-                emp.numero_documento,
-                emp.email,
-                emp.telefono or '',
-                emp.direccion or '',
-                emp.cargo_establecido,
-                'Sí' if emp.activo else 'No',
-                'Sí' if emp.email_confirmado else 'No',
-                emp.fecha_creacion.strftime('%Y-%m-%d %H:%M') if emp.fecha_creacion else ''
-            ])
-        filename = f"empleados_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-    elif tipo == 'tanques':
-        tanques = Tanque.query.all()
-        data = []
-        headers = ['ID', 'Tipo Combustible', 'Capacidad (gal)', 'Contenido (gal)', 
-                   'Volumen (m³)', 'Activo', 'Fecha Creación']
-        
-        for tanque in tanques:
-            data.append([
-                tanque.id_tanques,
-                tanque.tipo_combustible,
-                tanque.capacidad,
-                tanque.contenido or 0,
-                tanque.volumen_m3,
-                'Sí' if tanque.activo else 'No',
-                tanque.fecha_creacion.strftime('%Y-%m-%d') if tanque.fecha_creacion else ''
-            ])
-        filename = f"tanques_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-    elif tipo == 'mediciones':
-        # Filtros opcionales
-        fecha_desde = request.args.get('fecha_desde')
-        fecha_hasta = request.args.get('fecha_hasta')
-        tanque_id = request.args.get('tanque_id')
-        
-        query = RegistroMedida.query
-        if fecha_desde:
-            query = query.filter(RegistroMedida.fecha_hora_registro >= fecha_desde)
-        if fecha_hasta:
-            query = query.filter(RegistroMedida.fecha_hora_registro <= fecha_hasta)
-        if tanque_id:
-            query = query.filter_by(id_tanques=int(tanque_id))
-        
-        mediciones = query.order_by(RegistroMedida.fecha_hora_registro.desc()).all()
-        
-        data = []
-        headers = ['ID', 'Fecha/Hora', 'Tanque', 'Tipo Combustible', 'Medida (cm)', 
-                   'Galones', 'Tipo Medición', 'Empleado', 'Novedad']
-        
-        for med in mediciones:
-            data.append([
-                med.id_registro_medidas,
-                med.fecha_hora_registro.strftime('%Y-%m-%d %H:%M:%S') if med.fecha_hora_registro else '',
-                f"Tanque {med.tanque.id_tanques}" if med.tanque else 'N/A',
-                med.tanque.tipo_combustible if med.tanque else 'N/A',
-                med.medida_combustible or '',
-                med.galones or 0,
-                med.tipo_medida or 'rutinario',
-                med.empleado.nombre_empleado if med.empleado else 'N/A',
-                med.novedad or ''
-            ])
-        filename = f"mediciones_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-    elif tipo == 'descargues':
-        # Filtros opcionales
-        fecha_desde = request.args.get('fecha_desde')
-        fecha_hasta = request.args.get('fecha_hasta')
-        
-        query = Descargue.query
-        if fecha_desde:
-            query = query.filter(Descargue.fecha >= fecha_desde)
-        if fecha_hasta:
-            query = query.filter(Descargue.fecha <= fecha_hasta)
-        
-        descargues = query.order_by(Descargue.fecha.desc()).all()
-        
-        data = []
-        headers = ['ID', 'Fecha', 'Tanque', 'Medida Inicial (gl)', 'Descargue (gl)', 
-                   'Medida Final (gl)', 'Diferencia', 'Empleado', 'Kit Derrames', 
-                   'Extintores', 'Observaciones']
-        
-        for desc in descargues:
-            data.append([
-                desc.idDescargue,
-                desc.fecha.strftime('%Y-%m-%d') if desc.fecha else '',
-                desc.tanque or '',
-                float(desc.medida_inicial_gl) if desc.medida_inicial_gl else 0,
-                float(desc.descargue_gl) if desc.descargue_gl else 0,
-                float(desc.medida_final_gl) if desc.medida_final_gl else 0,
-                float(desc.diferencia) if desc.diferencia else 0,
-                desc.empleado.nombre_empleado if desc.empleado else 'N/A',
-                desc.kit_derrames or 'no',
-                desc.extintores or 'no',
-                desc.observaciones1 or ''
-            ])
-        filename = f"descargues_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    
-    else:
+    exportacion = preparar_exportacion(tipo, request.args)
+    if exportacion is None:
         flash("Tipo de exportación no válido", "danger")
         return redirect(url_for('dashboard.index'))
+    headers = exportacion.headers
+    filename = exportacion.nombre
+    
+    if formato in FORMATOS_COLUMNARES:
+        if exportacion.lotes is None:
+            flash(f"El formato {formato} sólo está disponible para mediciones y descargues", "warning")
+            return redirect(url_for('admin.export_menu'))
+        if not columnar_disponible():
+            flash("Error: Instale pyarrow con 'pip install pyarrow'", "danger")
+            return redirect(url_for('admin.export_menu'))
+    
+    # Rangos grandes: generar el archivo en segundo plano y descargarlo al terminar
+    if request.args.get('modo') == 'async':
+        if formato not in FORMATOS_EXPORTACION:
+            flash("Formato de exportación no válido", "danger")
+            return redirect(url_for('admin.export_menu'))
+        trabajo_id = solicitar_exportacion(
+            exportacion, request.args, formato, request.args.get('gzip') == '1',
+            current_user.id_empleados, request.remote_addr
+        )
+        estado_url = url_for('admin.export_estado', trabajo_id=trabajo_id)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'trabajo_id': trabajo_id, 'estado_url': estado_url}), 202
+        return render_template('admin/exportacion_estado.html', trabajo_id=trabajo_id, tipo=tipo)
     
     # Generar archivo según formato
     if formato == 'csv':
-        # Exportar como CSV
-        output = BytesIO()
-        df = pd.DataFrame(data, columns=headers)
-        df.to_csv(output, index=False, encoding='utf-8-sig')
-        output.seek(0)
+        # CSV en streaming: filas leídas por lotes y escritas a medida que llegan
+        estado = {}
         
-        registrar_auditoria('EXPORT_CSV', tipo, None, None, {
-            'formato': 'csv',
-            'registros': len(data)
-        })
+        def generar():
+            yield from escribir_csv(headers, exportacion.filas(), estado)
+            registrar_auditoria('EXPORT_CSV', tipo, None, None, {
+                'formato': 'csv',
+                'registros': estado.get('registros', 0)
+            })
         
-        return send_file(
-            output,
+        return Response(
+            stream_with_context(generar()),
             mimetype='text/csv',
-            as_attachment=True,
-            download_name=f"{filename}.csv"
+            headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'}
         )
     
-    else:  # Excel
-        # Crear workbook de Excel con estilos
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = tipo.capitalize()
-        
-        # Estilo para encabezados
-        header_fill = PatternFill(start_color="E10000", end_color="E10000", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        header_alignment = Alignment(horizontal="center", vertical="center")
+    elif formato in FORMATOS_COLUMNARES:
+        # Parquet / Arrow IPC: columnas tipadas, comprimidas y enviadas por record batch
+        extension, mimetype, accion = FORMATOS_EXPORTACION[formato]
+        estado = {}
         
-        # Escribir encabezados
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
-            cell.value = header
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = header_alignment
-        
-        # Escribir datos
-        for row_num, row_data in enumerate(data, 2):
-            for col_num, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col_num)
-                cell.value = value
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-        
-        # Ajustar ancho de columnas
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Congelar primera fila
-        ws.freeze_panes = 'A2'
+        def generar():
+            yield from escribir_columnar(exportacion.lotes(), formato, estado)
+            registrar_auditoria(accion, tipo, None, None, {
+                'formato': formato,
+                'registros': estado.get('registros', 0)
+            })
         
-        # Guardar en BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        return Response(
+            stream_with_context(generar()),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}.{extension}"'}
+        )
+    
+    else:  # Excel
+        # XLSX en disco con memoria constante; el temporal se borra al cerrar la respuesta
+        import tempfile
+        fd, ruta = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        estado = {}
+        try:
+            escribir_xlsx(headers, exportacion.filas(), ruta, tipo.capitalize(), estado)
+        except Exception:
+            os.remove(ruta)
+            raise
         
         registrar_auditoria('EXPORT_EXCEL', tipo, None, None, {
             'formato': 'excel',
-            'registros': len(data)
+            'registros': estado.get('registros', 0)
         })
         
-        return send_file(
-            output,
+        response = send_file(
+            ruta,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
             download_name=f"{filename}.xlsx"
         )
+        response.call_on_close(lambda: os.path.exists(ruta) and os.remove(ruta))
+        return response
+
+
+@admin_bp.route("/export/estado/<trabajo_id>", methods=["GET"])
+@login_required
+@admin_or_encargado_required
+def export_estado(trabajo_id):
+    """Estado de una exportación en segundo plano (JSON)"""
+    _, estado = ruta_exportacion(trabajo_id, current_user.id_empleados)
+    if not estado:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    resultado = estado.get('resultado') or {}
+    respuesta = {
+        'id': trabajo_id,
+        'estado': estado['estado'],
+        'error': estado.get('error'),
+        'nombre': estado.get('nombre'),
+        'registros': resultado.get('registros'),
+        'bytes': resultado.get('bytes'),
+    }
+    if estado['estado'] == 'completado':
+        respuesta['descarga'] = url_for('admin.export_descargar', trabajo_id=trabajo_id)
+    return jsonify(respuesta)
+
+
+@admin_bp.route("/export/descargar/<trabajo_id>", methods=["GET"])
+@login_required
+@admin_or_encargado_required
+def export_descargar(trabajo_id):
+    """Descargar el archivo de una exportación (admite Range para reanudar)"""
+    ruta, estado = ruta_exportacion(trabajo_id, current_user.id_empleados)
+    if not ruta:
+        flash("La exportación no está disponible o ya expiró", "warning")
+        return redirect(url_for('admin.export_menu'))
+    mimetype = 'application/gzip' if estado.get('comprimido') else FORMATOS_EXPORTACION[estado['formato']][1]
+    return send_file(ruta, as_attachment=True, download_name=estado.get('nombre'),
+                     mimetype=mimetype, conditional=True)
 
 # Agregar estas rutas al final de admin_bp en routes.py
 
@@ -1500,19 +1409,47 @@ def toggle_tanque(tanque_id):
     return redirect(url_for("dashboard.tanques"))
 
 
-def calcular_altura_maxima(capacidad_galones):
-    """Calcular altura máxima en cm basada en capacidad del tanque"""
-    # Radio estándar en cm (ajustar según tanques reales)
-    radio_cm = 125  # 2.5m de diámetro
-    
-    # Volumen en cm³ = capacidad en galones * 3785.411784
-    volumen_cm3 = capacidad_galones * 3785.411784
-    
-    # Altura = Volumen / (π * r²)
-    area_base = 3.14159 * (radio_cm ** 2)
-    altura_cm = volumen_cm3 / area_base
-    
-    return round(altura_cm, 2)
+@admin_bp.route("/tanques/<int:tanque_id>/calibracion", methods=["GET", "POST"])
+@login_required
+@admin_or_encargado_required
+def calibracion_tanque(tanque_id):
+    """Subir la tabla de aforo (cm → galones) de un tanque"""
+    tanque = Tanque.query.get_or_404(tanque_id)
+    form = CalibracionForm()
+
+    if form.validate_on_submit():
+        file = form.archivo.data
+        try:
+            alturas, galones = leer_tabla(file)
+        except TablaCalibracionError as e:
+            flash(f"Tabla inválida: {e}", "danger")
+            return redirect(request.url)
+        except Exception as e:
+            flash(f"No se pudo leer el archivo: {e}", "danger")
+            return redirect(request.url)
+
+        tabla = TablaCalibracion.publicar(
+            tanque, alturas, galones,
+            nombre_archivo=secure_filename(file.filename),
+            id_empleados=current_user.id_empleados
+        )
+        tanque.altura_maxima_cm = float(alturas[-1])
+        db.session.commit()
+
+        registrar_auditoria('CREATE', 'tabla_calibracion', tabla.id_tabla, None, {
+            'tanque': tanque_id,
+            'version': tabla.version,
+            'puntos': tabla.puntos
+        })
+
+        flash(f"Tabla de aforo v{tabla.version} cargada ({tabla.puntos} puntos)", "success")
+        return redirect(url_for("dashboard.tanques"))
+
+    tablas = TablaCalibracion.query.filter_by(id_tanques=tanque_id).order_by(
+        TablaCalibracion.version.desc()
+    ).all()
+    return render_template("admin/calibracion_form.html", form=form, tanque=tanque, tablas=tablas)
+
 
 # ============= CARGUE DE EMERGENCIA =============
 @medicion_bp.route("/cargue_emergencia", methods=["GET", "POST"])
@@ -1598,7 +1535,7 @@ def cargue_emergencia():
 def historial_cargues():
     """Historial de cargues de emergencia"""
     page = request.args.get("page", 1, type=int)
-    cargues = MedicionCargue.query.order_by(
+    cargues = MedicionCargue.consulta().order_by(
         MedicionCargue.fecha.desc()
     ).paginate(page=page, per_page=20, error_out=False)
     
@@ -0,0 +1,219 @@
+# sesiones.py - Seguimiento de sesiones: latidos en memoria, volcado por lotes y retención
+import atexit
+import secrets
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import request, session
+from sqlalchemy import bindparam, delete, insert, select, update
+
+LOTE_ARCHIVO = 1000
+
+
+class RegistroSesiones:
+    """Sesiones activas sin escribir en la BD en cada petición.
+
+    El login inserta su fila en la transacción de la petición, así un logout
+    atendido por otro worker siempre la encuentra. La última actividad
+    ("latidos") se acumula en memoria y un hilo la vuelca cada
+    ``SESIONES_INTERVALO`` segundos con un UPDATE por lote. El mismo hilo
+    vence las sesiones inactivas y pasa las viejas a sesiones_archivadas, a
+    lo sumo una vez por ``SESIONES_LIMPIEZA_INTERVALO``. Cada worker tiene su
+    propio búfer de latidos, así que la última actividad que otro worker no
+    ha volcado aparece como mucho un intervalo tarde.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.intervalo = 60
+        self._latidos = {}   # session_id -> última actividad pendiente
+        self._lock = threading.Lock()
+        self._volcando = False
+        self._ultimo_volcado = time.monotonic()
+        self._ultima_limpieza = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SESIONES_INTERVALO", 60)
+        app.config.setdefault("SESIONES_INACTIVIDAD_HORAS", 12)
+        app.config.setdefault("SESIONES_RETENCION_DIAS", 30)
+        app.config.setdefault("SESIONES_LIMPIEZA_INTERVALO", 3600)
+        self.intervalo = app.config["SESIONES_INTERVALO"]
+        if self.app is None:
+            atexit.register(self._al_salir)
+        self.app = app
+        app.before_request(self._latido_peticion)
+        app.extensions["sesiones"] = self
+
+    # ============= REGISTRO =============
+
+    def iniciar(self, id_empleados, ip_address, user_agent):
+        """Registrar una sesión nueva y devolver su session_id (el llamador hace commit)"""
+        from extensions import db
+        from models import SesionActiva
+        session_id = secrets.token_urlsafe(32)
+        db.session.add(SesionActiva(
+            id_empleados=id_empleados,
+            session_id=session_id,
+            ip_address=ip_address,
+            user_agent=(user_agent or '')[:255],
+        ))
+        return session_id
+
+    def latido(self, session_id):
+        with self._lock:
+            self._latidos[session_id] = datetime.utcnow()
+            toca = not self._volcando and time.monotonic() - self._ultimo_volcado >= self.intervalo
+            if toca:
+                self._volcando = True
+        if toca:
+            threading.Thread(target=self._volcar_en_hilo, name="sesiones", daemon=True).start()
+
+    def _latido_peticion(self):
+        session_id = session.get('sesion_id')
+        if session_id and request.endpoint != 'static':
+            self.latido(session_id)
+
+    def cerrar(self, session_id):
+        """Marcar una sesión como cerrada (el llamador hace commit)"""
+        from extensions import db
+        from models import SesionActiva
+        with self._lock:
+            self._latidos.pop(session_id, None)
+        db.session.execute(
+            update(SesionActiva)
+            .where(SesionActiva.session_id == session_id)
+            .values(activa=False, fecha_actividad=datetime.utcnow())
+        )
+
+    def cerrar_todas(self, id_empleados):
+        """Cerrar todas las sesiones activas de un empleado (el llamador hace commit)"""
+        from extensions import db
+        from models import SesionActiva
+        db.session.execute(
+            update(SesionActiva)
+            .where(SesionActiva.id_empleados == id_empleados, SesionActiva.activa == True)
+            .values(activa=False, fecha_actividad=datetime.utcnow())
+        )
+
+    # ============= VOLCADO =============
+
+    def volcar(self):
+        """Escribir los latidos pendientes; devuelve cuántas sesiones se tocaron"""
+        from extensions import db
+        from models import SesionActiva
+
+        with self._lock:
+            latidos, self._latidos = self._latidos, {}
+            self._ultimo_volcado = time.monotonic()
+        if not latidos:
+            return 0
+
+        tabla = SesionActiva.__table__
+        try:
+            with db.engine.begin() as conn:
+                # Un latido tardío no reabre una sesión ya cerrada
+                conn.execute(
+                    update(tabla)
+                    .where(tabla.c.session_id == bindparam('b_session_id'), tabla.c.activa == True)
+                    .values(fecha_actividad=bindparam('b_fecha')),
+                    [{'b_session_id': sid, 'b_fecha': fecha} for sid, fecha in latidos.items()]
+                )
+        except Exception:
+            traceback.print_exc()
+            # Devolver al búfer lo que no se escribió; gana el latido más reciente
+            with self._lock:
+                for sid, fecha in latidos.items():
+                    self._latidos[sid] = max(fecha, self._latidos.get(sid, fecha))
+            return 0
+        return len(latidos)
+
+    def _volcar_en_hilo(self):
+        from extensions import db
+        with self.app.app_context():
+            try:
+                self.volcar()
+                limpieza = self.app.config["SESIONES_LIMPIEZA_INTERVALO"]
+                if self._ultima_limpieza is None or time.monotonic() - self._ultima_limpieza >= limpieza:
+                    self._ultima_limpieza = time.monotonic()
+                    self.limpiar()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._volcando = False
+                db.session.remove()
+
+    def _al_salir(self):
+        if self.app is None:
+            return
+        try:
+            with self.app.app_context():
+                self.volcar()
+        except Exception:
+            traceback.print_exc()
+
+    # ============= RETENCIÓN =============
+
+    def limpiar(self, ahora=None):
+        """Vencer sesiones inactivas y archivar las cerradas hace más de SESIONES_RETENCION_DIAS.
+
+        Devuelve (vencidas, archivadas).
+        """
+        from extensions import db
+        from models import SesionActiva, SesionArchivada
+
+        ahora = ahora or datetime.utcnow()
+        config = self.app.config
+        tabla = SesionActiva.__table__
+        archivo = SesionArchivada.__table__
+        columnas = [c.name for c in archivo.columns]
+
+        with db.engine.begin() as conn:
+            vencidas = conn.execute(
+                update(tabla)
+                .where(tabla.c.activa == True,
+                       tabla.c.fecha_actividad < ahora - timedelta(hours=config["SESIONES_INACTIVIDAD_HORAS"]))
+                .values(activa=False)
+            ).rowcount
+
+        corte = ahora - timedelta(days=config["SESIONES_RETENCION_DIAS"])
+        archivadas = 0
+        while True:
+            # Un lote por transacción: no bloquear la tabla mientras se archiva un histórico grande
+            with db.engine.begin() as conn:
+                ids = conn.execute(
+                    select(tabla.c.id_sesion)
+                    .where(tabla.c.activa == False, tabla.c.fecha_actividad < corte)
+                    .limit(LOTE_ARCHIVO)
+                ).scalars().all()
+                if not ids:
+                    break
+                conn.execute(insert(archivo).from_select(
+                    columnas,
+                    select(*(tabla.c[nombre] for nombre in columnas)).where(tabla.c.id_sesion.in_(ids))
+                ))
+                conn.execute(delete(tabla).where(tabla.c.id_sesion.in_(ids)))
+            archivadas += len(ids)
+        return vencidas, archivadas
+
+    # ============= CONSULTA =============
+
+    def activas(self):
+        """Sesiones activas recientes con su empleado, de la más reciente a la más vieja"""
+        from extensions import db
+        from models import SesionActiva, Empleado
+
+        self.volcar()
+        desde = datetime.utcnow() - timedelta(hours=self.app.config["SESIONES_INACTIVIDAD_HORAS"])
+        return db.session.execute(
+            select(SesionActiva.id_sesion, SesionActiva.fecha_inicio, SesionActiva.fecha_actividad,
+                   SesionActiva.ip_address, SesionActiva.user_agent,
+                   Empleado.id_empleados, Empleado.nombre_empleado, Empleado.apellido_empleado,
+                   Empleado.usuario, Empleado.cargo_establecido)
+            .join(Empleado, Empleado.id_empleados == SesionActiva.id_empleados)
+            .where(SesionActiva.activa == True, SesionActiva.fecha_actividad >= desde)
+            .order_by(SesionActiva.fecha_actividad.desc())
+        ).all()
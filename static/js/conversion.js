@@ -0,0 +1,52 @@
+// conversion.js - Conversión cm ↔ galones en el navegador
+// Descarga una vez la tabla de cada tanque (/medicion/api/tabla_conversion/<id>,
+// versionada con ETag) y convierte localmente sin pedir nada por cada tecla.
+(function () {
+    const tablas = {};
+
+    function cargar(tanqueId) {
+        if (!tanqueId) return Promise.resolve(null);
+        if (!tablas[tanqueId]) {
+            tablas[tanqueId] = fetch(`/medicion/api/tabla_conversion/${tanqueId}`, {credentials: 'same-origin'})
+                .then(r => {
+                    if (!r.ok) throw new Error(`HTTP ${r.status}`);
+                    return r.json();
+                })
+                .catch(err => {
+                    console.error('Error cargando tabla de conversión:', err);
+                    delete tablas[tanqueId];
+                    return null;
+                });
+        }
+        return tablas[tanqueId];
+    }
+
+    function interpolar(xs, ys, x) {
+        if (x <= 0) return 0;
+        if (x < xs[0]) return ys[0] * x / xs[0];
+        if (x >= xs[xs.length - 1]) return ys[ys.length - 1];
+        let lo = 0, hi = xs.length - 1;
+        while (hi - lo > 1) {
+            const mid = (lo + hi) >> 1;
+            if (xs[mid] <= x) lo = mid; else hi = mid;
+        }
+        const t = (x - xs[lo]) / (xs[hi] - xs[lo]);
+        return ys[lo] + t * (ys[hi] - ys[lo]);
+    }
+
+    function aGalones(tabla, cm) {
+        const h = parseFloat(String(cm).replace(',', '.'));
+        if (!tabla || isNaN(h) || h <= 0) return 0;
+        if (tabla.tipo === 'tabla') return interpolar(tabla.alturas, tabla.galones, h);
+        return tabla.galones_por_cm * h;
+    }
+
+    function aCm(tabla, galones) {
+        const g = parseFloat(String(galones).replace(',', '.'));
+        if (!tabla || isNaN(g) || g <= 0) return 0;
+        if (tabla.tipo === 'tabla') return interpolar(tabla.galones, tabla.alturas, g);
+        return tabla.galones_por_cm > 0 ? g / tabla.galones_por_cm : 0;
+    }
+
+    window.TablaConversion = {cargar, aGalones, aCm};
+})();
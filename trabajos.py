@@ -0,0 +1,238 @@
+# trabajos.py - Trabajos en segundo plano (reportes, exportaciones, cargas)
+import json
+import multiprocessing
+import os
+import secrets
+import socket
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+ESTADOS_ACTIVOS = ('pendiente', 'en_proceso')
+_HOST = socket.gethostname()
+
+
+class GestorTrabajos:
+    """Ejecuta trabajos fuera de la petición y guarda su estado en disco.
+
+    El estado de cada trabajo es un JSON en TRABAJOS_DIR, así cualquier
+    worker de gunicorn puede responder al endpoint de estado. Los trabajos
+    de CPU (PDF) van a un pool de procesos; los que usan la BD van a un
+    pool de hilos con contexto de aplicación.
+
+    Cada estado guarda el pid y el host del worker que lo escribió, y ese
+    worker renueva la fecha del archivo mientras el trabajo corre. Un
+    trabajo activo cuyo worker murió (o que lleva ``TRABAJOS_EXPIRACION``
+    segundos sin renovarse) se reporta como "interrumpido" y se puede
+    volver a encolar.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._procesos = None
+        self._cpu = None
+        self._hilos = None
+        self._lock = threading.Lock()
+        self._en_curso = set()
+        self._latido = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("TRABAJOS_DIR", os.path.join(app.instance_path, "trabajos"))
+        app.config.setdefault("TRABAJOS_PROCESOS", 2)
+        app.config.setdefault("TRABAJOS_HILOS", 2)
+        app.config.setdefault("TRABAJOS_CPU", os.cpu_count() or 1)
+        app.config.setdefault("TRABAJOS_EXPIRACION", 900)
+        os.makedirs(app.config["TRABAJOS_DIR"], exist_ok=True)
+        self.app = app
+        app.extensions["trabajos"] = self
+
+    @property
+    def directorio(self):
+        return self.app.config["TRABAJOS_DIR"]
+
+    # ============= EJECUTORES =============
+
+    def _pool_procesos(self):
+        with self._lock:
+            if self._procesos is None:
+                # spawn: el hijo no hereda conexiones de BD ni estado del worker
+                self._procesos = ProcessPoolExecutor(
+                    max_workers=self.app.config["TRABAJOS_PROCESOS"],
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._procesos
+
+    def _pool_cpu(self):
+        # Pool aparte para cálculo puro repartido en todos los núcleos (p. ej. bcrypt)
+        with self._lock:
+            if self._cpu is None:
+                self._cpu = ProcessPoolExecutor(
+                    max_workers=self.app.config["TRABAJOS_CPU"],
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._cpu
+
+    def _pool_hilos(self):
+        with self._lock:
+            if self._hilos is None:
+                self._hilos = ThreadPoolExecutor(
+                    max_workers=self.app.config["TRABAJOS_HILOS"],
+                    thread_name_prefix="trabajo"
+                )
+            return self._hilos
+
+    # ============= ESTADO =============
+
+    def _ruta(self, trabajo_id):
+        return os.path.join(self.directorio, f"{trabajo_id}.json")
+
+    def _escribir(self, estado):
+        estado["pid"] = os.getpid()
+        estado["host"] = _HOST
+        fd, temporal = tempfile.mkstemp(dir=self.directorio)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(estado, f, default=str)
+        os.replace(temporal, self._ruta(estado["id"]))
+
+    def crear(self, tipo, trabajo_id=None, **datos):
+        """Registrar un trabajo pendiente y devolver su id"""
+        trabajo_id = trabajo_id or f"{tipo}-{secrets.token_hex(8)}"
+        ahora = datetime.utcnow().isoformat()
+        self._escribir({
+            "id": trabajo_id,
+            "tipo": tipo,
+            "estado": "pendiente",
+            "creado": ahora,
+            "actualizado": ahora,
+            **datos,
+        })
+        return trabajo_id
+
+    def estado(self, trabajo_id):
+        if not trabajo_id or not all(c.isalnum() or c in "-_" for c in trabajo_id):
+            return None
+        ruta = self._ruta(trabajo_id)
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                estado = json.load(f)
+            renovado = os.path.getmtime(ruta)
+        except (OSError, ValueError):
+            return None
+        if estado.get("estado") in ESTADOS_ACTIVOS and self._abandonado(estado, renovado):
+            estado["estado"] = "interrumpido"
+        return estado
+
+    def _abandonado(self, estado, renovado):
+        """El worker dueño del trabajo ya no existe o dejó de renovarlo"""
+        if time.time() - renovado > self.app.config["TRABAJOS_EXPIRACION"]:
+            return True
+        pid = estado.get("pid")
+        if estado.get("host") != _HOST or not pid or pid == os.getpid() or os.name == "nt":
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _seguir(self, trabajo_id):
+        """Renovar el estado de ``trabajo_id`` mientras corre en este proceso"""
+        with self._lock:
+            self._en_curso.add(trabajo_id)
+            if self._latido is None or not self._latido.is_alive():
+                self._latido = threading.Thread(target=self._renovar, name="trabajos-latido", daemon=True)
+                self._latido.start()
+
+    def _soltar(self, trabajo_id):
+        with self._lock:
+            self._en_curso.discard(trabajo_id)
+
+    def _renovar(self):
+        # Sólo la fecha del archivo: reescribir el JSON pisaría el checkpoint del trabajo
+        while True:
+            time.sleep(max(self.app.config["TRABAJOS_EXPIRACION"] / 3, 1))
+            with self._lock:
+                en_curso = list(self._en_curso)
+            for trabajo_id in en_curso:
+                try:
+                    os.utime(self._ruta(trabajo_id))
+                except OSError:
+                    pass
+
+    def actualizar(self, trabajo_id, **campos):
+        estado = self.estado(trabajo_id) or {"id": trabajo_id}
+        estado.update(campos)
+        estado["actualizado"] = datetime.utcnow().isoformat()
+        self._escribir(estado)
+        return estado
+
+    def activo(self, trabajo_id):
+        estado = self.estado(trabajo_id)
+        return bool(estado and estado.get("estado") in ESTADOS_ACTIVOS)
+
+    # ============= ENVÍO =============
+
+    def en_proceso(self, trabajo_id, funcion, *args, al_terminar=None):
+        """Ejecutar ``funcion(*args)`` en el pool de procesos (sin contexto de app)"""
+        self.actualizar(trabajo_id, estado="en_proceso")
+        self._seguir(trabajo_id)
+        futuro = self._pool_procesos().submit(funcion, *args)
+
+        def _terminado(f):
+            self._soltar(trabajo_id)
+            try:
+                resultado = f.result()
+                if al_terminar is not None:
+                    with self.app.app_context():
+                        al_terminar(resultado)
+                self.actualizar(trabajo_id, estado="completado", resultado=resultado)
+            except Exception as e:
+                traceback.print_exc()
+                self.actualizar(trabajo_id, estado="error", error=str(e))
+
+        futuro.add_done_callback(_terminado)
+        return futuro
+
+    def en_hilo(self, trabajo_id, funcion, *args, **kwargs):
+        """Ejecutar ``funcion(trabajo_id, *args)`` en un hilo con contexto de aplicación"""
+        app = self.app
+
+        def _ejecutar():
+            with app.app_context():
+                try:
+                    self.actualizar(trabajo_id, estado="en_proceso")
+                    resultado = funcion(trabajo_id, *args, **kwargs)
+                    self.actualizar(trabajo_id, estado="completado", resultado=resultado)
+                except Exception as e:
+                    traceback.print_exc()
+                    from extensions import db
+                    db.session.rollback()
+                    self.actualizar(trabajo_id, estado="error", error=str(e))
+                finally:
+                    self._soltar(trabajo_id)
+                    from extensions import db
+                    db.session.remove()
+
+        self._seguir(trabajo_id)
+        return self._pool_hilos().submit(_ejecutar)
+
+    def en_paralelo(self, funcion, lotes):
+        """Ejecutar ``funcion(*args)`` por cada tupla de ``lotes`` en el pool de CPU.
+
+        Genera (índice del lote, resultado) a medida que cada lote termina.
+        """
+        pool = self._pool_cpu()
+        futuros = {pool.submit(funcion, *args): indice for indice, args in enumerate(lotes)}
+        try:
+            for futuro in as_completed(futuros):
+                yield futuros[futuro], futuro.result()
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
@@ -53,18 +53,27 @@ def encargado_full_access(f):
     return roles_required('admin', 'encargado')(f)
 
 
-def registrar_auditoria(accion, tabla, registro_id, datos_anteriores=None, datos_nuevos=None):
-    """Registrar cambios en la auditoría"""
+def registrar_auditoria(accion, tabla, registro_id, datos_anteriores=None, datos_nuevos=None,
+                        id_empleados=None, ip_address=None):
+    """Registrar cambios en la auditoría.
+
+    Fuera de una petición (trabajos en segundo plano) se pasan id_empleados e ip_address.
+    """
     try:
-        from flask import request
+        from flask import request, has_request_context
+        if has_request_context():
+            if id_empleados is None and current_user.is_authenticated:
+                id_empleados = current_user.id_empleados
+            if ip_address is None:
+                ip_address = request.remote_addr
         auditoria = Auditoria(
-            id_empleados=current_user.id_empleados if current_user.is_authenticated else None,
+            id_empleados=id_empleados,
             accion=accion,
             tabla=tabla,
             registro_id=registro_id,
             datos_anteriores=json.dumps(datos_anteriores) if datos_anteriores else None,
             datos_nuevos=json.dumps(datos_nuevos) if datos_nuevos else None,
-            ip_address=request.remote_addr if request else None
+            ip_address=ip_address
         )
         db.session.add(auditoria)
         db.session.commit()